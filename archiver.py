@@ -0,0 +1,9 @@
+import asyncio
+
+from worker import archiver
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(archiver.run())
+    except KeyboardInterrupt:
+        print("Good night!")
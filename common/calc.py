@@ -1,7 +1,10 @@
 import collections
+import csv
+import io
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
 
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 
 from . import crud, models, schemas
@@ -128,3 +131,146 @@ def plot_update(plot_state_event: schemas.paissa.PlotStateEntry, old_state: mode
         previous_lotto_phase=old_state.lotto_phase,
         lotto_phase_until=plot_state_event.lotto_phase_until,
     )
+
+
+# ==== lottery ====
+HOUSE_SIZE_NAMES = ("SMALL", "MEDIUM", "LARGE")
+
+
+def lottery_cycle_summary(cycle: models.LotteryCycle) -> schemas.paissa.LotteryCycleSummary:
+    return schemas.paissa.LotteryCycleSummary(
+        id=cycle.id, entry_start_time=cycle.entry_start, entry_end_time=cycle.entry_end, built_time=cycle.built_at
+    )
+
+
+def lottery_cycle_detail(db: Session, cycle: models.LotteryCycle) -> schemas.paissa.LotteryCycleDetail:
+    """Gets the results of a summarized lottery cycle, with totals by world, district, and house size."""
+    results = crud.get_lottery_results(db, cycle.id)
+    aggregates = {}
+    for result in results:
+        key = (result.world_id, result.territory_type_id, result.house_size)
+        if key not in aggregates:
+            aggregates[key] = schemas.paissa.LotteryAggregate(
+                world_id=result.world_id,
+                district_id=result.territory_type_id,
+                size=result.house_size,
+                num_plots=0,
+                num_entries=0,
+                max_entries=0,
+                num_plots_without_entries=0,
+            )
+        aggregate = aggregates[key]
+        aggregate.num_plots += 1
+        aggregate.num_entries += result.lotto_entries or 0
+        aggregate.max_entries = max(aggregate.max_entries, result.lotto_entries or 0)
+        if not result.lotto_entries:
+            aggregate.num_plots_without_entries += 1
+
+    summary = lottery_cycle_summary(cycle)
+    return schemas.paissa.LotteryCycleDetail(
+        **summary.dict(),
+        num_plots=len(results),
+        aggregates=[aggregates[key] for key in sorted(aggregates)],
+        plots=[
+            schemas.paissa.LotteryPlotResult(
+                world_id=result.world_id,
+                district_id=result.territory_type_id,
+                ward_number=result.ward_number,
+                plot_number=result.plot_number,
+                size=result.house_size,
+                price=result.price,
+                lotto_entries=result.lotto_entries,
+                purchase_system=result.purchase_system,
+            )
+            for result in results
+        ],
+    )
+
+
+def lottery_cycle_csv(db: Session, cycle: models.LotteryCycle) -> str:
+    """Gets the results of a summarized lottery cycle as CSV, in the format of scripts/export_lottery_stats.sql."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(("world", "district", "ward_number", "plot_number", "house_size", "lotto_entries", "price"))
+    for result in crud.get_lottery_results(db, cycle.id):
+        writer.writerow(
+            (
+                result.world,
+                result.district,
+                result.ward_number + 1,
+                result.plot_number + 1,
+                HOUSE_SIZE_NAMES[result.house_size],
+                result.lotto_entries,
+                result.price,
+            )
+        )
+    return buf.getvalue()
+
+
+# ==== market ====
+def market_size_stats(sale_stats: List[Row], lottery_stats: List[Row]) -> List[schemas.paissa.MarketSizeStats]:
+    """Combines rows of sale and lottery stats for one world or datacenter into stats for each house size."""
+    sales = {row.house_size: row for row in sale_stats}
+    lottery = {row.house_size: row for row in lottery_stats}
+    out = []
+    for size in range(len(HOUSE_SIZE_NAMES)):
+        sale = sales.get(size)
+        lotto = lottery.get(size)
+        out.append(
+            schemas.paissa.MarketSizeStats(
+                size=size,
+                num_sales_1d=sale.num_sales_1d if sale else 0,
+                num_sales_7d=sale.num_sales_7d if sale else 0,
+                num_sales_30d=sale.num_sales_30d if sale else 0,
+                median_hours_to_sell=sale.median_hours_to_sell if sale else None,
+                num_lottery_plots=lotto.num_plots if lotto else 0,
+                num_lottery_entries=lotto.num_entries if lotto else 0,
+                num_lottery_plots_without_entries=lotto.num_plots_without_entries if lotto else 0,
+                mean_lottery_entries=lotto.num_entries / lotto.num_plots if lotto else None,
+            )
+        )
+    return out
+
+
+def market_details(
+    db: Session, now: float
+) -> Tuple[List[schemas.paissa.WorldMarket], List[schemas.paissa.DatacenterMarket]]:
+    """
+    Gets the sale velocity, time to sell, and lottery competitiveness by house size of each world and datacenter,
+    from the sales recorded in the 30 days before *now* and the latest summarized lottery cycle.
+    """
+    cycle = crud.get_latest_lottery_cycle(db)
+    by_group = {}
+    for by_datacenter in (False, True):
+        grouped = collections.defaultdict(lambda: ([], []))
+        for row in crud.get_market_sale_stats(db, by_datacenter, now):
+            grouped[row.group_id][0].append(row)
+        if cycle is not None:
+            for row in crud.get_market_lottery_stats(db, cycle.id, by_datacenter):
+                grouped[row.group_id][1].append(row)
+        by_group[by_datacenter] = grouped
+
+    worlds = sorted(crud.get_worlds(db), key=lambda w: w.id)
+    world_markets = [
+        schemas.paissa.WorldMarket(
+            id=world.id,
+            name=world.name,
+            generated_time=now,
+            lottery_cycle=cycle.id if cycle else None,
+            sizes=market_size_stats(*by_group[False][world.id]),
+        )
+        for world in worlds
+    ]
+    datacenters = {world.datacenter_id: world.datacenter_name for world in worlds}
+    datacenter_markets = [
+        schemas.paissa.DatacenterMarket(
+            id=datacenter_id,
+            name=datacenter_name,
+            generated_time=now,
+            lottery_cycle=cycle.id if cycle else None,
+            sizes=market_size_stats(*by_group[True][datacenter_id]),
+            worlds=[market for market, world in zip(world_markets, worlds) if world.datacenter_id == datacenter_id],
+        )
+        for datacenter_id, datacenter_name in sorted(datacenters.items())
+    ]
+    return world_markets, datacenter_markets
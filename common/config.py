@@ -1,4 +1,5 @@
 import os
+import socket
 import urllib.parse
 
 GAMEDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../gamedata")
@@ -7,6 +8,8 @@ JWT_ISSUER = "PaissaDB"
 JWT_AUDIENCES = ["PaissaHouse"]
 
 JWT_SECRET_PAISSAHOUSE = os.getenv("JWT_SECRET_PAISSAHOUSE")
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", 4096))  # max number of verified tokens to remember
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", 300))  # seconds to remember a verified token
 DB_URI = os.getenv("DB_URI", f"sqlite:///{SQLITE_DIR}sql_app.db")
 DB_TYPE = urllib.parse.urlparse(DB_URI).scheme.split("+")[0]
 REDIS_URI = os.getenv("REDIS_URI", "redis://localhost")
@@ -14,3 +17,52 @@ SENTRY_DSN = os.getenv("SENTRY_DSN")
 SENTRY_ENV = os.getenv("SENTRY_ENV", "development")
 
 LOGLEVEL = os.getenv("LOGLEVEL", "INFO")
+
+# profiling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # fraction of requests/events to profile, 0 to disable
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))  # seconds between stack samples
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "../_profiles"))
+
+# worker
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 0))  # 0 to disable the worker's prometheus endpoint
+# "zset": events are queued as keys in a sorted set by timestamp, with their payload in a separate key
+# "stream": events are queued with their payload in a stream read by the workers' consumer group
+EVENT_QUEUE_BACKEND = os.getenv("EVENT_QUEUE_BACKEND", "zset")
+WORKER_NAME = os.getenv("WORKER_NAME", socket.gethostname())  # stream consumer name, must be unique and stable
+WORKER_BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", 100))  # events read from the stream at once
+WORKER_CLAIM_IDLE = int(os.getenv("WORKER_CLAIM_IDLE", 60))  # seconds before a dead worker's events are reclaimed
+# seconds to hold updates that only advance a state's last_seen before writing them in bulk, 0 to write immediately
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", 0))
+
+# csv exports
+CSV_DUMP_FETCH_SIZE = int(os.getenv("CSV_DUMP_FETCH_SIZE", 10000))  # rows fetched from the server-side cursor at once
+# seconds of last_seen before the previous archive segment's high-water mark that the next segment exports again
+CSV_ARCHIVE_OVERLAP = float(os.getenv("CSV_ARCHIVE_OVERLAP", 3600))
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", 100_000))  # rows per row group of parquet exports
+
+# lottery
+LOTTERY_BUILD_DELAY = int(os.getenv("LOTTERY_BUILD_DELAY", 3600))  # seconds after an entry period ends to summarize it
+
+# market stats (see paissadb/market.py)
+MARKET_REFRESH_INTERVAL = int(os.getenv("MARKET_REFRESH_INTERVAL", 900))  # seconds between recomputing them
+
+# archiver
+ARCHIVER_NAME = os.getenv("ARCHIVER_NAME", socket.gethostname())  # must be stable across restarts of an archiver
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))
+ARCHIVE_MAX_DELIVERIES = int(os.getenv("ARCHIVE_MAX_DELIVERIES", 5))  # before an unarchivable event is dead-lettered
+
+# ingest
+INGEST_MAX_BODY_SIZE = int(os.getenv("INGEST_MAX_BODY_SIZE", 8 * 1024 * 1024))  # max decompressed /ingest/binary body
+# admission control by event queue length, 0 to disable (see crud.bulk_ingest)
+INGEST_SHED_QSIZE = int(os.getenv("INGEST_SHED_QSIZE", 50_000))  # drop ward info for wards seen in INGEST_SHED_WINDOW
+INGEST_SHED_WINDOW = int(os.getenv("INGEST_SHED_WINDOW", 300))
+INGEST_REJECT_QSIZE = int(os.getenv("INGEST_REJECT_QSIZE", 200_000))  # reject all ingest requests with a 503
+INGEST_RETRY_AFTER = int(os.getenv("INGEST_RETRY_AFTER", 60))
+
+# rate limits (see paissadb/ratelimit.py): average requests per second and burst size, a rate of 0 disables the limit
+RATELIMIT_INGEST_RATE = float(os.getenv("RATELIMIT_INGEST_RATE", 2))  # per sweeper, on /ingest and /ingest/binary
+RATELIMIT_INGEST_BURST = int(os.getenv("RATELIMIT_INGEST_BURST", 10))
+RATELIMIT_HELLO_RATE = float(os.getenv("RATELIMIT_HELLO_RATE", 0.1))  # per IP
+RATELIMIT_HELLO_BURST = int(os.getenv("RATELIMIT_HELLO_BURST", 5))
+RATELIMIT_WS_RATE = float(os.getenv("RATELIMIT_WS_RATE", 0.2))  # per IP, for connections without a token
+RATELIMIT_WS_BURST = int(os.getenv("RATELIMIT_WS_BURST", 10))
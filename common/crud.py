@@ -3,15 +3,26 @@ import json
 import logging
 import struct
 import time
-from typing import Iterator, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import redis.asyncio as redis_lib
-from sqlalchemy import desc, text, update
+from sqlalchemy import desc, func, insert, text, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from . import models, schemas, utils
-from .database import EVENT_QUEUE_KEY, TTL_ONE_HOUR, redis
+from . import config, eventcodec, models, plotkey, schemas
+from .database import (
+    ARCHIVE_STREAM_KEY,
+    EVENT_QUEUE_KEY,
+    EVENT_STREAM_KEY,
+    FRESHNESS_WORLDS_KEY,
+    TTL_ONE_HOUR,
+    WARD_FINGERPRINT_KEY_PREFIX,
+    WARD_RECENT_KEY_PREFIX,
+    redis,
+)
 
 log = logging.getLogger(__name__)
 
@@ -62,14 +73,13 @@ def historical_plot_state(
     yield_per: int = 10,
 ) -> Iterator[models.PlotState]:
     q = db.query(models.PlotState).filter(
-        models.PlotState.world_id == world_id,
-        models.PlotState.territory_type_id == district_id,
-        models.PlotState.ward_number == ward_number,
-        models.PlotState.plot_number == plot_number,
+        models.PlotState.plot_key == plotkey.encode(world_id, district_id, ward_number, plot_number)
     )
     if before is not None:
-        q = q.filter(models.PlotState.last_seen <= before)
-    return q.order_by(desc(models.PlotState.last_seen)).yield_per(yield_per)
+        # first_seen <= last_seen, so the first_seen bound is redundant but lets postgres skip later partitions
+        q = q.filter(models.PlotState.last_seen <= before, models.PlotState.first_seen <= before)
+    # a plot's states never overlap in time, so this orders them the same as last_seen would (but uses the index)
+    return q.order_by(desc(models.PlotState.first_seen)).yield_per(yield_per)
 
 
 def last_state_transition(
@@ -146,20 +156,78 @@ def latest_plot_states_in_district(db: Session, world_id: int, district_id: int)
     Gets the latest plot states in the district.
     """
     query = """
-    SELECT DISTINCT ON (ward_number, ps.plot_number) ps.*,
+    SELECT DISTINCT ON (ps.plot_key) ps.*,
+        h.last_seen,
+        h.last_seen_price,
+        h.lotto_entries,
+        h.lotto_phase,
+        h.lotto_phase_until,
         p.house_size,
         p.house_base_price
     FROM plot_states ps
+        JOIN plot_states_hot h ON h.state_id = ps.id AND h.first_seen = ps.first_seen
         JOIN plotinfo p ON ps.territory_type_id = p.territory_type_id AND ps.plot_number = p.plot_number
-    WHERE ps.world_id = :world_id
-      AND ps.territory_type_id = :district_id
-    ORDER BY ward_number, ps.plot_number, last_seen DESC;
+    WHERE ps.plot_key BETWEEN :start AND :end
+    ORDER BY ps.plot_key, ps.first_seen DESC;
     """
-    stmt = text(query).bindparams(world_id=world_id, district_id=district_id)
+    start, end = plotkey.district_range(world_id, district_id)
+    stmt = text(query).bindparams(start=start, end=end)
     result = db.execute(stmt)
     return [_row_to_plotstate(row) for row in result]
 
 
+def bump_ward_last_seen(db: Session, ward_key: int, source_timestamp: float, timestamp: float) -> int:
+    """
+    Sets the last_seen of the latest state of each plot in the ward (see common.plotkey) to *timestamp*, for a ward that
+    was seen unchanged since the sweep at *source_timestamp*.
+    Only states that the worker has already brought up to date with that sweep (last_seen >= source_timestamp) are
+    bumped: events are not necessarily processed in timestamp order (several workers, or the stream queue backend), and
+    bumping a state past a change that is still queued would make the worker discard the change as out of date.
+    Like update_historical_state_from, lottery states are not bumped before their phase ends.
+    The latest states are found with MAX rather than DISTINCT ON so that this also runs on sqlite.
+    Returns the number of states updated.
+    """
+    query = """
+    UPDATE plot_states_hot
+    SET last_seen = :timestamp
+    WHERE (state_id, first_seen) IN (SELECT id, first_seen
+                                     FROM plot_states
+                                     WHERE (plot_key, first_seen) IN (SELECT plot_key, MAX(first_seen)
+                                                                      FROM plot_states
+                                                                      WHERE plot_key BETWEEN :start AND :end
+                                                                      GROUP BY plot_key))
+      AND last_seen < :timestamp
+      AND last_seen >= :source_timestamp
+      AND (lotto_phase_until IS NULL OR lotto_phase_until < :timestamp);
+    """
+    start, end = plotkey.ward_range(ward_key)
+    stmt = text(query).bindparams(start=start, end=end, source_timestamp=source_timestamp, timestamp=timestamp)
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
+
+def bulk_bump_last_seen(db: Session, states: Dict[Tuple[int, float], float]) -> int:
+    """
+    Advances the last_seen of many states at once, given as a mapping of (id, first_seen) to last_seen. A state's
+    last_seen is never moved back. Returns the number of states updated.
+    """
+    query = """
+    UPDATE plot_states_hot h
+    SET last_seen = v.last_seen
+    FROM UNNEST(:ids, :first_seens, :last_seens) AS v(id, first_seen, last_seen)
+    WHERE h.state_id = v.id
+      AND h.first_seen = v.first_seen
+      AND h.last_seen < v.last_seen;
+    """
+    ids = [state_id for state_id, _ in states]
+    first_seens = [first_seen for _, first_seen in states]
+    stmt = text(query).bindparams(ids=ids, first_seens=first_seens, last_seens=list(states.values()))
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
+
 def _row_to_plotstate(row):
     return models.PlotState(
         id=row.id,
@@ -185,6 +253,184 @@ def _row_to_plotstate(row):
     )
 
 
+# ==== sales ====
+def record_plot_sale(
+    db: Session, first_sold_state: models.PlotState, last_open_state: models.PlotState
+) -> models.PlotSale:
+    """
+    Records the sale of a plot, given the pair of states it sold between, in the current transaction. Whether the sale
+    was a relocation is left to be determined offline.
+    """
+    first_open_state, last_sold_state = last_state_transition(db, last_open_state)
+    sale = models.PlotSale(
+        world_id=last_open_state.world_id,
+        territory_type_id=last_open_state.territory_type_id,
+        ward_number=last_open_state.ward_number,
+        plot_number=last_open_state.plot_number,
+        plot_key=last_open_state.plot_key,
+        time_open_min=last_sold_state.last_seen if last_sold_state is not None else 0,
+        time_open_max=first_open_state.first_seen,
+        time_sold_min=last_open_state.last_seen,
+        time_sold_max=first_sold_state.first_seen,
+        known_price=last_open_state.last_seen_price or last_open_state.plot_info.house_base_price,
+        purchase_system=last_open_state.purchase_system,
+        last_presale_state_id=last_open_state.id,
+    )
+    db.add(sale)
+    return sale
+
+
+def get_earliest_plot_sale_time(db: Session) -> Optional[float]:
+    """Returns the earliest time_sold_max of a recorded sale, or None if there are none."""
+    return db.query(func.min(models.PlotSale.time_sold_max)).scalar()
+
+
+def backfill_plot_sales(db: Session, sales: List[dict]):
+    """Inserts sales found offline (as dicts of PlotSale columns), skipping any that are already recorded."""
+    if not sales:
+        return
+    stmt = postgresql.insert(models.PlotSale).on_conflict_do_nothing(
+        index_elements=[models.PlotSale.last_presale_state_id]
+    )
+    db.execute(stmt, sales)  # executemany, which psycopg2 batches into multi-row inserts
+    db.commit()
+
+
+# ==== freshness ====
+async def get_world_freshness() -> List[schemas.paissa.WorldFreshness]:
+    """Gets the freshness summary of each world as last published by the worker, ordered by world ID."""
+    data = await redis.hgetall(FRESHNESS_WORLDS_KEY)
+    return [schemas.paissa.WorldFreshness.parse_raw(v) for _, v in sorted(data.items(), key=lambda i: int(i[0]))]
+
+
+# ==== lottery ====
+def lottery_cycle_times(cycle: int) -> Tuple[float, float]:
+    """Returns the (start, end) of the entry period of a lottery cycle, given its number."""
+    entry_end = cycle * LOTTO_CYCLE + CYCLE_ENTRY_END_OFFSET
+    return entry_end - ENTRY_TIME, entry_end
+
+
+def last_ended_lottery_cycle(now: float = None) -> int:
+    """Returns the number of the latest lottery cycle whose entry period has ended."""
+    if now is None:
+        now = time.time()
+    return int((now - CYCLE_ENTRY_END_OFFSET) // LOTTO_CYCLE)
+
+
+def build_lottery_cycle(db: Session, cycle: int) -> int:
+    """
+    Summarizes the results of a lottery cycle into lottery_results: the last open state of each lottery plot seen
+    during (or with a phase ending at the end of) the cycle's entry period, with its final entry count. Replaces any
+    earlier summary of the cycle. Returns the number of plots.
+    """
+    entry_start, entry_end = lottery_cycle_times(cycle)
+    query = """
+    INSERT INTO lottery_results (cycle_id, plot_key, world_id, territory_type_id, ward_number, plot_number, house_size,
+                                 price, lotto_entries, purchase_system)
+    SELECT DISTINCT ON (s.plot_key) :cycle,
+                                    s.plot_key,
+                                    s.world_id,
+                                    s.territory_type_id,
+                                    s.ward_number,
+                                    s.plot_number,
+                                    p.house_size,
+                                    h.last_seen_price,
+                                    -- sometimes it shows there being entries on unavailable plots
+                                    CASE WHEN h.lotto_phase = 3 THEN 0 ELSE h.lotto_entries END,
+                                    s.purchase_system
+    FROM plot_states s
+             JOIN plot_states_hot h ON h.state_id = s.id AND h.first_seen = s.first_seen
+             JOIN plotinfo p ON s.territory_type_id = p.territory_type_id AND s.plot_number = p.plot_number
+    WHERE (h.lotto_phase_until = :entry_end OR (h.last_seen >= :entry_start AND s.first_seen < :entry_end))
+      AND s.is_owned = FALSE
+      AND s.purchase_system & 1 = 1
+    ORDER BY s.plot_key, h.last_seen DESC;
+    """
+    db.query(models.LotteryCycle).filter(models.LotteryCycle.id == cycle).delete()
+    db.add(models.LotteryCycle(id=cycle, entry_start=entry_start, entry_end=entry_end, built_at=time.time()))
+    db.flush()
+    stmt = text(query).bindparams(cycle=cycle, entry_start=entry_start, entry_end=entry_end)
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
+
+def get_lottery_cycles(db: Session) -> List[models.LotteryCycle]:
+    return db.query(models.LotteryCycle).order_by(desc(models.LotteryCycle.id)).all()
+
+
+def get_lottery_cycle(db: Session, cycle: int) -> Optional[models.LotteryCycle]:
+    return db.query(models.LotteryCycle).filter(models.LotteryCycle.id == cycle).first()
+
+
+def get_lottery_results(db: Session, cycle: int) -> List[Row]:
+    """Returns the summarized results of a lottery cycle with world and district names, most entries first."""
+    query = """
+    SELECT r.*,
+           w.name AS world,
+           d.name AS district
+    FROM lottery_results r
+             LEFT JOIN worlds w ON w.id = r.world_id
+             LEFT JOIN districts d ON d.id = r.territory_type_id
+    WHERE r.cycle_id = :cycle
+    ORDER BY r.lotto_entries DESC NULLS LAST, r.plot_key;
+    """
+    stmt = text(query).bindparams(cycle=cycle)
+    return db.execute(stmt).all()
+
+
+def get_latest_lottery_cycle(db: Session) -> Optional[models.LotteryCycle]:
+    return db.query(models.LotteryCycle).order_by(desc(models.LotteryCycle.id)).first()
+
+
+# ==== market ====
+MARKET_SALES_WINDOWS = (24 * 60 * 60, 7 * 24 * 60 * 60, 30 * 24 * 60 * 60)  # the rolling windows sales are counted in
+
+
+def get_market_sale_stats(db: Session, by_datacenter: bool, now: float) -> List[Row]:
+    """
+    Returns the number of sales in each of MARKET_SALES_WINDOWS before *now* by world (or datacenter) and house size,
+    with the median hours to sell of the first-come first-served sales in the longest window whose open time is known
+    (midpoint to midpoint of the bounds).
+    """
+    day, week, month = MARKET_SALES_WINDOWS
+    query = f"""
+    SELECT {"w.datacenter_id" if by_datacenter else "w.id"}                             AS group_id,
+           p.house_size                                                                   AS house_size,
+           COUNT(*) FILTER (WHERE s.time_sold_max >= :day)                                AS num_sales_1d,
+           COUNT(*) FILTER (WHERE s.time_sold_max >= :week)                               AS num_sales_7d,
+           COUNT(*)                                                                       AS num_sales_30d,
+           PERCENTILE_CONT(0.5) WITHIN GROUP (
+               ORDER BY (s.time_sold_min + s.time_sold_max - s.time_open_min - s.time_open_max) / 7200
+               ) FILTER (WHERE s.time_open_min > 0 AND s.purchase_system & 1 = 0)         AS median_hours_to_sell
+    FROM plot_sales s
+             JOIN worlds w ON w.id = s.world_id
+             JOIN plotinfo p ON s.territory_type_id = p.territory_type_id AND s.plot_number = p.plot_number
+    WHERE s.time_sold_max >= :month
+      AND s.time_sold_max < :now
+    GROUP BY 1, 2;
+    """
+    stmt = text(query).bindparams(day=now - day, week=now - week, month=now - month, now=now)
+    return db.execute(stmt).all()
+
+
+def get_market_lottery_stats(db: Session, cycle: int, by_datacenter: bool) -> List[Row]:
+    """Returns the number of plots and entries in a summarized lottery cycle by world (or datacenter) and house size."""
+    query = f"""
+    SELECT {"w.datacenter_id" if by_datacenter else "w.id"}             AS group_id,
+           r.house_size                                                  AS house_size,
+           COUNT(*)                                                      AS num_plots,
+           COALESCE(SUM(r.lotto_entries), 0)                             AS num_entries,
+           COUNT(*) FILTER (WHERE COALESCE(r.lotto_entries, 0) = 0)      AS num_plots_without_entries
+    FROM lottery_results r
+             JOIN worlds w ON w.id = r.world_id
+    WHERE r.cycle_id = :cycle
+    GROUP BY 1, 2;
+    """
+    stmt = text(query).bindparams(cycle=cycle)
+    return db.execute(stmt).all()
+
+
 # ==== csv ====
 # def last_entry_cycle_entries(db: Session) -> List[Row]:
 #     entry_end_time = ((time.time() - CYCLE_ENTRY_END_OFFSET) // LOTTO_CYCLE) * LOTTO_CYCLE + CYCLE_ENTRY_END_OFFSET
@@ -213,9 +459,8 @@ def _row_to_plotstate(row):
 #     return result.all()
 
 
-def do_csv_state_dump(db: Session) -> Iterator[Row]:
-    query = """
-        SELECT s.id                                   AS id,
+CSV_STATE_QUERY = """
+    SELECT s.id                                   AS id,
            w.name                                 AS world,
            d.name                                 AS district,
            ward_number + 1                        AS ward_number,
@@ -224,36 +469,92 @@ def do_csv_state_dump(db: Session) -> Iterator[Row]:
                WHEN 0 THEN 'SMALL'
                WHEN 1 THEN 'MEDIUM'
                WHEN 2 THEN 'LARGE' END            AS house_size,
-           s.lotto_entries                        AS lotto_entries,
-           s.last_seen_price                      AS price,
+           h.lotto_entries                        AS lotto_entries,
+           h.last_seen_price                      AS price,
            s.first_seen                           AS first_seen,
-           s.last_seen                            AS last_seen,
+           h.last_seen                            AS last_seen,
            s.is_owned                             AS is_owned,
            s.purchase_system                      AS purchase_system,
            MD5(s.owner_name)                      AS owner_name_hash,
            s.owner_name LIKE '% %'                AS owner_name_has_space,
            LENGTH(s.owner_name)                   AS owner_name_len,
            s.owner_name ~ '[A-Z][a-z] [A-Z][a-z]' AS possible_character_name,
-           s.lotto_phase                          AS lotto_phase,
-           s.lotto_phase_until                    AS lotto_phase_until
+           h.lotto_phase                          AS lotto_phase,
+           h.lotto_phase_until                    AS lotto_phase_until
     FROM plot_states s
+             JOIN plot_states_hot h ON h.state_id = s.id AND h.first_seen = s.first_seen
              LEFT JOIN plotinfo p ON s.territory_type_id = p.territory_type_id AND s.plot_number = p.plot_number
              LEFT JOIN districts d ON d.id = s.territory_type_id
              LEFT JOIN worlds w ON w.id = s.world_id
-    ORDER BY id DESC;
+"""
+
+
+def do_csv_state_dump(db: Session, fetch_size: int = 10000) -> Iterator[Row]:
     """
-    stmt = text(query)
-    return db.execute(stmt)
+    Returns every plot state, newest first. The rows are streamed through a server-side cursor, *fetch_size* at a time,
+    so iterating over all of them does not buffer the whole table in memory.
+    """
+    stmt = text(f"{CSV_STATE_QUERY} ORDER BY id DESC")
+    return db.execute(stmt, execution_options={"stream_results": True}).yield_per(fetch_size)
+
+
+def get_csv_high_water_mark(db: Session) -> Tuple[int, float]:
+    """Returns the highest state ID and last_seen in the database, (0, 0) if there are no states."""
+    stmt = text("SELECT COALESCE(MAX(state_id), 0), COALESCE(MAX(last_seen), 0) FROM plot_states_hot")
+    return tuple(db.execute(stmt).one())
+
+
+def do_csv_state_delta(
+    db: Session,
+    after: Tuple[int, float],
+    until: Tuple[int, float],
+    fetch_size: int = 10000,
+) -> Iterator[Row]:
+    """
+    Returns the plot states that were created or last seen since the (id, last_seen) high-water mark *after*, up to
+    and including *until*, oldest first. Streamed like do_csv_state_dump.
+    """
+    query = f"""{CSV_STATE_QUERY}
+    WHERE (h.state_id > :after_id OR h.last_seen > :after_last_seen)
+      AND h.state_id <= :until_id
+      AND h.last_seen <= :until_last_seen
+    ORDER BY id
+    """
+    stmt = text(query).bindparams(
+        after_id=after[0], after_last_seen=after[1], until_id=until[0], until_last_seen=until[1]
+    )
+    return db.execute(stmt, execution_options={"stream_results": True}).yield_per(fetch_size)
 
 
 # ==== ingest ====
-DATUM_KEY_STRUCT = struct.Struct("!IIHH32s")  # world: u32, district: u32, ward: u16, plot: u16, ownername: char[32]
+DATUM_KEY_STRUCT = struct.Struct("!Q32s")  # plot key: u64, ownername: char[32]
+
+
+class IngestRejected(Exception):
+    """Raised by bulk_ingest when the event queue is too long to accept any more data."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Ingest is temporarily disabled, retry after {retry_after} seconds")
+        self.retry_after = retry_after
 
 
-async def bulk_ingest(db: Session, data: List[schemas.ffxiv.BaseFFXIVPacket], sweeper: schemas.paissa.JWTSweeper):
+async def bulk_ingest(data: List[schemas.lite.Packet], sweeper: schemas.paissa.JWTSweeper, queue_size: int = 0) -> int:
+    """
+    Queues a batch of packets for the worker and the archiver. Returns the number of packets queued.
+
+    Admission control, based on the current length of the event queue (*queue_size*): past INGEST_SHED_QSIZE, ward
+    info packets for a ward that was already accepted in the last INGEST_SHED_WINDOW seconds are dropped, and past
+    INGEST_REJECT_QSIZE, the whole batch is rejected with IngestRejected.
+    """
+    if config.INGEST_REJECT_QSIZE and queue_size >= config.INGEST_REJECT_QSIZE:
+        raise IngestRejected(config.INGEST_RETRY_AFTER)
+    shedding = bool(config.INGEST_SHED_QSIZE) and queue_size >= config.INGEST_SHED_QSIZE
+
     sweeper_id = sweeper.cid if sweeper is not None else None
     pipeline = redis.pipeline(transaction=True)
     now = time.time()
+    ward_state = await _get_ward_state(data, shedding)
+    queued = 0
 
     for datum in data:
         if datum.timestamp > (now + 10):
@@ -263,39 +564,60 @@ async def bulk_ingest(db: Session, data: List[schemas.ffxiv.BaseFFXIVPacket], sw
             )
             continue
         # add to redis - switch on event type
-        if isinstance(datum, schemas.ffxiv.HousingWardInfo):
+        if datum.event_type == models.EventType.HOUSING_WARD_INFO:
             if datum.LandIdent.WorldId == 0:  # sometimes the server is borked and sends us fully null data
                 continue
-            await _ingest_wardinfo(pipeline, datum)
-        elif isinstance(datum, schemas.ffxiv.LotteryInfo):
+            if not await _ingest_wardinfo(pipeline, datum, ward_state, shedding):
+                continue
+        elif datum.event_type == models.EventType.LOTTERY_INFO:
             await _ingest_lotteryinfo(pipeline, datum)
         else:
             raise ValueError(f"Unknown event type: {datum.event_type}")
 
-        # add to postgres
-        db_event = models.Event(
-            sweeper_id=sweeper_id,
-            timestamp=datum.timestamp,
-            event_type=datum.event_type,
-            data=datum.json().replace("\x00", ""),  # remove any null bytes that might sneak in somehow
-        )
-        db.add(db_event)
+        # queue for archival to postgres (worker.archiver)
+        await _queue_archive_event(pipeline, datum, sweeper_id)
+        queued += 1
     await pipeline.execute()
-    await utils.executor(db.commit)
+    return queued
 
 
 # --- wardinfo ---
-async def _ingest_wardinfo(pipeline: redis_lib.client.Pipeline, wardinfo: schemas.ffxiv.HousingWardInfo):
+async def _ingest_wardinfo(
+    pipeline: redis_lib.client.Pipeline,
+    wardinfo: schemas.ffxiv.HousingWardInfo,
+    ward_state: Dict[str, str],
+    shedding: bool = False,
+) -> bool:
+    """Queues a ward info packet. Returns False if it was dropped by admission control."""
     world_id = wardinfo.LandIdent.WorldId
     district_id = wardinfo.LandIdent.TerritoryTypeId
     ward_num = wardinfo.LandIdent.WardNumber
+    ward_key = plotkey.encode(world_id, district_id, ward_num)
     server_timestamp = wardinfo.server_timestamp
+
+    if shedding:
+        recent_key = ward_recent_key(ward_key)
+        if recent_key in ward_state:
+            return False
+        ward_state[recent_key] = "1"
+        await pipeline.set(recent_key, 1, ex=config.INGEST_SHED_WINDOW)
+
+    # if nothing in the ward changed since the last sweep, all the worker has to do is bump last_seen
+    fingerprint_key = ward_fingerprint_key(ward_key)
+    fingerprint = ward_fingerprint(wardinfo)
+    stored_fingerprint, source_timestamp = parse_ward_fingerprint(ward_state.get(fingerprint_key))
+    if stored_fingerprint == fingerprint:
+        heartbeat_key = ward_heartbeat_key(ward_key, source_timestamp, server_timestamp)
+        await _queue_event(pipeline, heartbeat_key, server_timestamp)
+        return True
+    stored = f"{fingerprint}:{server_timestamp!r}"
+    ward_state[fingerprint_key] = stored
+    await pipeline.set(fingerprint_key, stored, ex=TTL_ONE_HOUR)
+
     for plot_num, plot in enumerate(wardinfo.HouseInfoEntries):
         is_owned = bool(plot.InfoFlags & schemas.ffxiv.HousingFlags.PlotOwned)
         owner_name = plot.EstateOwnerName if is_owned else ""
-        key_data = DATUM_KEY_STRUCT.pack(world_id, district_id, ward_num, plot_num, owner_name.encode())
-        hashed = hashlib.sha256(key_data).hexdigest()
-        plot_data_key = f"event.wardinfo.plot:{hashed}"
+        key_data = DATUM_KEY_STRUCT.pack(ward_key | plot_num, owner_name.encode())
         purchase_system = ffxiv_purchase_info_to_paissa(wardinfo.PurchaseType, wardinfo.TenantType)
         # using pydantic here is really slow so we just make the dict ourselves
         state_entry = dict(
@@ -313,8 +635,8 @@ async def _ingest_wardinfo(pipeline: redis_lib.client.Pipeline, wardinfo: schema
             lotto_phase_until=None,
         )
 
-        await pipeline.set(plot_data_key, json.dumps(state_entry), nx=True, ex=TTL_ONE_HOUR)
-        await pipeline.zadd(EVENT_QUEUE_KEY, {plot_data_key: server_timestamp}, nx=True)
+        await _queue_plot_event(pipeline, WARDINFO_EVENT_PREFIX, key_data, state_entry, server_timestamp)
+    return True
 
 
 # --- lotteryinfo ---
@@ -323,9 +645,10 @@ async def _ingest_lotteryinfo(pipeline: redis_lib.client.Pipeline, lotteryinfo:
     district_id = lotteryinfo.DistrictId
     ward_num = lotteryinfo.WardId
     plot_num = lotteryinfo.PlotId
-    key_data = DATUM_KEY_STRUCT.pack(world_id, district_id, ward_num, plot_num, bytes())
-    hashed = hashlib.sha256(key_data).hexdigest()
-    plot_data_key = f"event.lotteryinfo.plot:{hashed}"
+    plot_key = plotkey.encode(world_id, district_id, ward_num, plot_num)
+    key_data = DATUM_KEY_STRUCT.pack(plot_key, bytes())
+    # this may change the plot's purchase system, so the next sweep of the ward must be processed in full
+    await pipeline.delete(ward_fingerprint_key(plotkey.ward_of(plot_key)))
     purchase_system = ffxiv_purchase_info_to_paissa(lotteryinfo.PurchaseType, lotteryinfo.TenantType)
     state_entry = dict(
         world_id=world_id,
@@ -342,8 +665,150 @@ async def _ingest_lotteryinfo(pipeline: redis_lib.client.Pipeline, lotteryinfo:
         lotto_phase_until=lotteryinfo.PhaseEndsAt,
     )
 
-    await pipeline.set(plot_data_key, json.dumps(state_entry), nx=True, ex=TTL_ONE_HOUR)
-    await pipeline.zadd(EVENT_QUEUE_KEY, {plot_data_key: lotteryinfo.client_timestamp}, nx=True)
+    await _queue_plot_event(pipeline, LOTTERYINFO_EVENT_PREFIX, key_data, state_entry, lotteryinfo.client_timestamp)
+
+
+# --- event queue ---
+WARDINFO_EVENT_PREFIX = "event.wardinfo.plot"
+LOTTERYINFO_EVENT_PREFIX = "event.lotteryinfo.plot"
+
+
+async def _queue_plot_event(
+    pipeline: redis_lib.client.Pipeline, prefix: str, key_data: bytes, state_entry: dict, timestamp: float
+):
+    """
+    Queues a plot state event for the worker on the configured queue backend (EVENT_QUEUE_BACKEND):
+    - zset: the payload is stored under a key derived from *key_data* (so that a duplicate event is only queued once
+      while the first is pending), and the key is added to the event sorted set scored by the event's timestamp
+    - stream: the payload is appended to the event stream with the key prefix, in a single XADD
+    """
+    payload = json.dumps(state_entry)
+    if config.EVENT_QUEUE_BACKEND == "stream":
+        await pipeline.xadd(EVENT_STREAM_KEY, {"key": prefix, "data": payload})
+        return
+    plot_data_key = f"{prefix}:{hashlib.sha256(key_data).hexdigest()}"
+    await pipeline.set(plot_data_key, payload, nx=True, ex=TTL_ONE_HOUR)
+    await pipeline.zadd(EVENT_QUEUE_KEY, {plot_data_key: timestamp}, nx=True)
+
+
+async def _queue_event(pipeline: redis_lib.client.Pipeline, key: str, timestamp: float):
+    """Queues an event whose key is its whole payload (e.g. a ward heartbeat)."""
+    if config.EVENT_QUEUE_BACKEND == "stream":
+        await pipeline.xadd(EVENT_STREAM_KEY, {"key": key})
+    else:
+        await pipeline.zadd(EVENT_QUEUE_KEY, {key: timestamp}, nx=True)
+
+
+async def get_event_queue_size() -> int:
+    """The number of events waiting for (or being processed by) the worker."""
+    if config.EVENT_QUEUE_BACKEND == "stream":
+        return await redis.xlen(EVENT_STREAM_KEY)
+    return await redis.zcard(EVENT_QUEUE_KEY)
+
+
+# --- ward fingerprints ---
+WARD_HEARTBEAT_KEY_PREFIX = "event.wardheartbeat"
+
+
+def ward_fingerprint_key(ward_key: int) -> str:
+    return f"{WARD_FINGERPRINT_KEY_PREFIX}:{ward_key}"
+
+
+def ward_fingerprint(wardinfo: schemas.ffxiv.HousingWardInfo) -> str:
+    """A hash of everything in a ward info packet that the worker reads when building plot states."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(bytes((wardinfo.PurchaseType, wardinfo.TenantType)))
+    for plot in wardinfo.HouseInfoEntries:
+        # as text, so that no value can be out of range (or collide with another by overflowing a fixed width)
+        h.update(f"{plot.HousePrice}:{int(plot.InfoFlags)}:{plot.EstateOwnerName}\0".encode())
+    return h.hexdigest()
+
+
+def parse_ward_fingerprint(value: Optional[str]) -> Tuple[Optional[str], float]:
+    """
+    Returns the (fingerprint, timestamp of the sweep it was taken from) of a stored ward fingerprint, or (None, 0) if
+    there is none (or it was stored before it carried its timestamp).
+    """
+    if value is None or ":" not in value:
+        return None, 0
+    fingerprint, source_timestamp = value.split(":")
+    return fingerprint, float(source_timestamp)
+
+
+def ward_heartbeat_key(ward_key: int, source_timestamp: float, timestamp: float) -> str:
+    """
+    The event queue member that means that a ward was seen at *timestamp* unchanged since the sweep at
+    *source_timestamp* (the one its fingerprint was taken from).
+    """
+    return f"{WARD_HEARTBEAT_KEY_PREFIX}:{ward_key}:{source_timestamp!r}:{timestamp!r}"
+
+
+def parse_ward_heartbeat_key(key: str) -> Tuple[int, float, float]:
+    """Returns the (ward_key, source_timestamp, timestamp) of a ward heartbeat event."""
+    _, ward_key, *timestamps = key.split(":")
+    if len(timestamps) == 1:  # queued before heartbeats carried their source timestamp
+        return int(ward_key), 0, float(timestamps[0])
+    source_timestamp, timestamp = timestamps
+    return int(ward_key), float(source_timestamp), float(timestamp)
+
+
+def ward_recent_key(ward_key: int) -> str:
+    """Exists while a ward info packet for the ward was accepted in the last INGEST_SHED_WINDOW seconds of shedding."""
+    return f"{WARD_RECENT_KEY_PREFIX}:{ward_key}"
+
+
+async def _get_ward_state(data: List[schemas.ffxiv.BaseFFXIVPacket], shedding: bool) -> Dict[str, str]:
+    """
+    Fetches the stored fingerprints (and if *shedding*, the recently accepted markers) of all wards in a batch of
+    packets in one round trip.
+    """
+    keys = set()
+    for d in data:
+        if d.event_type != models.EventType.HOUSING_WARD_INFO:
+            continue
+        ward_key = plotkey.encode(d.LandIdent.WorldId, d.LandIdent.TerritoryTypeId, d.LandIdent.WardNumber)
+        keys.add(ward_fingerprint_key(ward_key))
+        if shedding:
+            keys.add(ward_recent_key(ward_key))
+    keys = list(keys)
+    if not keys:
+        return {}
+    return {k: v for k, v in zip(keys, await redis.mget(keys)) if v is not None}
+
+
+# --- archive ---
+async def _queue_archive_event(
+    pipeline: redis_lib.client.Pipeline, datum: schemas.ffxiv.BaseFFXIVPacket, sweeper_id: Optional[int]
+):
+    entry = {
+        "sweeper_id": sweeper_id if sweeper_id is not None else "",
+        "timestamp": datum.timestamp,
+        "event_type": datum.event_type.value,
+        "packed": eventcodec.encode(datum),
+    }
+    await pipeline.xadd(ARCHIVE_STREAM_KEY, entry)
+
+
+def archive_events(db: Session, events: List[dict]):
+    """Inserts a batch of events (dicts of Event columns) into the events table in one multi-row insert."""
+    db.execute(insert(models.Event), events)
+    db.commit()
+
+
+def archive_event(db: Session, event: dict):
+    """
+    Inserts a single event (a dict of Event columns). If its sweeper is unknown (e.g. a client that never sent /hello),
+    the event is inserted without one.
+    """
+    try:
+        db.execute(insert(models.Event), event)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        if event["sweeper_id"] is None:
+            raise
+        db.execute(insert(models.Event), {**event, "sweeper_id": None})
+        db.commit()
 
 
 # --- helpers ---
@@ -0,0 +1,162 @@
+"""
+The CSV exports of plot_states.
+
+The full dump served by /csv/dump is written by ``python maintenance.py csv-dump``, which the API runs as a subprocess
+so that a dump taking minutes does not hold an API worker's memory or GIL. Rows are streamed from a server-side cursor
+and written through gzip as they arrive, into a temporary file that is only renamed into place once complete.
+
+The archive served under /csv/archive/states is built incrementally by ``python maintenance.py csv-archive`` (e.g.
+daily): each run writes a segment holding only the states created or last seen since the previous segment's (id,
+last_seen) high-water mark, and lists it in ``manifest.json``. The first segment holds every state. A state that
+changes after it was exported appears again in a later segment, so the current version of a state is its row in the
+latest segment it appears in. If pyarrow is installed, each segment is also written as Parquet (see
+parquetexport.py), in the same pass over the rows.
+"""
+import contextlib
+import csv
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from . import config, crud, parquetexport
+from .utils import REPO_ROOT
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_DIR = REPO_ROOT / "_csv_archive" / "states"
+MANIFEST_VERSION = 1
+
+DUMP_FIELDS = (
+    "id",
+    "world",
+    "district",
+    "ward_number",
+    "plot_number",
+    "house_size",
+    "lotto_entries",
+    "price",
+    "first_seen",
+    "last_seen",
+    "is_owned",
+    "purchase_system",
+    "owner_name_hash",
+    "owner_name_has_space",
+    "owner_name_len",
+    "possible_character_name",
+    "lotto_phase",
+    "lotto_phase_until",
+)
+
+
+def write_state_dump(db: Session, fp: Path, fetch_size: int = config.CSV_DUMP_FETCH_SIZE) -> int:
+    """Writes every plot state to *fp* as gzipped CSV. Returns the number of rows written."""
+    written = _write_csv(fp, crud.do_csv_state_dump(db, fetch_size).partitions())
+    log.info(f"Dumped {written} states to {fp}")
+    return written
+
+
+def write_archive_segment(
+    db: Session,
+    archive_dir: Path = ARCHIVE_DIR,
+    overlap: float = config.CSV_ARCHIVE_OVERLAP,
+    fetch_size: int = config.CSV_DUMP_FETCH_SIZE,
+) -> Optional[dict]:
+    """
+    Writes the states created or last seen since the last segment in *archive_dir* to a new segment and adds it to
+    the manifest. Returns the new segment's manifest entry, or None if nothing changed since the last segment.
+
+    States whose last_seen is up to *overlap* seconds before the last segment's high-water mark are exported again,
+    since last_seen is the time a plot was swept, not the time the worker wrote it: events processed late (or
+    heartbeats held by the worker) can move a state's last_seen to before a high-water mark that was already taken.
+    """
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(archive_dir)
+    until_id, until_last_seen = crud.get_csv_high_water_mark(db)
+    if manifest["segments"]:
+        last = manifest["segments"][-1]
+        if (until_id, until_last_seen) == (last["until_id"], last["until_last_seen"]):
+            log.info("No states changed since the last archive segment")
+            return None
+        after_id, after_last_seen = last["until_id"], last["until_last_seen"] - overlap
+    else:
+        after_id, after_last_seen = 0, 0
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    fp = archive_dir / f"{now:%Y-%m-%dT%H%M%SZ}.csv.gz"
+    parquet_fp = fp.with_name(fp.name.replace(".csv.gz", ".parquet")) if parquetexport.pyarrow is not None else None
+    rows = crud.do_csv_state_delta(db, (after_id, after_last_seen), (until_id, until_last_seen), fetch_size)
+    written = _write_csv(fp, rows.partitions(), parquet_fp=parquet_fp)
+    segment = {
+        "name": fp.name,
+        "created_at": time.time(),
+        "after_id": after_id,
+        "after_last_seen": after_last_seen,
+        "until_id": until_id,
+        "until_last_seen": until_last_seen,
+        "rows": written,
+        "size": fp.stat().st_size,
+        "sha256": _sha256(fp),
+    }
+    if parquet_fp is not None:
+        segment["parquet"] = {"name": parquet_fp.name, "size": parquet_fp.stat().st_size, "sha256": _sha256(parquet_fp)}
+    manifest["segments"].append(segment)
+    _write_manifest(archive_dir, manifest)
+    log.info(f"Archived {written} states to {fp}")
+    return segment
+
+
+def load_manifest(archive_dir: Path = ARCHIVE_DIR) -> dict:
+    """Returns the manifest of the archive in *archive_dir*, or an empty one if there is none yet."""
+    try:
+        with open(archive_dir / "manifest.json") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"version": MANIFEST_VERSION, "fields": DUMP_FIELDS, "segments": []}
+
+
+# ==== helpers ====
+def _write_csv(fp: Path, batches: Iterable[List[Row]], parquet_fp: Optional[Path] = None) -> int:
+    """
+    Writes batches of rows to *fp* as gzipped CSV, atomically, and to *parquet_fp* as Parquet if given. Returns the
+    number of rows written.
+    """
+    tmp_fp = fp.with_name(f"{fp.name}.tmp")
+    written = 0
+    try:
+        with gzip.open(tmp_fp, "wt", newline="", encoding="utf-8", compresslevel=6) as f, (
+            parquetexport.StateParquetWriter(parquet_fp) if parquet_fp is not None else contextlib.nullcontext()
+        ) as parquet_writer:
+            writer = csv.DictWriter(f, fieldnames=DUMP_FIELDS)
+            writer.writeheader()
+            for rows in batches:
+                writer.writerows(row._mapping for row in rows)
+                if parquet_writer is not None:
+                    parquet_writer.write(rows)
+                written += len(rows)
+        tmp_fp.replace(fp)
+    finally:
+        tmp_fp.unlink(missing_ok=True)
+    return written
+
+
+def _write_manifest(archive_dir: Path, manifest: dict):
+    tmp_fp = archive_dir / "manifest.json.tmp"
+    with open(tmp_fp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    tmp_fp.replace(archive_dir / "manifest.json")
+
+
+def _sha256(fp: Path) -> str:
+    digest = hashlib.sha256()
+    with open(fp, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,4 +1,5 @@
 import redis.asyncio as redis_lib
+from redis.exceptions import ResponseError
 from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
@@ -28,7 +29,28 @@ def get_db():
 
 # ==== redis ====
 EVENT_QUEUE_KEY = "events_pq"
+EVENT_STREAM_KEY = "events_stream"
+EVENT_STREAM_GROUP = "workers"
+ARCHIVE_STREAM_KEY = "events_archive"
+ARCHIVE_GROUP = "archivers"
+ARCHIVE_DEAD_LETTER_KEY = "events_archive_dead"
 METRICS_KEY_PREFIX = "metrics"
+FRESHNESS_WARDS_KEY = "freshness:wards"
+FRESHNESS_WORLDS_KEY = "freshness:worlds"
+WARD_FINGERPRINT_KEY_PREFIX = "fingerprint.ward"
+WARD_RECENT_KEY_PREFIX = "recent.ward"
+RATELIMIT_KEY_PREFIX = "ratelimit"
+LOTTERY_CACHE_KEY_PREFIX = "lottery"
+MARKET_KEY_PREFIX = "market"
 PUBSUB_WS_CHANNEL = "ws_messages"
 TTL_ONE_HOUR = 3600
 redis = redis_lib.from_url(config.REDIS_URI, decode_responses=True)
+
+
+async def ensure_stream_group(client: redis_lib.Redis, stream: str, group: str):
+    """Creates a consumer group (and its stream) if it does not exist."""
+    try:
+        await client.xgroup_create(stream, group, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):  # the group already exists
+            raise
@@ -0,0 +1,465 @@
+"""
+Compact binary encoding of archived ingest events (models.Event.packed).
+
+Each encoded event is a 2-byte header (format version, flags) followed by the body, which is zlib-compressed if that
+makes it smaller (FLAG_COMPRESSED). Ward info bodies may also be delta-encoded against an earlier event of the same
+ward (FLAG_DELTA): the header is then followed by the base event's ID, and the body only contains the house entries
+that differ from the base.
+
+Body layouts (network byte order):
+- ward info: WARD_INFO_HEADER, then for a full body 60 entries, or for a delta body a u64 bitmask of changed entries
+  followed by just those entries. Each entry is HOUSE_INFO_ENTRY followed by the UTF-8 owner name (u8 length prefixed).
+- lottery info: LOTTERY_INFO
+
+The same body layouts are used by the /ingest/binary endpoint (see encode_ingest_body).
+"""
+import logging
+import struct
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from . import models, partitions, schemas
+from .gamedata import PLOTS_PER_WARD
+
+log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+FLAG_COMPRESSED = 1 << 0
+FLAG_DELTA = 1 << 1
+KEYFRAME_INTERVAL = 16  # max length of a chain of delta-encoded events
+
+HEADER = struct.Struct("!BB")
+DELTA_BASE = struct.Struct("!Q")
+# client_timestamp, server_timestamp, LandId, WardNumber, TerritoryTypeId, WorldId, PurchaseType, TenantType
+WARD_INFO_HEADER = struct.Struct("!ddhhHHBB")
+# HousePrice, InfoFlags, HouseAppeals[3]
+HOUSE_INFO_ENTRY = struct.Struct("!IB3B")
+ENTRY_MASK = struct.Struct("!Q")
+# client_timestamp, WorldId, DistrictId, WardId, PlotId, PurchaseType, TenantType, AvailabilityType, PhaseEndsAt,
+# EntryCount
+LOTTERY_INFO = struct.Struct("!dHHHHBBBII")
+
+WardKey = Tuple[int, int, int]  # world, district, ward
+
+
+# ==== encode ====
+def encode(
+    packet: schemas.ffxiv.BaseFFXIVPacket,
+    base: Optional[Tuple[int, List[bytes]]] = None,
+    compress: bool = True,
+) -> bytes:
+    """
+    Encodes a packet. If *base* is given as the ID of an earlier ward info event of the same ward and its encoded
+    entries (see encode_entries), the packet is delta-encoded against it.
+    """
+    flags = 0
+    prefix = b""
+    if packet.event_type == models.EventType.HOUSING_WARD_INFO:
+        if base is not None:
+            flags |= FLAG_DELTA
+            prefix = DELTA_BASE.pack(base[0])
+            body = _encode_ward_info(packet, base[1])
+        else:
+            body = _encode_ward_info(packet)
+    elif packet.event_type == models.EventType.LOTTERY_INFO:
+        body = _encode_lottery_info(packet)
+    else:
+        raise ValueError(f"Unknown event type: {packet.event_type}")
+
+    if compress:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            flags |= FLAG_COMPRESSED
+            body = compressed
+    return HEADER.pack(FORMAT_VERSION, flags) + prefix + body
+
+
+def encode_entries(wardinfo: schemas.ffxiv.HousingWardInfo) -> List[bytes]:
+    """Encodes each house entry of a ward info packet."""
+    return [_encode_entry(entry) for entry in wardinfo.HouseInfoEntries]
+
+
+def _encode_ward_info(wardinfo: schemas.ffxiv.HousingWardInfo, base_entries: List[bytes] = None) -> bytes:
+    parts = [
+        WARD_INFO_HEADER.pack(
+            wardinfo.client_timestamp,
+            wardinfo.server_timestamp,
+            wardinfo.LandIdent.LandId,
+            wardinfo.LandIdent.WardNumber,
+            wardinfo.LandIdent.TerritoryTypeId,
+            wardinfo.LandIdent.WorldId,
+            wardinfo.PurchaseType,
+            wardinfo.TenantType,
+        )
+    ]
+    entries = encode_entries(wardinfo)
+    if base_entries is None:
+        parts.extend(entries)
+    else:
+        mask = 0
+        for i, (entry, base_entry) in enumerate(zip(entries, base_entries)):
+            if entry != base_entry:
+                mask |= 1 << i
+                parts.append(entry)
+        parts.insert(1, ENTRY_MASK.pack(mask))
+    return b"".join(parts)
+
+
+def _encode_entry(entry: schemas.ffxiv.HouseInfoEntry) -> bytes:
+    name = entry.EstateOwnerName.encode()
+    return HOUSE_INFO_ENTRY.pack(entry.HousePrice, entry.InfoFlags, *entry.HouseAppeals) + bytes((len(name),)) + name
+
+
+def _encode_lottery_info(lotteryinfo: schemas.ffxiv.LotteryInfo) -> bytes:
+    return LOTTERY_INFO.pack(
+        lotteryinfo.client_timestamp,
+        lotteryinfo.WorldId,
+        lotteryinfo.DistrictId,
+        lotteryinfo.WardId,
+        lotteryinfo.PlotId,
+        lotteryinfo.PurchaseType,
+        lotteryinfo.TenantType,
+        lotteryinfo.AvailabilityType,
+        lotteryinfo.PhaseEndsAt,
+        lotteryinfo.EntryCount,
+    )
+
+
+# ==== decode ====
+def decode(
+    event_type: models.EventType,
+    data: bytes,
+    resolve_base: Callable[[int], schemas.ffxiv.HousingWardInfo] = None,
+) -> schemas.ffxiv.BaseFFXIVPacket:
+    """
+    Decodes a packet. Delta-encoded packets need *resolve_base*, which is called with the ID of the base event and
+    should return its decoded packet.
+    """
+    version, flags = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unknown event encoding version: {version}")
+    offset = HEADER.size
+    base_id = None
+    if flags & FLAG_DELTA:
+        (base_id,) = DELTA_BASE.unpack_from(data, offset)
+        offset += DELTA_BASE.size
+    body = data[offset:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+
+    if event_type == models.EventType.HOUSING_WARD_INFO:
+        if base_id is not None:
+            if resolve_base is None:
+                raise ValueError(f"Event is delta-encoded against event {base_id} but no way to resolve it was given")
+            return _decode_ward_info(body, resolve_base(base_id))
+        return _decode_ward_info(body)
+    elif event_type == models.EventType.LOTTERY_INFO:
+        return _decode_lottery_info(body)
+    raise ValueError(f"Unknown event type: {event_type}")
+
+
+def _decode_ward_info(body: bytes, base: schemas.ffxiv.HousingWardInfo = None) -> schemas.ffxiv.HousingWardInfo:
+    (
+        client_timestamp,
+        server_timestamp,
+        land_id,
+        ward_number,
+        territory_type_id,
+        world_id,
+        purchase_type,
+        tenant_type,
+    ) = WARD_INFO_HEADER.unpack_from(body)
+    offset = WARD_INFO_HEADER.size
+
+    if base is None:
+        changed = (1 << PLOTS_PER_WARD) - 1
+        entries = [None] * PLOTS_PER_WARD
+    else:
+        (changed,) = ENTRY_MASK.unpack_from(body, offset)
+        offset += ENTRY_MASK.size
+        entries = [entry.dict() for entry in base.HouseInfoEntries]
+    for i in range(PLOTS_PER_WARD):
+        if changed & (1 << i):
+            entries[i], offset = _decode_entry(body, offset)
+
+    return schemas.ffxiv.HousingWardInfo(
+        client_timestamp=client_timestamp,
+        server_timestamp=server_timestamp,
+        LandIdent=dict(LandId=land_id, WardNumber=ward_number, TerritoryTypeId=territory_type_id, WorldId=world_id),
+        HouseInfoEntries=entries,
+        PurchaseType=purchase_type,
+        TenantType=tenant_type,
+    )
+
+
+def _decode_entry(body: bytes, offset: int) -> Tuple[dict, int]:
+    price, flags, *appeals = HOUSE_INFO_ENTRY.unpack_from(body, offset)
+    offset += HOUSE_INFO_ENTRY.size
+    name_len = body[offset]
+    offset += 1
+    name = body[offset : offset + name_len].decode()
+    offset += name_len
+    return dict(HousePrice=price, InfoFlags=flags, HouseAppeals=appeals, EstateOwnerName=name), offset
+
+
+def _decode_lottery_info(body: bytes) -> schemas.ffxiv.LotteryInfo:
+    (
+        client_timestamp,
+        world_id,
+        district_id,
+        ward_id,
+        plot_id,
+        purchase_type,
+        tenant_type,
+        availability_type,
+        phase_ends_at,
+        entry_count,
+    ) = LOTTERY_INFO.unpack(body)
+    return schemas.ffxiv.LotteryInfo(
+        client_timestamp=client_timestamp,
+        WorldId=world_id,
+        DistrictId=district_id,
+        WardId=ward_id,
+        PlotId=plot_id,
+        PurchaseType=purchase_type,
+        TenantType=tenant_type,
+        AvailabilityType=availability_type,
+        PhaseEndsAt=phase_ends_at,
+        EntryCount=entry_count,
+    )
+
+
+# ==== ingest ====
+# A body of /ingest/binary is a HEADER (FORMAT_VERSION, no flags), then for each packet an INGEST_RECORD (event type
+# code, body length) followed by its full, uncompressed body. The request itself may be compressed with
+# Content-Encoding.
+INGEST_RECORD = struct.Struct("!BI")
+INGEST_EVENT_TYPES = {
+    1: models.EventType.HOUSING_WARD_INFO,
+    2: models.EventType.LOTTERY_INFO,
+}
+INGEST_EVENT_TYPE_CODES = {event_type: code for code, event_type in INGEST_EVENT_TYPES.items()}
+
+
+def encode_ingest_body(packets: Iterable[schemas.ffxiv.BaseFFXIVPacket]) -> bytes:
+    """Encodes packets as an /ingest/binary request body."""
+    parts = [HEADER.pack(FORMAT_VERSION, 0)]
+    for packet in packets:
+        if packet.event_type == models.EventType.HOUSING_WARD_INFO:
+            body = _encode_ward_info(packet)
+        elif packet.event_type == models.EventType.LOTTERY_INFO:
+            body = _encode_lottery_info(packet)
+        else:
+            raise ValueError(f"Unknown event type: {packet.event_type}")
+        parts.append(INGEST_RECORD.pack(INGEST_EVENT_TYPE_CODES[packet.event_type], len(body)))
+        parts.append(body)
+    return b"".join(parts)
+
+
+def decode_ingest_body(data: bytes) -> List[schemas.lite.Packet]:
+    """
+    Decodes an /ingest/binary request body into the same objects as the JSON decoder in schemas.lite, applying the
+    validation rules that the packed layout does not already guarantee. Raises a ValueError if the body is invalid.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Body is too short")
+    version, flags = HEADER.unpack_from(data)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unknown encoding version: {version}")
+    if flags:
+        raise ValueError("Flags are not supported in ingest bodies")
+
+    packets = []
+    offset = HEADER.size
+    while offset < len(data):
+        i = len(packets)
+        try:
+            code, length = INGEST_RECORD.unpack_from(data, offset)
+            offset += INGEST_RECORD.size
+            body = data[offset : offset + length]
+            if len(body) != length:
+                raise ValueError("body is truncated")
+            offset += length
+            event_type = INGEST_EVENT_TYPES.get(code)
+            if event_type == models.EventType.HOUSING_WARD_INFO:
+                packets.append(_decode_ingest_ward_info(body))
+            elif event_type == models.EventType.LOTTERY_INFO:
+                packets.append(_decode_ingest_lottery_info(body))
+            else:
+                raise ValueError(f"{code} is not a valid event type")
+        except (struct.error, IndexError, ValueError) as e:
+            raise ValueError(f"Invalid packet {i}: {e}") from e
+    return packets
+
+
+def _decode_ingest_ward_info(body: bytes) -> schemas.lite.HousingWardInfo:
+    (
+        client_timestamp,
+        server_timestamp,
+        land_id,
+        ward_number,
+        territory_type_id,
+        world_id,
+        purchase_type,
+        tenant_type,
+    ) = WARD_INFO_HEADER.unpack_from(body)
+    offset = WARD_INFO_HEADER.size
+
+    entries = []
+    unpack_entry = HOUSE_INFO_ENTRY.unpack_from
+    for _ in range(PLOTS_PER_WARD):
+        price, flags, appeal_1, appeal_2, appeal_3 = unpack_entry(body, offset)
+        offset += HOUSE_INFO_ENTRY.size
+        name_len = body[offset]
+        name = body[offset + 1 : offset + 1 + name_len].decode()
+        offset += 1 + name_len
+        if len(name) > 32:
+            raise ValueError("EstateOwnerName has more than 32 characters")
+        info_flags = schemas.lite.HOUSING_FLAGS_BY_VALUE.get(flags)
+        if info_flags is None:
+            info_flags = schemas.ffxiv.HousingFlags(flags)
+        entries.append(schemas.lite.HouseInfoEntry(price, info_flags, [appeal_1, appeal_2, appeal_3], name))
+    if offset != len(body):
+        raise ValueError("unexpected data after the house entries")
+    if not 0 <= ward_number <= 0xFF:  # wider in the packed layout than in a plot key
+        raise ValueError("WardNumber is out of range")
+
+    return schemas.lite.HousingWardInfo(
+        client_timestamp,
+        server_timestamp,
+        schemas.lite.LandIdent(land_id, ward_number, territory_type_id, world_id),
+        entries,
+        schemas.ffxiv.PurchaseType(purchase_type),
+        schemas.ffxiv.TenantType(tenant_type),
+    )
+
+
+def _decode_ingest_lottery_info(body: bytes) -> schemas.lite.LotteryInfo:
+    (
+        client_timestamp,
+        world_id,
+        district_id,
+        ward_id,
+        plot_id,
+        purchase_type,
+        tenant_type,
+        availability_type,
+        phase_ends_at,
+        entry_count,
+    ) = LOTTERY_INFO.unpack(body)
+    if ward_id > 0xFF or plot_id > 0xFF:  # wider in the packed layout than in a plot key
+        raise ValueError("WardId or PlotId is out of range")
+    return schemas.lite.LotteryInfo(
+        client_timestamp,
+        world_id,
+        district_id,
+        ward_id,
+        plot_id,
+        schemas.ffxiv.PurchaseType(purchase_type),
+        schemas.ffxiv.TenantType(tenant_type),
+        schemas.ffxiv.LotteryPhase(availability_type),
+        phase_ends_at,
+        entry_count,
+    )
+
+
+# ==== events ====
+class EventReader:
+    """
+    Decodes archived events, in either the packed or the legacy JSON format.
+    Reading events in ID order is fastest, since delta-encoded events can then be resolved against the last event read
+    for their ward instead of having to load their base event from the db.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self._last_by_ward: Dict[WardKey, int] = {}
+        self._packets: Dict[int, schemas.ffxiv.HousingWardInfo] = {}  # event id -> packet, for the last of each ward
+
+    def decode(self, event: models.Event) -> schemas.ffxiv.BaseFFXIVPacket:
+        packet = self._decode(event)
+        if isinstance(packet, schemas.ffxiv.HousingWardInfo):
+            key = ward_key(packet)
+            self._packets.pop(self._last_by_ward.get(key), None)
+            self._last_by_ward[key] = event.id
+            self._packets[event.id] = packet
+        return packet
+
+    def _decode(self, event: models.Event) -> schemas.ffxiv.BaseFFXIVPacket:
+        if event.packed is None:
+            return schemas.ffxiv.EVENT_TYPES[event.event_type.value].parse_raw(event.data)
+        return decode(event.event_type, event.packed, resolve_base=self._resolve_base)
+
+    def _resolve_base(self, base_id: int) -> schemas.ffxiv.HousingWardInfo:
+        if (packet := self._packets.get(base_id)) is not None:
+            return packet
+        base = self.db.query(models.Event).filter(models.Event.id == base_id).first()
+        if base is None:
+            raise ValueError(f"Base event {base_id} does not exist")
+        return self._decode(base)
+
+
+def ward_key(wardinfo: schemas.ffxiv.HousingWardInfo) -> WardKey:
+    return wardinfo.LandIdent.WorldId, wardinfo.LandIdent.TerritoryTypeId, wardinfo.LandIdent.WardNumber
+
+
+# ==== conversion ====
+def pack_legacy_events(read_db: Session, write_db: Session, delta: bool = True, batch_size: int = 1000) -> int:
+    """
+    Converts all events stored as JSON to the packed format, in ID order. *read_db* is used to stream the events, and
+    the converted rows are written and committed in batches through *write_db*.
+
+    If *delta*, ward info events are delta-encoded against the previous event of the same ward, with a full event at
+    least every KEYFRAME_INTERVAL events and at each partition boundary (so that retiring a partition never orphans a
+    delta-encoded event).
+
+    Returns the number of converted events.
+    """
+    stmt = (
+        update(models.Event)
+        .where(models.Event.id == bindparam("b_id"), models.Event.timestamp == bindparam("b_timestamp"))
+        .values(packed=bindparam("b_packed"), data=None)
+    )
+    # ward -> (event id, partition, chain length, encoded entries)
+    bases: Dict[WardKey, Tuple[int, int, int, List[bytes]]] = {}
+    batch = []
+    converted = 0
+
+    events = (
+        read_db.query(models.Event)
+        .filter(models.Event.data.isnot(None))
+        .order_by(models.Event.id)
+        .yield_per(batch_size)
+    )
+    for event in events:
+        packet = schemas.ffxiv.EVENT_TYPES[event.event_type.value].parse_raw(event.data)
+        base = None
+        if isinstance(packet, schemas.ffxiv.HousingWardInfo):
+            key = ward_key(packet)
+            partition = partitions.partition_start(event.timestamp)
+            chain_length = 0
+            if delta and (prev := bases.get(key)) is not None:
+                prev_id, prev_partition, prev_chain_length, prev_entries = prev
+                if prev_partition == partition and prev_chain_length < KEYFRAME_INTERVAL:
+                    base = (prev_id, prev_entries)
+                    chain_length = prev_chain_length + 1
+            bases[key] = (event.id, partition, chain_length, encode_entries(packet))
+
+        batch.append(dict(b_id=event.id, b_timestamp=event.timestamp, b_packed=encode(packet, base=base)))
+        if len(batch) >= batch_size:
+            converted += _write_batch(write_db, stmt, batch)
+    if batch:
+        converted += _write_batch(write_db, stmt, batch)
+    return converted
+
+
+def _write_batch(db: Session, stmt, batch: list) -> int:
+    db.execute(stmt, batch)
+    db.commit()
+    n = len(batch)
+    log.info(f"Packed {n} events, last ID {batch[-1]['b_id']}")
+    batch.clear()
+    return n
@@ -1,31 +1,71 @@
 import csv
+import hashlib
 import logging
 import os
 
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 
-from . import models
+from . import config, models
 
 log = logging.getLogger(__name__)
 
 PLOTS_PER_WARD = 60
+WARDS_PER_DISTRICT = 30
 
+GAMEDATA_FILES = ["HousingLandSet.csv", "PlaceName.csv", "TerritoryType.csv", "World.csv", "WorldDCGroupType.csv"]
+# bump this when the generation below changes, so that existing databases are updated even if the files are not
+GAMEDATA_VERSION = 1
+GAMEDATA_CHECKSUM_KEY = "gamedata_checksum"
 
-def upsert_all(gamedata_dir, db: Session):
+
+def upsert_all(gamedata_dir, db: Session, force: bool = False) -> bool:
     """
     Given the path to the directory where gamedata files are, upserts the necessary rows into worlds, districts,
     and plotinfo.
+    This is skipped if the gamedata files have not changed since the last upsert (unless *force* is set).
+    Returns whether the rows were upserted.
     """
+    checksum = gamedata_checksum(gamedata_dir)
+    stored = db.get(models.Meta, GAMEDATA_CHECKSUM_KEY)
+    if not force and stored is not None and stored.value == checksum:
+        log.info("Gamedata is unchanged, skipping upsert")
+        return False
+
     worlds = generate_worlds(gamedata_dir)
     districts = generate_districts(gamedata_dir)
     plotinfo = generate_plotinfo(districts, gamedata_dir)
-    for world in worlds:
-        db.merge(world)
-    for district in districts:
-        db.merge(district)
-    for pi in plotinfo:
-        db.merge(pi)
+    _bulk_upsert(db, models.World, worlds)
+    _bulk_upsert(db, models.District, districts)
+    _bulk_upsert(db, models.PlotInfo, plotinfo)
+    db.merge(models.Meta(key=GAMEDATA_CHECKSUM_KEY, value=checksum))
     db.commit()
+    log.info(f"Upserted {len(worlds)} worlds, {len(districts)} districts and {len(plotinfo)} plots")
+    return True
+
+
+def gamedata_checksum(gamedata_dir) -> str:
+    """A hash of the gamedata files (and GAMEDATA_VERSION), which changes whenever upsert_all would write new rows."""
+    h = hashlib.sha256(str(GAMEDATA_VERSION).encode())
+    for filename in GAMEDATA_FILES:
+        h.update(filename.encode())
+        with open(os.path.join(gamedata_dir, filename), "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+def _bulk_upsert(db: Session, model, rows: list):
+    """Inserts or updates all the given model instances in one statement."""
+    if not rows:
+        return
+    table = model.__table__
+    insert = postgresql.insert if config.DB_TYPE == "postgresql" else sqlite.insert
+    stmt = insert(table).values([{c.key: getattr(row, c.key) for c in table.columns} for row in rows])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={c.key: stmt.excluded[c.key] for c in table.columns if not c.primary_key},
+    )
+    db.execute(stmt)
 
 
 # ==== Transient Gen ====
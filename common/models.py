@@ -4,6 +4,7 @@ from sqlalchemy import (
     BigInteger,
     Boolean,
     Column,
+    Computed,
     DateTime,
     Enum,
     Float,
@@ -11,15 +12,23 @@ from sqlalchemy import (
     ForeignKeyConstraint,
     Index,
     Integer,
+    LargeBinary,
     String,
+    Table,
     UnicodeText,
+    and_,
     func,
+    join,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import column_property, relationship
 
+from . import config, plotkey
 from .database import Base
 
 UNKNOWN_OWNER = "Unknown"
+# plot_states and events are partitioned on postgres, which needs the partition key in the primary key; sqlite cannot
+# autoincrement a composite primary key, so there the id is the primary key on its own
+PARTITIONED = config.DB_TYPE == "postgresql"
 
 
 class EventType(enum.Enum):
@@ -71,30 +80,61 @@ class PlotInfo(Base):
     district = relationship("District", viewonly=True)
 
 
-class PlotState(Base):
-    __tablename__ = "plot_states"
-    __table_args__ = (
-        ForeignKeyConstraint(
-            ("territory_type_id", "plot_number"), ("plotinfo.territory_type_id", "plotinfo.plot_number")
-        ),
-    )
+# plot states are split in two tables, which PlotState maps as one: plot_states holds the columns that are set when a
+# state is created (or rarely after that), and plot_states_hot the ones that change on nearly every sweep. This keeps
+# the row rewritten by each update narrow, and since no index covers plot_states_hot's columns (and its pages are kept
+# half empty), postgres can update its rows in place (HOT updates) without touching any index.
+# That includes last_seen: the queries that filter on it (the lottery summary, CSV archive segments, and seeding the
+# worker's freshness index on first deploy) are background jobs that can afford to scan plot_states_hot, whereas an
+# index on it would make every heartbeat a non-HOT update (see tests/bench_hot_table.py).
+# plot_states_hot carries its state's first_seen and is partitioned the same way as plot_states, so that a week of
+# states is retired by detaching and dropping a partition of each (see common.partitions).
+plot_states = Table(
+    "plot_states",
+    Base.metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("world_id", Integer, ForeignKey("worlds.id")),
+    Column("territory_type_id", Integer, ForeignKey("districts.id")),
+    Column("ward_number", Integer),
+    Column("plot_number", Integer),
+    Column("plot_key", BigInteger, Computed(plotkey.PLOT_KEY_SQL, persisted=True)),  # see common.plotkey
+    Column("first_seen", Float, primary_key=PARTITIONED),  # UNIX seconds
+    Column("is_owned", Boolean),
+    # "Unknown" for unknown owner (UNKNOWN_OWNER), used to build relo graph
+    Column("owner_name", String, nullable=True),
+    Column("purchase_system", Integer),
+    ForeignKeyConstraint(("territory_type_id", "plot_number"), ("plotinfo.territory_type_id", "plotinfo.plot_number")),
+    # weekly partitions are managed by common.partitions
+    postgresql_partition_by="RANGE (first_seen)",
+)
 
-    id = Column(Integer, primary_key=True)
-    world_id = Column(Integer, ForeignKey("worlds.id"))
-    territory_type_id = Column(Integer, ForeignKey("districts.id"))
-    ward_number = Column(Integer)
-    plot_number = Column(Integer)
-    last_seen = Column(Float)  # UNIX seconds
-    first_seen = Column(Float)
+plot_states_hot = Table(
+    "plot_states_hot",
+    Base.metadata,
+    # plot_states.id (not a foreign key, since ids are only unique per partition as far as postgres knows)
+    Column("state_id", Integer, primary_key=True, autoincrement=False),
+    Column("first_seen", Float, primary_key=PARTITIONED),  # plot_states.first_seen
+    Column("last_seen", Float),  # UNIX seconds
+    Column("last_seen_price", Integer, nullable=True),  # null for unknown price
+    Column("lotto_entries", Integer, nullable=True),  # null if the plot is FCFS (purchase_system is even)
+    Column("lotto_phase", Integer, nullable=True),
+    Column("lotto_phase_until", Integer, nullable=True),
+    # weekly partitions are managed by common.partitions, which gives each of them these storage parameters (postgres
+    # does not take them on a partitioned table)
+    postgresql_partition_by="RANGE (first_seen)",
+    info={"storage_parameters": "fillfactor = 50, autovacuum_vacuum_scale_factor = 0.02"},
+)
 
-    is_owned = Column(Boolean)
-    last_seen_price = Column(Integer, nullable=True)  # null for unknown price
-    owner_name = Column(String, nullable=True)  # "Unknown" for unknown owner (UNKNOWN_OWNER), used to build relo graph
 
-    purchase_system = Column(Integer)
-    lotto_entries = Column(Integer, nullable=True)  # null if the plot is FCFS (purchase_system is even)
-    lotto_phase = Column(Integer, nullable=True)
-    lotto_phase_until = Column(Integer, nullable=True)
+class PlotState(Base):
+    __table__ = join(
+        plot_states,
+        plot_states_hot,
+        and_(plot_states.c.id == plot_states_hot.c.state_id, plot_states.c.first_seen == plot_states_hot.c.first_seen),
+    )
+
+    id = column_property(plot_states.c.id, plot_states_hot.c.state_id)
+    first_seen = column_property(plot_states.c.first_seen, plot_states_hot.c.first_seen)
 
     world = relationship("World", viewonly=True)
     district = relationship("District", viewonly=True)
@@ -107,28 +147,53 @@ class PlotState(Base):
 
 # common query indices
 Index(
-    "ix_plot_states_loc_last_seen_desc",
-    # these 4 make up the plot state's unique location
-    PlotState.world_id,
-    PlotState.territory_type_id,
-    PlotState.ward_number,
-    PlotState.plot_number,
-    # and this is for convenience
-    PlotState.last_seen.desc(),
+    "ix_plot_states_plot_key_first_seen_desc",
+    # the plot state's unique location, packed (world, district, ward, plot) so it also covers ward/district ranges
+    plot_states.c.plot_key,
+    # a plot's states never overlap in time, so this orders them the same as last_seen would
+    plot_states.c.first_seen.desc(),
 )
-Index("ix_plot_states_last_seen_desc", PlotState.last_seen.desc())
+
+
+class PlotSale(Base):
+    """
+    a plot that was seen open and then sold, recorded by the worker when it sees the sale (and backfilled from older
+    history by stats/sales.py); times are UNIX seconds
+    """
+    __tablename__ = "plot_sales"
+
+    id = Column(Integer, primary_key=True)
+    world_id = Column(Integer, ForeignKey("worlds.id"))
+    territory_type_id = Column(Integer, ForeignKey("districts.id"))
+    ward_number = Column(Integer)
+    plot_number = Column(Integer)
+    plot_key = Column(BigInteger, index=True)  # see common.plotkey
+    time_open_min = Column(Float)  # 0 if the plot was open for as long as we've known it
+    time_open_max = Column(Float)
+    time_sold_min = Column(Float)
+    time_sold_max = Column(Float, index=True)
+    known_price = Column(Integer, nullable=True)
+    is_relo = Column(Boolean, nullable=True)  # null if not (yet) determined
+    purchase_system = Column(Integer)
+    # the last open state before the sale, which identifies the sale
+    last_presale_state_id = Column(Integer, unique=True)
 
 
 # ==== logging ====
 class Event(Base):
-    """store of all ingested events for later analysis (e.g. FC/player ownership, relocation/resell graphs, etc)"""
+    """
+    store of all ingested events for later analysis (e.g. FC/player ownership, relocation/resell graphs, etc)
+    use common.eventcodec.EventReader to decode them
+    """
     __tablename__ = "events"
+    __table_args__ = ({"postgresql_partition_by": "RANGE (timestamp)"},)
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     sweeper_id = Column(BigInteger, ForeignKey("sweepers.id", ondelete="SET NULL"), nullable=True, index=True)
-    timestamp = Column(Float, index=True)
+    timestamp = Column(Float, primary_key=PARTITIONED, index=True)
     event_type = Column(Enum(EventType), index=True)
-    data = Column(UnicodeText)
+    data = Column(UnicodeText, nullable=True)  # legacy JSON format, null once packed
+    packed = Column(LargeBinary, nullable=True)  # see common.eventcodec
 
     sweeper = relationship("Sweeper", back_populates="events")
 
@@ -142,3 +207,38 @@ class WSPayload(Base):
     type = Column(String, index=True)
     data = Column(UnicodeText)
 
+
+# ==== lottery ====
+class LotteryCycle(Base):
+    """a lottery cycle whose entry period has ended and whose results were summarized (see crud.build_lottery_cycle)"""
+    __tablename__ = "lottery_cycles"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # number of LOTTO_CYCLEs since the epoch
+    entry_start = Column(Float)  # UNIX seconds
+    entry_end = Column(Float)
+    built_at = Column(Float)
+
+
+class LotteryResult(Base):
+    """the final state of a lottery plot at the end of an entry period"""
+    __tablename__ = "lottery_results"
+
+    cycle_id = Column(Integer, ForeignKey("lottery_cycles.id", ondelete="CASCADE"), primary_key=True)
+    plot_key = Column(BigInteger, primary_key=True)  # see common.plotkey
+    world_id = Column(Integer, ForeignKey("worlds.id"))
+    territory_type_id = Column(Integer, ForeignKey("districts.id"))
+    ward_number = Column(Integer)
+    plot_number = Column(Integer)
+    house_size = Column(Integer)
+    price = Column(Integer, nullable=True)
+    lotto_entries = Column(Integer, nullable=True)  # null if the plot was never seen with an entry count
+    purchase_system = Column(Integer)
+
+
+# ==== meta ====
+class Meta(Base):
+    """key-value store of database bookkeeping (e.g. the checksum of the last gamedata upserted)"""
+    __tablename__ = "meta"
+
+    key = Column(String, primary_key=True)
+    value = Column(String)
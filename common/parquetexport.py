@@ -0,0 +1,117 @@
+"""
+Parquet exports of plot states, for analytics.
+
+These hold the same fields as the CSV exports (see csvexport.py), but typed, with world, district and house_size
+dictionary-encoded and the whole file compressed with zstd, so that loading them does not mean parsing gigabytes of
+text. Rows are converted to Arrow as they are streamed from the database and written out in row groups of
+PARQUET_ROW_GROUP_SIZE, so memory use is bounded by the size of a row group.
+
+Only available if the optional pyarrow package is installed.
+"""
+import logging
+from pathlib import Path
+from typing import List, Sequence
+
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from . import config, crud
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+if pyarrow is not None:
+    SCHEMA = pyarrow.schema(
+        [
+            ("id", pyarrow.int64()),
+            ("world", pyarrow.dictionary(pyarrow.int16(), pyarrow.string())),
+            ("district", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+            ("ward_number", pyarrow.int16()),
+            ("plot_number", pyarrow.int16()),
+            ("house_size", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+            ("lotto_entries", pyarrow.int32()),
+            ("price", pyarrow.int32()),
+            ("first_seen", pyarrow.float64()),
+            ("last_seen", pyarrow.float64()),
+            ("is_owned", pyarrow.bool_()),
+            ("purchase_system", pyarrow.int16()),
+            ("owner_name_hash", pyarrow.string()),
+            ("owner_name_has_space", pyarrow.bool_()),
+            ("owner_name_len", pyarrow.int16()),
+            ("possible_character_name", pyarrow.bool_()),
+            ("lotto_phase", pyarrow.int16()),
+            ("lotto_phase_until", pyarrow.int64()),
+        ]
+    )
+else:
+    SCHEMA = None
+
+
+class StateParquetWriter:
+    """
+    Writes batches of plot state rows (as returned by crud.do_csv_state_dump and do_csv_state_delta) to a Parquet file.
+    Used as a context manager; the file is written to a temporary path and only renamed into place if the block exits
+    without an error.
+    """
+
+    def __init__(self, fp: Path, row_group_size: int = config.PARQUET_ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise RuntimeError("Parquet exports need the pyarrow package")
+        self.fp = fp
+        self.tmp_fp = fp.with_name(f"{fp.name}.tmp")
+        self.row_group_size = row_group_size
+        self.written = 0
+        self._writer = None
+        self._pending: List["pyarrow.RecordBatch"] = []
+        self._pending_rows = 0
+
+    def __enter__(self):
+        self._writer = pyarrow.parquet.ParquetWriter(self.tmp_fp, SCHEMA, compression="zstd")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._flush()
+            self._writer.close()
+            if exc_type is None:
+                self.tmp_fp.replace(self.fp)
+        finally:
+            self.tmp_fp.unlink(missing_ok=True)
+
+    def write(self, rows: Sequence[Row]):
+        """Adds a batch of rows, writing out a row group once enough have been added."""
+        if not rows:
+            return
+        columns = dict(zip(rows[0]._fields, zip(*rows)))
+        self._pending.append(
+            pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(columns[field.name], type=field.type) for field in SCHEMA], schema=SCHEMA
+            )
+        )
+        self._pending_rows += len(rows)
+        self.written += len(rows)
+        if self._pending_rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        table = pyarrow.Table.from_batches(self._pending, schema=SCHEMA)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self._pending = []
+        self._pending_rows = 0
+
+
+def write_state_dump(db: Session, fp: Path, fetch_size: int = config.CSV_DUMP_FETCH_SIZE) -> int:
+    """Writes every plot state to *fp* as Parquet. Returns the number of rows written."""
+    with StateParquetWriter(fp) as writer:
+        for rows in crud.do_csv_state_dump(db, fetch_size).partitions():
+            writer.write(rows)
+    log.info(f"Dumped {writer.written} states to {fp}")
+    return writer.written
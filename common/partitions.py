@@ -0,0 +1,239 @@
+"""
+Maintenance of the weekly time-range partitions of plot_states and plot_states_hot (by first_seen) and events (by
+timestamp).
+
+plot_states is partitioned by first_seen rather than last_seen since first_seen never changes, so rows never have to
+move between partitions as they are updated. plot_states_hot carries the first_seen of its state and has the same
+partitions, which are retired together with plot_states': a week of states is dropped with its hot rows.
+
+Each table has a default partition that catches anything no range partition covers. This is where the latest state of
+a plot ends up when the partition it was created in is retired, so that plots which have not changed in a long time
+are never forgotten.
+"""
+import datetime
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+
+log = logging.getLogger(__name__)
+
+PARTITION_SPAN = 60 * 60 * 24 * 7
+PARTITION_EPOCH = 60 * 60 * 24 * 4  # weeks start on Monday 00:00 UTC (the UNIX epoch was a Thursday)
+
+# table -> partition key
+PARTITIONED_TABLES = {
+    models.plot_states.name: "first_seen",
+    models.plot_states_hot.name: "first_seen",
+    models.Event.__tablename__: "timestamp",
+}
+
+
+# ==== helpers ====
+def partition_start(timestamp: float) -> int:
+    """Returns the start of the partition that contains the given timestamp."""
+    return int((timestamp - PARTITION_EPOCH) // PARTITION_SPAN) * PARTITION_SPAN + PARTITION_EPOCH
+
+
+def partition_name(table: str, start: int) -> str:
+    return f"{table}_p{datetime.datetime.utcfromtimestamp(start):%Y%m%d}"
+
+
+def _insertable_columns(table: str) -> str:
+    """The comma-separated list of columns that can be copied between partitions (i.e. not generated)."""
+    columns = models.Base.metadata.tables[table].columns
+    return ", ".join(f'"{c.name}"' for c in columns if c.computed is None)
+
+
+def _storage_parameters(table: str) -> str:
+    """The WITH clause giving a partition of *table* the storage parameters set in its model, if any."""
+    parameters = models.Base.metadata.tables[table].info.get("storage_parameters")
+    return f"WITH ({parameters})" if parameters else ""
+
+
+def list_partitions(db: Session, table: str) -> List[Tuple[str, Optional[float], float]]:
+    """
+    Returns a list of (name, start, end) tuples of the range partitions of a table, oldest first.
+    *start* is None for a partition that starts at MINVALUE.
+    """
+    result = db.execute(
+        text(
+            """
+            SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+                     JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:table AS regclass)
+            """
+        ).bindparams(table=table)
+    )
+    out = []
+    for name, bound in result:
+        # e.g. FOR VALUES FROM ('1697414400') TO ('1698019200'); the default partition has no range
+        if (match := _RANGE_BOUND_RE.match(bound)) is None:
+            continue
+        start, end = (None if v == "MINVALUE" else float(v.strip("'")) for v in match.groups())
+        out.append((name, start, end))
+    return sorted(out, key=lambda p: p[2])
+
+
+_RANGE_BOUND_RE = re.compile(r"FOR VALUES FROM \((.+)\) TO \((.+)\)")
+
+
+# ==== creation ====
+def ensure_partitions(db: Session, weeks_ahead: int = 2, now: float = None):
+    """
+    Creates the default partition of each partitioned table, and the weekly partitions from this week to *weeks_ahead*
+    weeks ahead if they do not exist.
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    this_week = partition_start(now)
+    for table, key in PARTITIONED_TABLES.items():
+        storage = _storage_parameters(table)
+        db.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT {storage}"))
+        existing = list_partitions(db, table)
+        for week in range(weeks_ahead + 1):
+            start = this_week + week * PARTITION_SPAN
+            # already covered, e.g. by the legacy partition attached by the partitioning migration
+            if _overlaps_any(existing, start, start + PARTITION_SPAN):
+                continue
+            name = partition_name(table, start)
+            _create_partition(db, table, key, name, start, start + PARTITION_SPAN)
+            log.info(f"Created partition {name}")
+    db.commit()
+
+
+def _create_partition(db: Session, table: str, key: str, name: str, start: int, end: int):
+    # rows in this range may already be in the default partition (e.g. if this was not run ahead of time), which would
+    # make a plain CREATE TABLE ... PARTITION OF fail, so build the partition standalone and move them over first
+    columns = _insertable_columns(table)
+    db.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING ALL) {_storage_parameters(table)}"))
+    db.execute(
+        text(
+            f"""
+            WITH moved AS (
+                DELETE FROM {table}_default WHERE {key} >= :start AND {key} < :end RETURNING {columns}
+            )
+            INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+            """
+        ).bindparams(start=start, end=end)
+    )
+    db.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})"))
+
+
+def _overlaps_any(partitions, start: float, end: float) -> bool:
+    return any((p_start is None or p_start < end) and start < p_end for _, p_start, p_end in partitions)
+
+
+# ==== retention ====
+def retire_partitions(db: Session, retain_days: float = 9, drop: bool = True, now: float = None) -> List[str]:
+    """
+    Detaches (and if *drop*, drops) all partitions whose range ends more than *retain_days* days ago.
+    A plot_states partition is retired together with the plot_states_hot partition of the same range. Before they are,
+    any state in them that was seen within the retention period or is the latest state of its plot is copied back (with
+    its hot row) to the default partitions.
+
+    Returns the names of the retired partitions.
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc).timestamp()
+    cutoff = now - retain_days * 60 * 60 * 24
+    hot_partitions = {(start, end): name for name, start, end in list_partitions(db, models.plot_states_hot.name)}
+    retired = []
+    for table in PARTITIONED_TABLES:
+        if table == models.plot_states_hot.name:  # retired along with plot_states
+            continue
+        for name, start, end in list_partitions(db, table):
+            if end > cutoff:
+                break
+            partitions = [(table, name)]
+            if table == models.plot_states.name:
+                if (hot_name := hot_partitions.get((start, end))) is None:
+                    log.warning(f"Not retiring partition {name}: plot_states_hot has no partition with the same range")
+                    continue
+                partitions.append((models.plot_states_hot.name, hot_name))
+            for parent, partition in partitions:
+                db.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {partition}"))
+            if table == models.plot_states.name:
+                _keep_plot_states(db, name, hot_name, cutoff)
+            if drop:
+                for _, partition in partitions:
+                    db.execute(text(f"DROP TABLE {partition}"))
+            db.commit()
+            for _, partition in partitions:
+                retired.append(partition)
+                log.info(f"Retired partition {partition}")
+
+    _prune_default_plot_states(db, cutoff)
+    db.commit()
+    return retired
+
+
+def _keep_plot_states(db: Session, partition: str, hot_partition: str, cutoff: float):
+    """
+    Copies the states in a detached plot_states partition that must be kept back into plot_states, and their rows in
+    the detached plot_states_hot partition of the same range back into plot_states_hot.
+    """
+    columns = _insertable_columns(models.plot_states.name)
+    hot_columns = _insertable_columns(models.plot_states_hot.name)
+    # a plot's states never overlap in time, so its latest state is also the one first seen last
+    db.execute(
+        text(
+            f"""
+            WITH kept AS (
+                SELECT s.id, s.first_seen
+                FROM {partition} s
+                         JOIN {hot_partition} h ON h.state_id = s.id AND h.first_seen = s.first_seen
+                WHERE h.last_seen >= :cutoff
+                   OR (s.id IN (SELECT DISTINCT ON (plot_key) id
+                                FROM {partition}
+                                ORDER BY plot_key, first_seen DESC)
+                    AND NOT EXISTS(SELECT 1
+                                   FROM plot_states n
+                                   WHERE n.plot_key = s.plot_key
+                                     AND n.first_seen > s.first_seen))
+            ),
+                 kept_states AS (
+                     INSERT INTO plot_states ({columns})
+                         SELECT {columns}
+                         FROM {partition}
+                         WHERE (id, first_seen) IN (SELECT id, first_seen FROM kept)
+                 )
+            INSERT
+            INTO plot_states_hot ({hot_columns})
+            SELECT {hot_columns}
+            FROM {hot_partition}
+            WHERE (state_id, first_seen) IN (SELECT id, first_seen FROM kept)
+            """
+        ).bindparams(cutoff=cutoff)
+    )
+
+
+def _prune_default_plot_states(db: Session, cutoff: float):
+    """Deletes states kept in the default partitions that are past retention and have since been superseded."""
+    db.execute(
+        text(
+            """
+            WITH pruned AS (
+                DELETE
+                FROM plot_states_default s
+                    USING plot_states_hot_default h
+                WHERE h.state_id = s.id
+                  AND h.first_seen = s.first_seen
+                  AND h.last_seen < :cutoff
+                  AND EXISTS(SELECT 1
+                             FROM plot_states n
+                             WHERE n.plot_key = s.plot_key
+                               AND n.first_seen > s.first_seen)
+                RETURNING s.id, s.first_seen
+            )
+            DELETE
+            FROM plot_states_hot_default
+            WHERE (state_id, first_seen) IN (SELECT id, first_seen FROM pruned)
+            """
+        ).bindparams(cutoff=cutoff)
+    )
@@ -0,0 +1,58 @@
+"""
+The packed 64-bit identity of a plot: world_id << 32 | district_id << 16 | ward_num << 8 | plot_num.
+
+Used wherever a plot (or ward) location is a key - redis keys, the worker's caches, and the generated
+plot_states.plot_key column - so that lookups compare one integer instead of four. Keys sort by world, district, ward
+and plot, so the plots of a ward or district are a contiguous range of keys.
+"""
+from typing import Tuple
+
+WORLD_SHIFT = 32
+DISTRICT_SHIFT = 16
+WARD_SHIFT = 8
+_BYTE = 0xFF
+_SHORT = 0xFFFF
+_WORD = 0xFFFFFFFF
+
+# the same packing in SQL, for the generated plot_states.plot_key column (world_id is cast first so it does not
+# overflow a 32-bit integer)
+PLOT_KEY_SQL = "CAST(world_id AS BIGINT) * 4294967296 + territory_type_id * 65536 + ward_number * 256 + plot_number"
+
+
+def encode(world_id: int, district_id: int, ward_num: int, plot_num: int = 0) -> int:
+    """
+    Packs a plot's location into its key. With the default *plot_num* of 0, this is also the key of its ward.
+    Raises a ValueError if a part does not fit in its bits, since it would otherwise overwrite the parts above it.
+    """
+    if not (
+        0 <= world_id <= _WORD and 0 <= district_id <= _SHORT and 0 <= ward_num <= _BYTE and 0 <= plot_num <= _BYTE
+    ):
+        raise ValueError(f"Plot location is out of range: {world_id=} {district_id=} {ward_num=} {plot_num=}")
+    return world_id << WORLD_SHIFT | district_id << DISTRICT_SHIFT | ward_num << WARD_SHIFT | plot_num
+
+
+def decode(key: int) -> Tuple[int, int, int, int]:
+    """Returns the (world_id, district_id, ward_num, plot_num) of a plot key."""
+    return key >> WORLD_SHIFT, key >> DISTRICT_SHIFT & _SHORT, key >> WARD_SHIFT & _BYTE, key & _BYTE
+
+
+def ward_of(key: int) -> int:
+    """The key of the ward a plot key is in."""
+    return key & ~_BYTE
+
+
+def ward_range(ward_key: int) -> Tuple[int, int]:
+    """The (inclusive) range of the keys of the plots in a ward, given the ward's key."""
+    return ward_key, ward_key | _BYTE
+
+
+def district_range(world_id: int, district_id: int) -> Tuple[int, int]:
+    """The (inclusive) range of the keys of the plots in a district."""
+    start = encode(world_id, district_id, 0)
+    return start, start | _SHORT
+
+
+def world_range(world_id: int) -> Tuple[int, int]:
+    """The (inclusive) range of the keys of the plots in a world."""
+    start = world_id << WORLD_SHIFT
+    return start, start | _WORD
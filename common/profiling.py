@@ -0,0 +1,118 @@
+"""
+Opt-in sampling profiler for API requests and worker events.
+
+When PROFILE_SAMPLE_RATE is above 0, that fraction of profiled sections is sampled: while any sampled section is
+running, a background thread records the stacks of all busy threads every PROFILE_INTERVAL seconds. The aggregated
+stacks are written to PROFILE_DIR in the collapsed stack format (one ``frame;frame;frame count`` line per stack), which
+can be rendered by flamegraph.pl or speedscope. Since the whole process is sampled, concurrent work shows up in the
+stacks as well.
+
+When disabled, a section is a shared no-op context manager.
+"""
+import atexit
+import collections
+import contextlib
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from . import config
+from .utils import REPO_ROOT
+
+log = logging.getLogger(__name__)
+
+# threads whose innermost frame is in one of these files are waiting on something, not doing work
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+_noop = contextlib.nullcontext()
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        name: str,
+        sample_rate: float = config.PROFILE_SAMPLE_RATE,
+        interval: float = config.PROFILE_INTERVAL,
+        out_dir: str = config.PROFILE_DIR,
+        flush_interval: float = 60,
+    ):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.out_dir = out_dir
+        self.flush_interval = flush_interval
+        self.enabled = sample_rate > 0
+        self.stacks = collections.Counter()
+        self._num_active = 0
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def section(self):
+        """Returns a context manager that profiles its body if this call is sampled."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return _noop
+        return self._sampled_section()
+
+    @contextlib.contextmanager
+    def _sampled_section(self):
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.out_dir, exist_ok=True)
+                self._thread = threading.Thread(target=self._sampler, name=f"profiler-{self.name}", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._num_active += 1
+            self._active.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._num_active -= 1
+                if not self._num_active:
+                    self._active.clear()
+
+    # ==== sampling ====
+    def _sampler(self):
+        own_id = threading.get_ident()
+        last_flush = time.monotonic()
+        while True:
+            if self._active.wait(timeout=self.flush_interval):
+                self._sample(own_id)
+                time.sleep(self.interval)
+            if time.monotonic() - last_flush > self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def _sample(self, own_id: int):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or frame.f_code.co_filename.endswith(IDLE_FILES):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def flush(self):
+        """Writes the stacks sampled since the last flush to a new collapsed stack file."""
+        stacks, self.stacks = self.stacks, collections.Counter()
+        if not stacks:
+            return
+        fp = os.path.join(self.out_dir, f"{self.name}-{os.getpid()}-{int(time.time())}.collapsed")
+        with open(fp, "w", encoding="utf-8") as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+        log.info(f"Wrote {sum(stacks.values())} samples to {fp}")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(str(REPO_ROOT)):
+        filename = os.path.relpath(filename, REPO_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
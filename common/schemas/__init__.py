@@ -1 +1 @@
-from . import ffxiv, paissa
+from . import ffxiv, lite, paissa
@@ -4,11 +4,19 @@ See https://github.com/zhudotexe/FFXIV_PaissaHouse/tree/main/Structures
 """
 import enum
 
-from pydantic import BaseModel, conlist, constr
+from pydantic import BaseModel, conint, conlist, constr
 
 from common import models
 
 
+# the ranges of the fixed-width fields that packets are archived in (see common.eventcodec); ward and plot numbers are
+# further limited to the byte they take in a plot key (see common.plotkey)
+UInt8 = conint(ge=0, le=0xFF)
+Int16 = conint(ge=-0x8000, le=0x7FFF)
+UInt16 = conint(ge=0, le=0xFFFF)
+UInt32 = conint(ge=0, le=0xFFFFFFFF)
+
+
 # ---- substructures ----
 class HousingFlags(enum.IntFlag):
     PlotOwned = 1 << 0
@@ -37,16 +45,16 @@ class LotteryPhase(enum.IntEnum):
 
 
 class LandIdent(BaseModel):
-    LandId: int
-    WardNumber: int
-    TerritoryTypeId: int
-    WorldId: int
+    LandId: Int16
+    WardNumber: UInt8
+    TerritoryTypeId: UInt16
+    WorldId: UInt16
 
 
 class HouseInfoEntry(BaseModel):
-    HousePrice: int
+    HousePrice: UInt32
     InfoFlags: HousingFlags
-    HouseAppeals: conlist(int, min_items=3, max_items=3)
+    HouseAppeals: conlist(UInt8, min_items=3, max_items=3)
     EstateOwnerName: constr(max_length=32)
 
 
@@ -92,15 +100,15 @@ class HousingWardInfo(BaseFFXIVPacket):
 class LotteryInfo(BaseFFXIVPacket):
     event_type = models.EventType.LOTTERY_INFO
 
-    WorldId: int
-    DistrictId: int
-    WardId: int
-    PlotId: int
+    WorldId: UInt16
+    DistrictId: UInt16
+    WardId: UInt8
+    PlotId: UInt8
     PurchaseType: PurchaseType
     TenantType: TenantType
     AvailabilityType: LotteryPhase
-    PhaseEndsAt: int
-    EntryCount: int
+    PhaseEndsAt: UInt32
+    EntryCount: UInt32
 
 
 EVENT_TYPES = {
@@ -119,6 +119,84 @@ class WorldDetail(BaseModel):
     oldest_plot_time: float
 
 
+class DistrictFreshness(BaseModel):
+    id: int
+    name: str
+    oldest_ward_time: float  # 0 if any ward in the district has never been seen
+    num_stale_wards: int  # wards not seen in the last 24 hours
+
+
+class WorldFreshness(BaseModel):
+    id: int
+    name: str
+    oldest_ward_time: float
+    num_stale_wards: int
+    districts: List[DistrictFreshness]
+
+
+class LotteryCycleSummary(BaseModel):
+    id: int
+    entry_start_time: float
+    entry_end_time: float
+    built_time: float
+
+
+class LotteryPlotResult(BaseModel):
+    world_id: int
+    district_id: int
+    ward_number: int
+    plot_number: int
+    size: int
+    price: Optional[int]
+    lotto_entries: Optional[int]  # None if the plot was never seen with an entry count
+    purchase_system: PurchaseSystem
+
+
+class LotteryAggregate(BaseModel):
+    world_id: int
+    district_id: int
+    size: int
+    num_plots: int
+    num_entries: int
+    max_entries: int
+    num_plots_without_entries: int
+
+
+class LotteryCycleDetail(LotteryCycleSummary):
+    num_plots: int
+    aggregates: List[LotteryAggregate]  # by world, district, and house size
+    plots: List[LotteryPlotResult]  # most entries first
+
+
+class MarketSizeStats(BaseModel):
+    size: int
+    num_sales_1d: int
+    num_sales_7d: int
+    num_sales_30d: int
+    median_hours_to_sell: Optional[float]  # of FCFS sales in the last 30 days with a known open time
+    num_lottery_plots: int  # in the latest summarized lottery cycle
+    num_lottery_entries: int
+    num_lottery_plots_without_entries: int
+    mean_lottery_entries: Optional[float]  # None if there were no lottery plots
+
+
+class WorldMarket(BaseModel):
+    id: int
+    name: str
+    generated_time: float
+    lottery_cycle: Optional[int]  # the cycle the lottery stats are from, None if no cycle has been summarized
+    sizes: List[MarketSizeStats]
+
+
+class DatacenterMarket(BaseModel):
+    id: int
+    name: str
+    generated_time: float
+    lottery_cycle: Optional[int]
+    sizes: List[MarketSizeStats]
+    worlds: List[WorldMarket]
+
+
 class TemporarilyDisabled(BaseModel):
     """Temporary response model used to indicate that an endpoint is disabled due to high load."""
 
@@ -0,0 +1,124 @@
+"""
+Database maintenance tasks, meant to be run from cron with the same environment as the API/worker.
+
+    python maintenance.py partitions [--weeks-ahead N]
+        Creates the weekly partitions of plot_states, plot_states_hot and events ahead of time.
+    python maintenance.py retire [--retain-days N] [--detach-only]
+        Detaches and drops partitions past retention (see scripts/offload.sh).
+    python maintenance.py pack-events [--no-delta] [--batch-size N]
+        Converts events stored as JSON to the packed format (see common/eventcodec.py).
+    python maintenance.py csv-dump <path> [--fetch-size N]
+        Writes every plot state to <path> as gzipped CSV (run by the API for /csv/dump, see common/csvexport.py).
+    python maintenance.py csv-archive [--overlap SECONDS]
+        Adds a segment of the states changed since the last one to the CSV archive (see common/csvexport.py).
+    python maintenance.py lottery [--cycle N] [--rebuild]
+        Summarizes the results of the last lottery cycle whose entry period ended, if not yet done (see /lottery).
+    python maintenance.py parquet-dump <path> [--fetch-size N]
+        Writes every plot state to <path> as Parquet (needs pyarrow, see common/parquetexport.py).
+"""
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from common import config, crud, csvexport, eventcodec, models, parquetexport, partitions
+from common.database import SessionLocal, engine
+
+log = logging.getLogger("maintenance")
+logging.basicConfig(level=config.LOGLEVEL)
+
+
+def cmd_partitions(args):
+    models.Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        partitions.ensure_partitions(db, weeks_ahead=args.weeks_ahead)
+
+
+def cmd_retire(args):
+    with SessionLocal() as db:
+        retired = partitions.retire_partitions(db, retain_days=args.retain_days, drop=not args.detach_only)
+    log.info(f"Retired {len(retired)} partitions: {retired}")
+
+
+def cmd_pack_events(args):
+    with SessionLocal() as read_db, SessionLocal() as write_db:
+        converted = eventcodec.pack_legacy_events(
+            read_db, write_db, delta=not args.no_delta, batch_size=args.batch_size
+        )
+    log.info(f"Packed {converted} events")
+
+
+def cmd_csv_dump(args):
+    with SessionLocal() as db:
+        csvexport.write_state_dump(db, Path(args.path), fetch_size=args.fetch_size)
+
+
+def cmd_csv_archive(args):
+    with SessionLocal() as db:
+        csvexport.write_archive_segment(db, overlap=args.overlap, fetch_size=args.fetch_size)
+
+
+def cmd_lottery(args):
+    if config.DB_TYPE != "postgresql":  # the summary query uses DISTINCT ON
+        log.error(f"Lottery cycles can only be summarized on postgresql, not {config.DB_TYPE}")
+        return
+    cycle = args.cycle
+    if cycle is None:
+        cycle = crud.last_ended_lottery_cycle(time.time() - config.LOTTERY_BUILD_DELAY)
+    with SessionLocal() as db:
+        if crud.get_lottery_cycle(db, cycle) is not None and not args.rebuild:
+            log.info(f"Lottery cycle {cycle} is already summarized")
+            return
+        num_plots = crud.build_lottery_cycle(db, cycle)
+    log.info(f"Summarized {num_plots} plots in lottery cycle {cycle}")
+
+
+def cmd_parquet_dump(args):
+    with SessionLocal() as db:
+        parquetexport.write_state_dump(db, Path(args.path), fetch_size=args.fetch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PaissaDB database maintenance")
+    subparsers = parser.add_subparsers(required=True)
+
+    p = subparsers.add_parser("partitions", help="create partitions ahead of time")
+    p.add_argument("--weeks-ahead", type=int, default=2)
+    p.set_defaults(func=cmd_partitions)
+
+    p = subparsers.add_parser("retire", help="detach and drop partitions past retention")
+    p.add_argument("--retain-days", type=float, default=9)
+    p.add_argument("--detach-only", action="store_true", help="keep retired partitions as standalone tables")
+    p.set_defaults(func=cmd_retire)
+
+    p = subparsers.add_parser("pack-events", help="convert JSON events to the packed format")
+    p.add_argument("--no-delta", action="store_true", help="do not delta-encode ward info events")
+    p.add_argument("--batch-size", type=int, default=1000)
+    p.set_defaults(func=cmd_pack_events)
+
+    p = subparsers.add_parser("csv-dump", help="write the full plot state dump")
+    p.add_argument("path")
+    p.add_argument("--fetch-size", type=int, default=config.CSV_DUMP_FETCH_SIZE)
+    p.set_defaults(func=cmd_csv_dump)
+
+    p = subparsers.add_parser("csv-archive", help="add a segment of the changed states to the CSV archive")
+    p.add_argument("--overlap", type=float, default=config.CSV_ARCHIVE_OVERLAP)
+    p.add_argument("--fetch-size", type=int, default=config.CSV_DUMP_FETCH_SIZE)
+    p.set_defaults(func=cmd_csv_archive)
+
+    p = subparsers.add_parser("lottery", help="summarize the results of a lottery cycle")
+    p.add_argument("--cycle", type=int, help="the cycle to summarize (default: the last one whose entry period ended)")
+    p.add_argument("--rebuild", action="store_true", help="summarize the cycle again if it already was")
+    p.set_defaults(func=cmd_lottery)
+
+    p = subparsers.add_parser("parquet-dump", help="write the full plot state dump as parquet")
+    p.add_argument("path")
+    p.add_argument("--fetch-size", type=int, default=config.CSV_DUMP_FETCH_SIZE)
+    p.set_defaults(func=cmd_parquet_dump)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,19 @@
+import threading
 import time
-from typing import Optional
+from typing import Optional, Tuple
 
 import jwt
+from cachetools import TTLCache
 from fastapi import HTTPException, Header
 
 from common import config, schemas
+from . import metrics
+
+# token -> (decoded sweeper, expiry timestamp or None); only successfully verified tokens are ever cached
+_token_cache: "TTLCache[str, Tuple[schemas.paissa.JWTSweeper, Optional[float]]]" = TTLCache(
+    maxsize=config.JWT_CACHE_SIZE, ttl=config.JWT_CACHE_TTL
+)
+_token_cache_lock = threading.Lock()  # dependencies run in the threadpool, and TTLCache is not thread-safe
 
 
 def maybe(authorization: Optional[str] = Header(None)) -> Optional[schemas.paissa.JWTSweeper]:
@@ -38,7 +47,31 @@ def create_session_token(hello: schemas.paissa.Hello) -> str:
 
 
 def decode_token(token: str) -> schemas.paissa.JWTSweeper:
-    claim = jwt.decode(
+    """
+    Decodes and verifies a session token, returning the sweeper it was issued to.
+    Verified tokens are cached for up to JWT_CACHE_TTL seconds, but never past their expiry.
+    """
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+    if cached is not None:
+        sweeper, expires_at = cached
+        if expires_at is None or time.time() < expires_at:
+            metrics.jwt_cache_lookups.labels("hit").inc()
+            return sweeper
+        # expired: drop it and let the full decode raise the right error
+        with _token_cache_lock:
+            _token_cache.pop(token, None)
+    metrics.jwt_cache_lookups.labels("miss").inc()
+
+    claim = _decode_token_uncached(token)
+    sweeper = schemas.paissa.JWTSweeper(**claim)
+    with _token_cache_lock:
+        _token_cache[token] = (sweeper, claim.get("exp"))
+    return sweeper
+
+
+def _decode_token_uncached(token: str) -> dict:
+    return jwt.decode(
         token,
         key=config.JWT_SECRET_PAISSAHOUSE,
         algorithms=["HS256"],
@@ -46,4 +79,3 @@ def decode_token(token: str) -> schemas.paissa.JWTSweeper:
         audience=config.JWT_AUDIENCES,
         issuer=config.JWT_ISSUER,
     )
-    return schemas.paissa.JWTSweeper(**claim)
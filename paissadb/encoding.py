@@ -0,0 +1,61 @@
+"""
+Decompression of request bodies sent with a Content-Encoding (used by /ingest/binary).
+zstd is only supported if the optional zstandard package is installed.
+"""
+import io
+import zlib
+from typing import Optional
+
+from fastapi import HTTPException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SUPPORTED_ENCODINGS = ["identity", "gzip", "deflate"] + (["zstd"] if zstandard is not None else [])
+_DECODE_ERRORS = (zlib.error, EOFError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+_CHUNK_SIZE = 64 * 1024
+
+
+def decompress(body: bytes, content_encoding: Optional[str], max_size: int) -> bytes:
+    """
+    Decodes a request body according to its Content-Encoding header. Raises an HTTPException if the encoding is not
+    supported (415), the body is corrupt (400), or it decompresses to more than *max_size* bytes (413).
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    try:
+        if encoding == "identity":
+            out = body
+        elif encoding == "gzip":
+            out = _decompress_zlib(body, zlib.MAX_WBITS | 16, max_size)
+        elif encoding == "deflate":
+            out = _decompress_zlib(body, zlib.MAX_WBITS, max_size)
+        elif encoding == "zstd" and zstandard is not None:
+            out = _decompress_zstd(body, max_size)
+        else:
+            raise HTTPException(
+                415, f"Unsupported Content-Encoding {encoding!r}, supported: {', '.join(SUPPORTED_ENCODINGS)}"
+            )
+    except _DECODE_ERRORS as e:
+        raise HTTPException(400, f"Invalid {encoding} body: {e}")
+    if len(out) > max_size:
+        raise HTTPException(413, f"Body is larger than {max_size} bytes")
+    return out
+
+
+def _decompress_zlib(body: bytes, wbits: int, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj(wbits)
+    # stop one byte past the limit so that oversized bodies are never fully inflated
+    out = decompressor.decompress(body, max_size + 1)
+    if not decompressor.eof and len(out) <= max_size:
+        raise EOFError("compressed body is truncated")
+    return out
+
+
+def _decompress_zstd(body: bytes, max_size: int) -> bytes:
+    out = bytearray()
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+        while len(out) <= max_size and (chunk := reader.read(_CHUNK_SIZE)):
+            out += chunk
+    return bytes(out)
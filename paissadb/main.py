@@ -1,6 +1,6 @@
 import asyncio
-import csv
 import datetime
+import json
 import logging
 import sys
 import time
@@ -9,18 +9,22 @@ from typing import List, Optional
 
 import jwt as jwtlib  # name conflict with jwt query param in /ws
 import sentry_sdk
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, WebSocket, status
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request, WebSocket, status
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sqlalchemy.orm import Session
 
-from common import calc, config, crud, schemas
-from common.database import get_db, redis
+from common import calc, config, crud, eventcodec, schemas
+from common.database import LOTTERY_CACHE_KEY_PREFIX, TTL_ONE_HOUR, get_db, redis
+from common.profiling import SamplingProfiler
 from common.utils import REPO_ROOT, executor
-from . import auth, metrics, ws
+from . import auth, encoding, market, metrics, ratelimit, ws
 
 log = logging.getLogger(__name__)
 if "debug" in sys.argv:
@@ -44,21 +48,91 @@ if config.SENTRY_DSN is not None:
     app.add_middleware(SentryAsgiMiddleware)
 # Prometheus
 metrics.register(app)
+# Profiling
+profiler = SamplingProfiler("api")
+if profiler.enabled:
+
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        with profiler.section():
+            return await call_next(request)
 
 
 # ==== HTTP ====
 # --- ingest ---
-@app.post("/ingest", status_code=202)
+async def ingest_packets(request: Request) -> List[schemas.lite.Packet]:
+    """
+    Parses the body of an ingest request with the fast packet decoder (schemas.lite), raising the same validation
+    errors FastAPI would for a List[schemas.ffxiv.BaseFFXIVPacket] body.
+    """
+    body = await request.body()
+    try:
+        return schemas.lite.parse_packets(json.loads(body))
+    except json.JSONDecodeError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body", e.pos))], body=e.doc)
+    except UnicodeDecodeError:
+        # what FastAPI answers for a body it cannot parse
+        raise HTTPException(400, "There was an error parsing the body")
+    except ValidationError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body",))], body=body)
+
+
+INGEST_REQUEST_BODY = {
+    "content": {"application/json": {"schema": {"type": "array", "items": {"type": "object"}}}},
+    "required": True,
+}
+
+
+@app.post("/ingest", status_code=202, openapi_extra={"requestBody": INGEST_REQUEST_BODY})
 async def bulk_ingest(
-    data: List[schemas.ffxiv.BaseFFXIVPacket],
-    sweeper: schemas.paissa.JWTSweeper = Depends(auth.required),
-    db: Session = Depends(get_db),
+    # the rate limit is checked first so that rejected requests are not decoded
+    sweeper: schemas.paissa.JWTSweeper = Depends(ratelimit.ingest),
+    data: List[schemas.lite.Packet] = Depends(ingest_packets),
 ):
-    await crud.bulk_ingest(db, data, sweeper)
-    return {"message": "OK", "accepted": len(data)}
+    return await _ingest(data, sweeper)
+
+
+INGEST_BINARY_REQUEST_BODY = {
+    "content": {"application/octet-stream": {"schema": {"type": "string", "format": "binary"}}},
+    "required": True,
+}
 
 
-@app.post("/hello")
+@app.post("/ingest/binary", status_code=202, openapi_extra={"requestBody": INGEST_BINARY_REQUEST_BODY})
+async def bulk_ingest_binary(
+    request: Request,
+    sweeper: schemas.paissa.JWTSweeper = Depends(ratelimit.ingest),
+):
+    """
+    Like /ingest, but takes the packets in the packed format described in common/eventcodec.py
+    (eventcodec.encode_ingest_body), optionally compressed with Content-Encoding: gzip, deflate or zstd.
+    """
+    body = encoding.decompress(
+        await request.body(), request.headers.get("content-encoding"), max_size=config.INGEST_MAX_BODY_SIZE
+    )
+    try:
+        data = eventcodec.decode_ingest_body(body)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    return await _ingest(data, sweeper)
+
+
+async def _ingest(data: List[schemas.lite.Packet], sweeper: schemas.paissa.JWTSweeper):
+    try:
+        accepted = await crud.bulk_ingest(data, sweeper, queue_size=metrics.event_queue_size())
+    except crud.IngestRejected as e:
+        metrics.ingest_rejected_requests.inc()
+        body = schemas.paissa.TemporarilyDisabled(
+            message="The event queue is backed up, please retry later.",
+            until=time.time() + e.retry_after,
+            indefinite=False,
+        )
+        return JSONResponse(body.dict(), status_code=503, headers={"Retry-After": str(e.retry_after)})
+    metrics.ingest_dropped_packets.inc(len(data) - accepted)
+    return {"message": "OK", "accepted": accepted}
+
+
+@app.post("/hello", dependencies=[Depends(ratelimit.hello)])
 def hello(
     data: schemas.paissa.Hello,
     # sweeper: schemas.paissa.JWTSweeper = Depends(auth.required),
@@ -108,6 +182,35 @@ def get_world(world_id: int, db: Session = Depends(get_db)):
     )
 
 
+# declared before /worlds/{world_id}/{district_id}, which would otherwise match it
+@app.get("/worlds/{world_id}/market", response_model=schemas.paissa.WorldMarket)
+async def get_world_market(world_id: int):
+    """Returns a world's sale counts, median time to sell, and lottery entries by house size, as of generated_time."""
+    data = await market.get_world_market(world_id)
+    if data is None:
+        await _raise_market_not_found("World not found")
+    return Response(data, media_type="application/json")
+
+
+@app.get("/datacenters/{datacenter_id}/market", response_model=schemas.paissa.DatacenterMarket)
+async def get_datacenter_market(datacenter_id: int):
+    """Returns the market stats of a datacenter as a whole and of each of its worlds, as of generated_time."""
+    data = await market.get_datacenter_market(datacenter_id)
+    if data is None:
+        await _raise_market_not_found("Datacenter not found")
+    return Response(data, media_type="application/json")
+
+
+async def _raise_market_not_found(detail: str):
+    if not market.ENABLED:
+        raise HTTPException(501, "Market stats are only available with a PostgreSQL database")
+    if await market.get_generated_time() is None:
+        raise HTTPException(
+            503, "Market stats have not been computed yet", headers={"Retry-After": str(market.LOCK_POLL_INTERVAL)}
+        )
+    raise HTTPException(404, detail)
+
+
 @app.get("/worlds/{world_id}/{district_id}", response_model=schemas.paissa.DistrictDetail)
 def get_district_detail(world_id: int, district_id: int, db: Session = Depends(get_db)):
     world = crud.get_world_by_id(db, world_id)
@@ -118,6 +221,59 @@ def get_district_detail(world_id: int, district_id: int, db: Session = Depends(g
     return calc.get_district_detail(db, world, district)
 
 
+@app.get("/freshness", response_model=List[schemas.paissa.WorldFreshness])
+async def get_freshness():
+    """Returns how recently each world's wards were swept, without touching the db."""
+    return await crud.get_world_freshness()
+
+
+# --- lottery ---
+@app.get("/lottery", response_model=List[schemas.paissa.LotteryCycleSummary])
+def list_lottery_cycles(db: Session = Depends(get_db)):
+    """Lists the lottery cycles whose results have been summarized, latest first."""
+    return [calc.lottery_cycle_summary(cycle) for cycle in crud.get_lottery_cycles(db)]
+
+
+@app.get("/lottery/{cycle}", response_model=schemas.paissa.LotteryCycleDetail)
+async def get_lottery_cycle(cycle: int, db: Session = Depends(get_db)):
+    """Returns the final entry counts of each lottery plot in a cycle, and their totals by world/district/size."""
+    data = await _cached_lottery_cycle(db, cycle, "json")
+    return Response(data, media_type="application/json")
+
+
+@app.get("/lottery/{cycle}/csv")
+async def get_lottery_cycle_csv(cycle: int, db: Session = Depends(get_db)):
+    """Returns the final entry counts of each lottery plot in a cycle as CSV, most entries first."""
+    data = await _cached_lottery_cycle(db, cycle, "csv")
+    return Response(
+        data, media_type="text/csv", headers={"Content-Disposition": f"attachment; filename=lottery-{cycle}.csv"}
+    )
+
+
+async def _cached_lottery_cycle(db: Session, cycle: int, fmt: str) -> str:
+    """
+    The results of a cycle only change if it is summarized again (see maintenance.py lottery), so they are rendered
+    once and cached in redis.
+    """
+    key = f"{LOTTERY_CACHE_KEY_PREFIX}:{cycle}:{fmt}"
+    if (data := await redis.get(key)) is not None:
+        return data
+
+    def _render():
+        db_cycle = crud.get_lottery_cycle(db, cycle)
+        if db_cycle is None:
+            return None
+        if fmt == "csv":
+            return calc.lottery_cycle_csv(db, db_cycle)
+        return calc.lottery_cycle_detail(db, db_cycle).json()
+
+    data = await executor(_render)
+    if data is None:
+        raise HTTPException(404, "Lottery cycle not found")
+    await redis.set(key, data, ex=TTL_ONE_HOUR)
+    return data
+
+
 # --- CSV export ---
 # @app.get("/csv/entries")
 # def get_entries_csv(db: Session = Depends(get_db)):
@@ -143,65 +299,42 @@ def get_district_detail(world_id: int, district_id: int, db: Session = Depends(g
 
 CSV_CACHE = REPO_ROOT / "_csv_cache"
 CSV_CACHE.mkdir(exist_ok=True)
+CSV_DUMP_LOCK_TTL = 3600  # in case the API dies mid-dump
 
 
 @app.get("/csv/dump")
-async def get_csv_dump(bg: BackgroundTasks, db: Session = Depends(get_db)):
-    """Exports the latest db state dump."""
+async def get_csv_dump(bg: BackgroundTasks):
+    """Exports the latest db state dump as gzipped CSV."""
     today = datetime.date.today()
-    fp = CSV_CACHE / f"{today.isoformat()}-export.csv"
+    fp = CSV_CACHE / f"{today.isoformat()}-export.csv.gz"
 
     # clear the dir and create the file if not exists
     if await redis.exists("csv_dump_lock"):
         return "Dump in progress, please wait..."
 
     if not fp.exists():
-        bg.add_task(_do_csv_dump, fp, db)
-        return "Beginning dump, please refresh in ~2 minutes..."
-
-    return FileResponse(fp, filename=fp.name)
-
-
-async def _do_csv_dump(fp, db):
-    def _run():
-        for old_fp in CSV_CACHE.glob("*.csv"):
-            old_fp.unlink(missing_ok=True)
-
-        with open(fp, "w") as f:
-            writer = csv.DictWriter(
-                f,
-                fieldnames=(
-                    "id",
-                    "world",
-                    "district",
-                    "ward_number",
-                    "plot_number",
-                    "house_size",
-                    "lotto_entries",
-                    "price",
-                    "first_seen",
-                    "last_seen",
-                    "is_owned",
-                    "purchase_system",
-                    "owner_name_hash",
-                    "owner_name_has_space",
-                    "owner_name_len",
-                    "possible_character_name",
-                    "lotto_phase",
-                    "lotto_phase_until",
-                ),
-            )
-            writer.writeheader()
-            for row in crud.do_csv_state_dump(db):
-                writer.writerow(row._mapping)
+        bg.add_task(_do_csv_dump, fp)
+        return "Beginning dump, please refresh in a few minutes..."
+
+    return FileResponse(fp, filename=fp.name, media_type="application/gzip")
 
+
+async def _do_csv_dump(fp):
     rv = str(uuid.uuid4())
     # acquire lock
-    resp = await redis.set("csv_dump_lock", rv, nx=True, ex=300)
+    resp = await redis.set("csv_dump_lock", rv, nx=True, ex=CSV_DUMP_LOCK_TTL)
     if resp is None:
         return
-    # run
-    await executor(_run)
+    # run, in a process of its own (see common/csvexport.py)
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, str(REPO_ROOT / "maintenance.py"), "csv-dump", str(fp), cwd=REPO_ROOT
+    )
+    if await proc.wait() == 0:
+        for old_fp in CSV_CACHE.iterdir():
+            if old_fp != fp:
+                old_fp.unlink(missing_ok=True)
+    else:
+        log.error(f"CSV dump exited with code {proc.returncode}")
     await asyncio.sleep(10)
     # unlock
     if (await redis.get("csv_dump_lock")) == rv:
@@ -222,6 +355,9 @@ async def root():
 @app.websocket("/ws")
 async def plot_updates(websocket: WebSocket, jwt: Optional[str] = None, db: Session = Depends(get_db)):
     if jwt is None:
+        if await ratelimit.ws_limiter.hit(ratelimit.client_ip(websocket)) is not None:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
         await ws.connect(db, websocket, None)
         return
 
@@ -241,6 +377,10 @@ async def on_startup():
     # this never gets cancelled explicitly, it's just killed when the app dies
     asyncio.create_task(ws.broadcast_listener())
     asyncio.create_task(metrics.metrics_task())
+    if market.ENABLED:
+        asyncio.create_task(market.market_task())
+    else:
+        log.info(f"Market stats are not supported on {config.DB_TYPE}, not computing them")
 
 
 @app.on_event("shutdown")
@@ -0,0 +1,78 @@
+"""
+Market stats (/worlds/{id}/market and /datacenters/{id}/market), computed from plot_sales and lottery_results by a
+background task every MARKET_REFRESH_INTERVAL seconds and served from redis. Each API process runs the task, but only
+the one holding the refresh lock computes them in a given interval.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Optional
+
+from common import calc, config
+from common.database import MARKET_KEY_PREFIX, SessionLocal, redis
+from common.utils import executor
+
+log = logging.getLogger(__name__)
+
+LOCK_KEY = f"{MARKET_KEY_PREFIX}:lock"
+GENERATED_KEY = f"{MARKET_KEY_PREFIX}:generated"
+LOCK_POLL_INTERVAL = 60
+CACHE_TTL_INTERVALS = 4  # stats expire after this many refresh intervals, in case refreshes stop
+# the stats queries use postgres aggregates (FILTER, PERCENTILE_CONT), and the lottery stats come from
+# maintenance.py lottery, which also only runs on postgres
+ENABLED = config.DB_TYPE == "postgresql"
+
+
+# ==== tasks ====
+async def market_task():
+    """Refreshes the market stats whenever no API process has done so in the last MARKET_REFRESH_INTERVAL seconds."""
+    while True:
+        try:
+            if await redis.set(LOCK_KEY, str(uuid.uuid4()), nx=True, ex=config.MARKET_REFRESH_INTERVAL):
+                await refresh()
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            log.exception("Failed to refresh market stats:")
+            await redis.delete(LOCK_KEY)  # let any process retry at its next poll
+        finally:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+async def refresh():
+    """Computes the market stats of every world and datacenter and replaces the cached ones at once."""
+
+    def _compute():
+        with SessionLocal() as db:
+            return calc.market_details(db, time.time())
+
+    start = time.monotonic()
+    worlds, datacenters = await executor(_compute)
+    ttl = config.MARKET_REFRESH_INTERVAL * CACHE_TTL_INTERVALS
+    pipeline = redis.pipeline(transaction=True)
+    for world in worlds:
+        await pipeline.set(f"{MARKET_KEY_PREFIX}:world:{world.id}", world.json(), ex=ttl)
+    for datacenter in datacenters:
+        await pipeline.set(f"{MARKET_KEY_PREFIX}:datacenter:{datacenter.id}", datacenter.json(), ex=ttl)
+    generated_time = worlds[0].generated_time if worlds else time.time()
+    await pipeline.set(GENERATED_KEY, generated_time, ex=ttl)
+    await pipeline.execute()
+    log.info(f"Refreshed market stats of {len(worlds)} worlds in {time.monotonic() - start:.2f}s")
+
+
+# ==== cache ====
+async def get_world_market(world_id: int) -> Optional[str]:
+    """Returns the cached market stats of a world as JSON, or None if there are none."""
+    return await redis.get(f"{MARKET_KEY_PREFIX}:world:{world_id}")
+
+
+async def get_datacenter_market(datacenter_id: int) -> Optional[str]:
+    """Returns the cached market stats of a datacenter as JSON, or None if there are none."""
+    return await redis.get(f"{MARKET_KEY_PREFIX}:datacenter:{datacenter_id}")
+
+
+async def get_generated_time() -> Optional[float]:
+    """Returns when the cached market stats were computed, or None if they have not been yet."""
+    generated_time = await redis.get(GENERATED_KEY)
+    return float(generated_time) if generated_time is not None else None
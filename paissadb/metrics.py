@@ -3,18 +3,23 @@ Prometheus metrics
 """
 import asyncio
 import logging
+import time
 import uuid
 from typing import Callable, Dict, TypeVar
 
-from prometheus_client import Gauge
+from prometheus_client import Counter, Gauge
 from prometheus_fastapi_instrumentator import Instrumentator
+from redis.client import NEVER_DECODE
 
-from common.database import EVENT_QUEUE_KEY, METRICS_KEY_PREFIX, redis
+from common import crud
+from common.database import ARCHIVE_STREAM_KEY, METRICS_KEY_PREFIX, redis
 from . import ws
 
 log = logging.getLogger(__name__)
 _event_queue_size = 0
 _num_ws_conns = 0
+_archive_queue_size = 0
+_archive_lag = 0
 
 WORKER_ID = str(uuid.uuid4())  # random uuid for aggregate metrics
 AGG_METRICS_REFRESH_TIME = 15
@@ -25,12 +30,13 @@ T = TypeVar("T")
 # ==== tasks ====
 async def metrics_task():
     """Updates various metrics every 15 seconds."""
-    global _event_queue_size, _num_ws_conns  # :(
+    global _event_queue_size, _num_ws_conns, _archive_queue_size, _archive_lag  # :(
     while True:
         try:
             await _update_agg_metrics()
             _num_ws_conns = await _fetch_agg_metric("ws_conns", strategy=sum_values)
-            _event_queue_size = await redis.zcard(EVENT_QUEUE_KEY)
+            _event_queue_size = await crud.get_event_queue_size()
+            _archive_queue_size, _archive_lag = await _archive_backlog()
         except asyncio.CancelledError:
             break
         except Exception:
@@ -51,6 +57,42 @@ event_qsize.set_function(lambda: _event_queue_size)
 ws_conns = Gauge("ws_conns", "The number of clients connected to the websocket")
 ws_conns.set_function(lambda: _num_ws_conns)
 
+archive_qsize = Gauge("archive_qsize", "The number of ingested events waiting to be archived")
+archive_qsize.set_function(lambda: _archive_queue_size)
+
+archive_lag_seconds = Gauge("archive_lag_seconds", "The age of the oldest ingested event waiting to be archived")
+archive_lag_seconds.set_function(lambda: _archive_lag)
+
+ingest_dropped_packets = Counter(
+    "ingest_dropped_packets", "Ingested packets that were not queued (by admission control, or invalid)"
+)
+ingest_rejected_requests = Counter("ingest_rejected_requests", "Ingest requests rejected because the queue is full")
+
+ratelimit_rejections = Counter("ratelimit_rejections", "Requests rejected by a rate limit", ["limit"])
+# not labelled by sweeper, since there is no bound on the number of sweepers; the cids are logged instead
+sweeper_ratelimit_rejections = Counter(
+    "sweeper_ratelimit_rejections", "Ingest requests rejected by the per-sweeper rate limit"
+)
+
+jwt_cache_lookups = Counter("jwt_cache_lookups", "Lookups in the verified JWT cache", ["result"])
+
+
+def event_queue_size() -> int:
+    """The size of the event processing queue as of the last refresh (at most 15 seconds old)."""
+    return _event_queue_size
+
+
+async def _archive_backlog():
+    """Returns the length of the archive stream and the age of its oldest entry, in seconds."""
+    length = await redis.xlen(ARCHIVE_STREAM_KEY)
+    # the entries hold binary packed events, which the shared connection cannot decode
+    oldest = await redis.execute_command("XRANGE", ARCHIVE_STREAM_KEY, "-", "+", "COUNT", 1, **{NEVER_DECODE: True})
+    if not oldest:
+        return length, 0
+    oldest_id, _ = oldest[0]
+    # stream entry ids are <ms timestamp>-<seq>
+    return length, max(time.time() - int(oldest_id.split(b"-")[0]) / 1000, 0)
+
 
 # ==== agg metric primitives ====
 async def _update_agg_metrics():
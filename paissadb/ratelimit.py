@@ -0,0 +1,110 @@
+"""
+Token-bucket rate limits, kept in Redis so that they are shared by all API workers.
+
+Each check is a single call of TOKEN_BUCKET_SCRIPT, which refills the bucket by the time since it was last touched
+(using the Redis server's clock, so API hosts need not agree on the time), takes a token if there is one, and returns
+how long to wait otherwise. Buckets expire once they would be full again.
+
+If Redis is unavailable, requests are let through rather than failing.
+"""
+import logging
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request
+from redis.exceptions import RedisError
+
+from common import config, schemas
+from common.database import RATELIMIT_KEY_PREFIX, redis
+from . import auth, metrics
+
+log = logging.getLogger(__name__)
+
+# KEYS[1]: bucket; ARGV[1]: refill rate (tokens/s); ARGV[2]: burst (bucket size)
+# returns {allowed (0/1), seconds until a token is available (as a string, since Lua numbers are truncated)}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+_token_bucket = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+
+class RateLimiter:
+    def __init__(self, name: str, rate: float, burst: int):
+        """
+        :param name: The name of the limit, used in its keys and metrics.
+        :param rate: The number of requests per second allowed on average, or 0 to disable this limit.
+        :param burst: The number of requests allowed at once.
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    async def hit(self, key) -> Optional[float]:
+        """Takes a token from *key*'s bucket. Returns None if the request is allowed, or the seconds to wait if not."""
+        if not self.enabled:
+            return None
+        try:
+            allowed, wait = await _token_bucket(
+                keys=[f"{RATELIMIT_KEY_PREFIX}:{self.name}:{key}"], args=[self.rate, self.burst]
+            )
+        except RedisError:
+            log.exception(f"Failed to check rate limit {self.name}, allowing request:")
+            return None
+        if allowed:
+            return None
+        metrics.ratelimit_rejections.labels(self.name).inc()
+        return float(wait)
+
+
+ingest_limiter = RateLimiter("ingest", config.RATELIMIT_INGEST_RATE, config.RATELIMIT_INGEST_BURST)
+hello_limiter = RateLimiter("hello", config.RATELIMIT_HELLO_RATE, config.RATELIMIT_HELLO_BURST)
+ws_limiter = RateLimiter("ws", config.RATELIMIT_WS_RATE, config.RATELIMIT_WS_BURST)
+
+
+# ==== dependencies ====
+async def ingest(sweeper: schemas.paissa.JWTSweeper = Depends(auth.required)) -> schemas.paissa.JWTSweeper:
+    """Like auth.required, but also takes a token from the sweeper's ingest bucket."""
+    if (wait := await ingest_limiter.hit(sweeper.cid)) is not None:
+        log.info(f"Rate limited ingest from sweeper {sweeper.cid}, retry in {wait:.1f}s")
+        metrics.sweeper_ratelimit_rejections.inc()
+        raise _too_many_requests(wait)
+    return sweeper
+
+
+async def hello(request: Request):
+    """Takes a token from the client IP's hello bucket."""
+    if (wait := await hello_limiter.hit(client_ip(request))) is not None:
+        raise _too_many_requests(wait)
+
+
+def client_ip(request) -> str:
+    """The address of the client of a request or websocket (behind a proxy, run uvicorn with --proxy-headers)."""
+    return request.client.host if request.client is not None else "unknown"
+
+
+def _too_many_requests(wait: float) -> HTTPException:
+    retry_after = max(int(wait + 0.999), 1)
+    return HTTPException(429, f"Rate limit exceeded, retry in {retry_after} seconds", {"Retry-After": str(retry_after)})
@@ -1,4 +1,5 @@
 -- Deletes events and plot states older than 9 days from when this script is run.
+-- Only for databases from before the 2026_10_partitioning migration; use `maintenance.py retire` after it.
 DELETE
 FROM paissadb.public.events
 WHERE paissadb.public.events.timestamp < EXTRACT(EPOCH FROM NOW() - '9 day'::interval);
@@ -19,19 +19,20 @@ SELECT s.id                        AS id,
            WHEN 0 THEN 'SMALL'
            WHEN 1 THEN 'MEDIUM'
            WHEN 2 THEN 'LARGE' END AS house_size,
-       s.lotto_entries             AS lotto_entries,
-       s.last_seen_price           AS price,
+       h.lotto_entries             AS lotto_entries,
+       h.last_seen_price           AS price,
        s.first_seen                AS first_seen,
-       s.last_seen                 AS last_seen,
-       s.lotto_phase               AS lotto_phase,
-       s.lotto_phase_until         AS lotto_phase_until
+       h.last_seen                 AS last_seen,
+       h.lotto_phase               AS lotto_phase,
+       h.lotto_phase_until         AS lotto_phase_until
 FROM plot_states s
+         JOIN plot_states_hot h ON h.state_id = s.id AND h.first_seen = s.first_seen
          LEFT JOIN plotinfo p ON s.territory_type_id = p.territory_type_id AND s.plot_number = p.plot_number
          LEFT JOIN districts d ON d.id = s.territory_type_id
          LEFT JOIN worlds w ON w.id = s.world_id
          JOIN constants ON TRUE
          JOIN times ON TRUE
 WHERE (lotto_phase_until = times.end_time
-    OR (last_seen >= times.end_time - constants.entry_time AND first_seen < times.end_time))
+    OR (last_seen >= times.end_time - constants.entry_time AND s.first_seen < times.end_time))
   AND is_owned = FALSE
 ORDER BY lotto_entries DESC NULLS LAST;
\ No newline at end of file
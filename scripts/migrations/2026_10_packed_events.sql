@@ -0,0 +1,10 @@
+-- packed_events
+-- Oct 19, 2026
+--
+-- Adds the following columns:
+-- events.packed = Column(LargeBinary, nullable=True)
+--
+-- Existing events can then be converted with `python maintenance.py pack-events`.
+
+ALTER TABLE events
+    ADD COLUMN packed BYTEA;
@@ -0,0 +1,87 @@
+-- partitioning
+-- Oct 19, 2026
+--
+-- Converts plot_states and events to weekly range-partitioned tables (see common/partitions.py):
+-- plot_states: PARTITION BY RANGE (first_seen), primary key (id, first_seen)
+-- events: PARTITION BY RANGE (timestamp), primary key (id, timestamp)
+--
+-- No data is copied: the existing tables are attached as the partitions holding everything before the start of next
+-- week (plot_states_legacy, events_legacy), and are retired by `maintenance.py retire` like any other partition once
+-- they are past retention.
+--
+-- Run `python maintenance.py partitions` right after this to create the default partitions and the partitions for
+-- the following weeks.
+
+BEGIN;
+
+-- ==== plot_states ====
+ALTER TABLE plot_states
+    RENAME TO plot_states_legacy;
+ALTER INDEX plot_states_pkey RENAME TO plot_states_legacy_pkey;
+ALTER INDEX ix_plot_states_loc_last_seen_desc RENAME TO ix_plot_states_legacy_loc_last_seen_desc;
+ALTER INDEX ix_plot_states_last_seen_desc RENAME TO ix_plot_states_legacy_last_seen_desc;
+
+CREATE TABLE plot_states
+(
+    LIKE plot_states_legacy INCLUDING DEFAULTS,
+    PRIMARY KEY (id, first_seen),
+    FOREIGN KEY (territory_type_id, plot_number) REFERENCES plotinfo (territory_type_id, plot_number),
+    FOREIGN KEY (world_id) REFERENCES worlds (id),
+    FOREIGN KEY (territory_type_id) REFERENCES districts (id)
+) PARTITION BY RANGE (first_seen);
+ALTER SEQUENCE plot_states_id_seq OWNED BY plot_states.id;
+
+CREATE INDEX ix_plot_states_loc_last_seen_desc
+    ON plot_states (world_id ASC, territory_type_id ASC, ward_number ASC, plot_number ASC, last_seen DESC);
+CREATE INDEX ix_plot_states_last_seen_desc
+    ON plot_states (last_seen DESC);
+
+-- ==== events ====
+ALTER TABLE events
+    RENAME TO events_legacy;
+ALTER INDEX events_pkey RENAME TO events_legacy_pkey;
+ALTER INDEX ix_events_event_type RENAME TO ix_events_legacy_event_type;
+ALTER INDEX ix_events_sweeper_id RENAME TO ix_events_legacy_sweeper_id;
+ALTER INDEX ix_events_timestamp RENAME TO ix_events_legacy_timestamp;
+
+CREATE TABLE events
+(
+    LIKE events_legacy INCLUDING DEFAULTS,
+    PRIMARY KEY (id, timestamp),
+    FOREIGN KEY (sweeper_id) REFERENCES sweepers (id) ON DELETE SET NULL
+) PARTITION BY RANGE (timestamp);
+ALTER SEQUENCE events_id_seq OWNED BY events.id;
+
+CREATE INDEX ix_events_event_type ON events (event_type);
+CREATE INDEX ix_events_sweeper_id ON events (sweeper_id);
+CREATE INDEX ix_events_timestamp ON events (timestamp);
+
+-- ==== attach legacy tables ====
+-- partitions must have the same primary key as their parent, and the CHECK constraints let ATTACH skip its validation
+-- scan
+DO
+$$
+    DECLARE
+        next_week DOUBLE PRECISION := EXTRACT(EPOCH FROM DATE_TRUNC('week', NOW() AT TIME ZONE 'UTC') + '1 week');
+    BEGIN
+        ALTER TABLE plot_states_legacy
+            ALTER COLUMN first_seen SET NOT NULL,
+            DROP CONSTRAINT plot_states_legacy_pkey,
+            ADD CONSTRAINT plot_states_legacy_pkey PRIMARY KEY (id, first_seen);
+        EXECUTE FORMAT('ALTER TABLE plot_states_legacy ADD CONSTRAINT plot_states_legacy_range CHECK (first_seen < %s)',
+                       next_week);
+        EXECUTE FORMAT('ALTER TABLE plot_states ATTACH PARTITION plot_states_legacy FOR VALUES FROM (MINVALUE) TO (%s)',
+                       next_week);
+
+        ALTER TABLE events_legacy
+            ALTER COLUMN timestamp SET NOT NULL,
+            DROP CONSTRAINT events_legacy_pkey,
+            ADD CONSTRAINT events_legacy_pkey PRIMARY KEY (id, timestamp);
+        EXECUTE FORMAT('ALTER TABLE events_legacy ADD CONSTRAINT events_legacy_range CHECK (timestamp < %s)',
+                       next_week);
+        EXECUTE FORMAT('ALTER TABLE events ATTACH PARTITION events_legacy FOR VALUES FROM (MINVALUE) TO (%s)',
+                       next_week);
+    END
+$$;
+
+COMMIT;
@@ -0,0 +1,24 @@
+-- plot_key
+-- Oct 19, 2026
+--
+-- Adds the following columns:
+-- plot_states.plot_key = Column(BigInteger, Computed(plotkey.PLOT_KEY_SQL, persisted=True))
+--
+-- Replaces the following indexes:
+-- ix_plot_states_loc_last_seen_desc (world_id, territory_type_id, ward_number, plot_number, last_seen DESC)
+--   -> ix_plot_states_plot_key_last_seen_desc (plot_key, last_seen DESC)
+--
+-- Adding a stored generated column rewrites every partition of plot_states, so run this during a maintenance window
+-- with the worker stopped. Run after 2026_10_partitioning.sql.
+
+BEGIN;
+
+ALTER TABLE plot_states
+    ADD COLUMN plot_key BIGINT GENERATED ALWAYS AS (CAST(world_id AS BIGINT) * 4294967296 + territory_type_id * 65536 +
+                                                    ward_number * 256 + plot_number) STORED;
+
+DROP INDEX ix_plot_states_loc_last_seen_desc;
+CREATE INDEX ix_plot_states_plot_key_last_seen_desc
+    ON plot_states (plot_key ASC, last_seen DESC);
+
+COMMIT;
@@ -0,0 +1,73 @@
+-- plot_states_hot
+-- Oct 19, 2026
+--
+-- Moves the columns of plot_states that change on nearly every sweep to a narrow table keyed by state (see the
+-- comment on models.plot_states_hot):
+-- plot_states_hot: PARTITION BY RANGE (first_seen), primary key (state_id, first_seen)
+-- plot_states.{last_seen, last_seen_price, lotto_entries, lotto_phase, lotto_phase_until} -> plot_states_hot
+--
+-- plot_states_hot gets a partition for each partition of plot_states, with the same range (plot_states_legacy ->
+-- plot_states_hot_legacy, plot_states_p20261019 -> plot_states_hot_p20261019, ...), so that `maintenance.py retire`
+-- can detach and drop them together.
+--
+-- Replaces the following indexes:
+-- ix_plot_states_plot_key_last_seen_desc (plot_key, last_seen DESC)
+--   -> ix_plot_states_plot_key_first_seen_desc (plot_key, first_seen DESC)
+-- ix_plot_states_last_seen_desc (last_seen DESC): dropped, since an index on any plot_states_hot column would prevent
+--   in-place (HOT) updates; only background jobs filter on last_seen
+--
+-- Run with the worker stopped, after 2026_10_plot_key.sql and `maintenance.py partitions`. Dropping the columns does
+-- not shrink the existing partitions; their space is reused by new rows, or reclaimed when they are retired.
+
+BEGIN;
+
+CREATE TABLE plot_states_hot
+(
+    state_id          INTEGER NOT NULL,
+    first_seen        FLOAT   NOT NULL,
+    last_seen         FLOAT,
+    last_seen_price   INTEGER,
+    lotto_entries     INTEGER,
+    lotto_phase       INTEGER,
+    lotto_phase_until INTEGER,
+    PRIMARY KEY (state_id, first_seen)
+) PARTITION BY RANGE (first_seen);
+
+-- storage parameters can only be set on the partitions (common.partitions does the same for new ones)
+DO
+$$
+    DECLARE
+        part RECORD;
+    BEGIN
+        FOR part IN SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+                    FROM pg_inherits i
+                             JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'plot_states'::regclass
+            LOOP
+                EXECUTE FORMAT(
+                        'CREATE TABLE %I PARTITION OF plot_states_hot %s '
+                            'WITH (fillfactor = 50, autovacuum_vacuum_scale_factor = 0.02)',
+                        REGEXP_REPLACE(part.name, '^plot_states_', 'plot_states_hot_'), part.bound);
+            END LOOP;
+    END
+$$;
+
+INSERT INTO plot_states_hot (state_id, first_seen, last_seen, last_seen_price, lotto_entries, lotto_phase,
+                             lotto_phase_until)
+SELECT id, first_seen, last_seen, last_seen_price, lotto_entries, lotto_phase, lotto_phase_until
+FROM plot_states;
+
+DROP INDEX ix_plot_states_plot_key_last_seen_desc;
+DROP INDEX ix_plot_states_last_seen_desc;
+
+ALTER TABLE plot_states
+    DROP COLUMN last_seen,
+    DROP COLUMN last_seen_price,
+    DROP COLUMN lotto_entries,
+    DROP COLUMN lotto_phase,
+    DROP COLUMN lotto_phase_until;
+
+CREATE INDEX ix_plot_states_plot_key_first_seen_desc
+    ON plot_states (plot_key ASC, first_seen DESC);
+
+COMMIT;
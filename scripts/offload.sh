@@ -15,12 +15,11 @@ if [[ $diskUsage -lt 50 ]]; then
 fi
 
 # dump, upload to s3
+# the tables are partitioned, and -t would dump none of their partitions' rows (--table-and-children needs pg_dump 16)
 sudo -u paissadb pg_dump --schema-only --no-owner -v -Z 9 paissadb | aws s3 cp - s3://paissadb-historical/paissadb-schema-${timestamp}.sql.gz
-sudo -u paissadb pg_dump --data-only --no-owner -t plot_states -t events -v -Z 3 paissadb | aws s3 cp - s3://paissadb-historical/paissadb-data-${timestamp}.sql.gz
+sudo -u paissadb pg_dump --data-only --no-owner --table-and-children=plot_states --table-and-children=plot_states_hot --table-and-children=events -v -Z 3 paissadb | aws s3 cp - s3://paissadb-historical/paissadb-data-${timestamp}.sql.gz
 
-# if the upload succeeded, delete data older than 1 week
+# if the upload succeeded, drop partitions older than 9 days (needs DB_URI set like the API/worker)
 if [[ $? == 0 ]]; then
-  paissaHome=$(eval echo "~paissadb")  # mild hack but whatever
-  cp ${dir}/delete_1w.sql ${paissaHome}/delete_1w.sql
-  sudo -u paissadb psql -f ${paissaHome}/delete_1w.sql paissadb
+  sudo -u paissadb --preserve-env=DB_URI python3 ${dir}/../maintenance.py retire --retain-days 9
 fi
@@ -0,0 +1,397 @@
+"""
+Plot state history as NumPy column arrays, for reports over all of it without a query (or a Python object) per row.
+
+StateColumns holds one typed array per column of plot_states (with its plot_states_hot columns and the plot's
+house_size), loaded once from the database, from Parquet exports (see common/parquetexport.py), or from an earlier load
+saved with --save. World and district are integer codes, named by world_names and district_names. Reports group
+rows with np.unique and reduce each group with sorted, vectorized operations, so a report over the full history takes
+seconds.
+
+Usage (from the repository root):
+
+    python -m stats.columns REPORT [--parquet PATH... | --archive [DIR] | --load PATH] [--save PATH] [--by KEYS] [--csv]
+
+REPORT is one of:
+    time-to-sell: the hours between a plot opening and selling, as lower and upper bounds (like plot_sales), for the
+                  sales whose open time is known
+    lottery: the number of entries on each open lottery plot state
+    prices: the last seen price of each open plot state
+
+KEYS is a comma-separated list of world, district and size (default: district,size); an empty list reports the
+whole history as one group.
+"""
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from common import crud, csvexport
+from common.calc import HOUSE_SIZE_NAMES
+from common.schemas.paissa import PurchaseSystem
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FETCH_SIZE = 100_000
+QUANTILES = (0.1, 0.5, 0.9)
+ENTRY_BINS = (0, 1, 2, 6, 11, 21)  # lower bounds of the lottery entry histogram buckets
+
+COLUMNS = {
+    "id": np.int64,
+    "world": np.int16,
+    "district": np.int16,
+    "ward_number": np.int16,  # 0-indexed
+    "plot_number": np.int16,  # 0-indexed
+    "house_size": np.int8,  # index into HOUSE_SIZE_NAMES, -1 if unknown
+    "price": np.int32,  # -1 if unknown
+    "lotto_entries": np.int32,  # -1 if unknown
+    "first_seen": np.float64,
+    "last_seen": np.float64,
+    "is_owned": np.bool_,
+    "purchase_system": np.int16,
+    "lotto_phase": np.int8,  # -1 if unknown
+}
+
+LOAD_QUERY = """
+SELECT s.id,
+       s.world_id,
+       s.territory_type_id,
+       s.ward_number,
+       s.plot_number,
+       COALESCE(p.house_size, -1),
+       COALESCE(h.last_seen_price, -1),
+       COALESCE(h.lotto_entries, -1),
+       s.first_seen,
+       h.last_seen,
+       s.is_owned,
+       s.purchase_system,
+       COALESCE(h.lotto_phase, -1)
+FROM plot_states s
+         JOIN plot_states_hot h ON h.state_id = s.id AND h.first_seen = s.first_seen
+         LEFT JOIN plotinfo p ON s.territory_type_id = p.territory_type_id AND s.plot_number = p.plot_number;
+"""
+
+
+class StateColumns:
+    """Every plot state, as one array per column (see COLUMNS), in no particular order."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], world_names: Dict[int, str], district_names: Dict[int, str]):
+        self.columns = columns
+        self.world_names = world_names
+        self.district_names = district_names
+
+    def __getitem__(self, item: str) -> np.ndarray:
+        return self.columns[item]
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    # ==== loading ====
+    @classmethod
+    def from_db(cls, db: Session, fetch_size: int = FETCH_SIZE) -> "StateColumns":
+        """Loads every plot state from the database, streamed *fetch_size* rows at a time."""
+        chunks = {name: [] for name in COLUMNS}
+        result = db.execute(text(LOAD_QUERY), execution_options={"stream_results": True}).yield_per(fetch_size)
+        for rows in result.partitions():
+            for (name, dtype), values in zip(COLUMNS.items(), zip(*rows)):
+                chunks[name].append(np.array(values, dtype=dtype))
+        columns = {
+            name: np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        world_names = {world.id: world.name for world in crud.get_worlds(db)}
+        district_names = {district.id: district.name for district in crud.get_districts(db)}
+        return cls(columns, world_names, district_names)
+
+    @classmethod
+    def from_parquet(cls, paths: Sequence[Path]) -> "StateColumns":
+        """
+        Loads plot states from Parquet exports (e.g. the segments of the CSV archive, in order). A state that appears
+        in more than one file is taken from the last one.
+        """
+        if pyarrow is None:
+            raise RuntimeError("Loading Parquet exports needs the pyarrow package")
+        table = pyarrow.concat_tables([pyarrow.parquet.read_table(path) for path in paths]).unify_dictionaries()
+        world, world_names = _dictionary_codes(table.column("world"))
+        district, district_names = _dictionary_codes(table.column("district"))
+        house_size, size_names = _dictionary_codes(table.column("house_size"))
+        size_lookup = np.array([HOUSE_SIZE_NAMES.index(name) for name in size_names] + [-1], dtype=np.int8)
+        columns = {
+            "world": world,
+            "district": district,
+            "house_size": size_lookup[house_size],  # -1 indexes the trailing -1
+        }
+        for name, dtype in COLUMNS.items():
+            if name not in columns:
+                null = False if dtype is np.bool_ else -1
+                columns[name] = table.column(name).fill_null(null).to_numpy().astype(dtype)
+        # the exports number wards and plots from 1
+        columns["ward_number"] -= 1
+        columns["plot_number"] -= 1
+
+        # keep the last occurrence of each state
+        _, last_from_end = np.unique(columns["id"][::-1], return_index=True)
+        keep = len(table) - 1 - last_from_end
+        columns = {name: columns[name][keep] for name in COLUMNS}
+        return cls(columns, dict(enumerate(world_names)), dict(enumerate(district_names)))
+
+    @classmethod
+    def from_archive(cls, archive_dir: Path = csvexport.ARCHIVE_DIR) -> "StateColumns":
+        """Loads plot states from the Parquet copies of the CSV archive's segments."""
+        manifest = csvexport.load_manifest(archive_dir)
+        paths = [archive_dir / segment["parquet"]["name"] for segment in manifest["segments"] if "parquet" in segment]
+        if not paths:
+            raise ValueError(f"The archive in {archive_dir} has no Parquet segments")
+        return cls.from_parquet(paths)
+
+    @classmethod
+    def load(cls, fp: Path) -> "StateColumns":
+        """Loads columns saved by save()."""
+        with np.load(fp) as data:
+            columns = {name: data[name] for name in COLUMNS}
+            world_names = dict(zip(data["world_codes"].tolist(), data["world_names"].tolist()))
+            district_names = dict(zip(data["district_codes"].tolist(), data["district_names"].tolist()))
+        return cls(columns, world_names, district_names)
+
+    def save(self, fp: Path):
+        """Saves the columns to an .npz file, which loads in a fraction of the time the database takes."""
+        np.savez(
+            fp,
+            **self.columns,
+            world_codes=np.array(list(self.world_names), dtype=np.int64),
+            world_names=np.array(list(self.world_names.values()), dtype=str),
+            district_codes=np.array(list(self.district_names), dtype=np.int64),
+            district_names=np.array(list(self.district_names.values()), dtype=str),
+        )
+
+    # ==== analysis ====
+    def find_sales(self) -> Dict[str, np.ndarray]:
+        """
+        Finds every sale (an open state followed by an owned state of the same plot), like stats.sales. Returns arrays
+        of the index of each sale's first owned state (``state``) and the bounds on when the plot opened and sold
+        (``open_min``, ``open_max``, ``sold_min``, ``sold_max``); open_min is 0 if the plot was never seen owned
+        before it opened.
+        """
+        c = self.columns
+        plot = (
+            (c["world"].astype(np.int64) << 32)
+            | (c["district"].astype(np.int64) << 16)
+            | (c["ward_number"].astype(np.int64) << 8)
+            | c["plot_number"].astype(np.int64)
+        )
+        order = np.lexsort((c["first_seen"], plot))
+        plot, owned = plot[order], c["is_owned"][order]
+        first_seen, last_seen = c["first_seen"][order], c["last_seen"][order]
+
+        new_plot = np.ones(len(order), dtype=bool)
+        new_plot[1:] = plot[1:] != plot[:-1]
+        follows_owned = np.zeros(len(order), dtype=bool)
+        follows_owned[1:] = owned[:-1]
+        # an open run starts at an open state that begins a plot's history or follows an owned state
+        run_start = ~owned & (new_plot | follows_owned)
+        run_first = np.maximum.accumulate(np.where(run_start, np.arange(len(order)), 0))
+
+        sold_at = np.flatnonzero(owned & ~new_plot & ~follows_owned)
+        last_open = sold_at - 1
+        first_open = run_first[last_open]
+        # the state before a run that does not begin its plot's history is owned
+        seen_owned = ~new_plot[first_open]
+        return {
+            "state": order[sold_at],
+            "open_min": np.where(seen_owned, last_seen[first_open - 1], 0),
+            "open_max": first_seen[first_open],
+            "sold_min": last_seen[last_open],
+            "sold_max": first_seen[sold_at],
+        }
+
+    def group_labels(self, key: str, codes: np.ndarray) -> List[str]:
+        if key == "world":
+            return [self.world_names.get(code, str(code)) for code in codes.tolist()]
+        if key == "district":
+            return [self.district_names.get(code, str(code)) for code in codes.tolist()]
+        return [HOUSE_SIZE_NAMES[code] if code >= 0 else "UNKNOWN" for code in codes.tolist()]
+
+    def group_codes(self, key: str) -> np.ndarray:
+        return self.columns["house_size" if key == "size" else key]
+
+
+# ==== grouping ====
+def group(keys: Sequence[np.ndarray], num_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Groups *num_rows* rows by the values of *keys* (arrays of that length; with no keys, all rows are one group).
+    Returns the group of each row, numbered from 0, and the index of a row in each group.
+    """
+    combined = np.zeros(num_rows, dtype=np.int64)
+    for key in keys:
+        uniques, inverse = np.unique(key, return_inverse=True)
+        combined = combined * len(uniques) + inverse.reshape(-1)
+    _, first, groups = np.unique(combined, return_index=True, return_inverse=True)
+    return groups.reshape(-1), first
+
+
+def summarize(groups: np.ndarray, num_groups: int, values: np.ndarray) -> Dict[str, np.ndarray]:
+    """Returns the count, mean and QUANTILES (as nearest ranks) of *values* in each group."""
+    counts = np.bincount(groups, minlength=num_groups)
+    sums = np.bincount(groups, weights=values, minlength=num_groups)
+    order = np.lexsort((values, groups))
+    starts = np.searchsorted(groups[order], np.arange(num_groups))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats = {"count": counts, "mean": sums / counts}
+    for q in QUANTILES:
+        stats[f"p{q * 100:g}"] = values[order][starts + np.floor((counts - 1) * q).astype(np.int64)]
+    return stats
+
+
+def histogram(groups: np.ndarray, num_groups: int, values: np.ndarray, bins: Sequence[int]) -> np.ndarray:
+    """Returns the number of *values* in each group that fall in each bin (of lower bounds *bins*)."""
+    bucket = np.digitize(values, bins) - 1
+    return np.bincount(groups * len(bins) + bucket, minlength=num_groups * len(bins)).reshape(num_groups, len(bins))
+
+
+def _dictionary_codes(column: "pyarrow.ChunkedArray") -> Tuple[np.ndarray, List[str]]:
+    """Returns the dictionary indices of a dictionary-encoded column (-1 where null) and its dictionary."""
+    array = column.combine_chunks()
+    return array.indices.fill_null(-1).to_numpy().astype(np.int16), array.dictionary.to_pylist()
+
+
+# ==== reports ====
+Report = Tuple[List[str], List[list]]
+
+
+def grouped_report(
+    states: StateColumns, by: Sequence[str], rows: np.ndarray, compute: Callable[[np.ndarray, int], Dict]
+) -> Report:
+    """
+    Groups the states at indices *rows* by the keys *by*, and returns a table of the groups with the columns that
+    *compute* returns for them (given the group of each row and the number of groups).
+    """
+    keys = [states.group_codes(key)[rows] for key in by]
+    if not len(rows):
+        return list(by), []
+    groups, first = group(keys, len(rows))
+    stats = compute(groups, len(first))
+    labels = [states.group_labels(key, codes[first]) for key, codes in zip(by, keys)]
+    columns = [np.asarray(values).tolist() for values in stats.values()]
+    return list(by) + list(stats), [list(row) for row in zip(*labels, *columns)]
+
+
+def time_to_sell_report(states: StateColumns, by: Sequence[str]) -> Report:
+    sales = states.find_sales()
+    known = sales["open_min"] > 0
+    hours_min = (sales["sold_min"] - sales["open_max"])[known] / 3600
+    hours_max = (sales["sold_max"] - sales["open_min"])[known] / 3600
+
+    def compute(groups, num_groups):
+        lower = summarize(groups, num_groups, hours_min)
+        upper = summarize(groups, num_groups, hours_max)
+        return {
+            "sales": lower.pop("count"),
+            **{f"min_{k}": v for k, v in lower.items()},
+            **{f"max_{k}": v for k, v in upper.items() if k != "count"},
+        }
+
+    return grouped_report(states, by, sales["state"][known], compute)
+
+
+def lottery_report(states: StateColumns, by: Sequence[str]) -> Report:
+    lottery = (states["purchase_system"] & PurchaseSystem.LOTTERY).astype(bool)
+    rows = np.flatnonzero(lottery & ~states["is_owned"] & (states["lotto_entries"] >= 0))
+    entries = states["lotto_entries"][rows]
+
+    def compute(groups, num_groups):
+        stats = summarize(groups, num_groups, entries)
+        counts = histogram(groups, num_groups, entries, ENTRY_BINS)
+        bounds = list(ENTRY_BINS[1:]) + [None]
+        for i, (low, high) in enumerate(zip(ENTRY_BINS, bounds)):
+            name = str(low) if high == low + 1 else f"{low}+" if high is None else f"{low}-{high - 1}"
+            stats[f"entries_{name}"] = counts[:, i]
+        return stats
+
+    return grouped_report(states, by, rows, compute)
+
+
+def prices_report(states: StateColumns, by: Sequence[str]) -> Report:
+    rows = np.flatnonzero(~states["is_owned"] & (states["price"] > 0))
+    prices = states["price"][rows]
+    return grouped_report(states, by, rows, lambda groups, num_groups: summarize(groups, num_groups, prices))
+
+
+REPORTS = {
+    "time-to-sell": time_to_sell_report,
+    "lottery": lottery_report,
+    "prices": prices_report,
+}
+
+
+# ==== main ====
+def write_report(report: Report, as_csv: bool):
+    header, rows = report
+    if as_csv:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(header)
+        writer.writerows(rows)
+        return
+    cells = [header] + [[f"{v:.1f}" if isinstance(v, float) else str(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(header))]
+    for row in cells:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def load(args) -> StateColumns:
+    if args.parquet:
+        return StateColumns.from_parquet(args.parquet)
+    if args.archive:
+        return StateColumns.from_archive(args.archive)
+    if args.load:
+        return StateColumns.load(args.load)
+    from common.database import SessionLocal
+
+    with SessionLocal() as db:
+        return StateColumns.from_db(db)
+
+
+def parse_keys(value: str) -> List[str]:
+    keys = [key for key in value.split(",") if key]
+    for key in keys:
+        if key not in ("world", "district", "size"):
+            raise argparse.ArgumentTypeError(f"unknown group key: {key}")
+    return keys
+
+
+def main(argv: Iterable[str] = None):
+    parser = argparse.ArgumentParser(description="Reports over the full plot state history.")
+    parser.add_argument("report", choices=REPORTS)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--parquet", nargs="+", type=Path, help="load Parquet exports instead of the database")
+    source.add_argument(
+        "--archive", nargs="?", type=Path, const=csvexport.ARCHIVE_DIR, help="load the CSV archive's Parquet segments"
+    )
+    source.add_argument("--load", type=Path, help="load columns saved with --save")
+    parser.add_argument("--save", type=Path, help="save the loaded columns to an .npz file")
+    parser.add_argument("--by", type=parse_keys, default=["district", "size"], help="world, district and/or size")
+    parser.add_argument("--csv", action="store_true", help="write the report as CSV")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    states = load(args)
+    print(f"Loaded {len(states)} states in {time.monotonic() - start:.2f}s", file=sys.stderr)
+    if args.save:
+        states.save(args.save)
+
+    start = time.monotonic()
+    report = REPORTS[args.report](states, args.by)
+    print(f"Computed {args.report} in {time.monotonic() - start:.2f}s", file=sys.stderr)
+    write_report(report, args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,59 @@
 """
-Saves a CSV of all plot sales to an output folder.
+Saves a CSV of all plot sales to sales.csv in the current directory, or with --backfill, records the sales from before
+the worker started recording them in the plot_sales table.
 
 Methodology:
 
-To reduce the amount of plots in memory at any one point, this script iterates over each district in each world
-independently. It first begins by getting the latest state of all plots (1,440 per district). For each individual plot,
-it then iterates over the plot's history in reverse chronological order searching for state transitions.
+Each world is processed independently, in a pool of NUM_PROCESSES processes. For a world, this script makes a single
+ordered pass over the history of all of its plots (plot_states by plot key, then first_seen, streamed from a
+server-side cursor), keeping only the current plot's open run in memory. A sale is an open state followed by an owned
+state; the time the plot opened is estimated from the owned state before the open run (if any), and the time it sold
+from the last open state and the first owned state after it.
 
-When it encounters a state transition, it uses PaissaDB methods to estimate the earliest and latest time the transition
-could have happened. If the transition was a sale, it determines whether the sale was a relocation using two methods:
-1. If the plot does not have a house built, it's likely not a relocation.
-2. Otherwise, search for any plot on the same world owned by the new owner up to one week prior to the earliest sell
-   time. If any is found, it is likely a relocation. Otherwise, assume it's a first-time buyer.
+A sale is a relocation if the new owner owned another plot on the same world at any time in the week before the
+earliest sell time. To check this without another query per sale, the pass also builds an index of the times each
+owner in the world owned a plot (see stats.utils.OwnerIndex), so memory use is bounded by the size of a world's history
+rather than all of it.
 
-If the transition was an opening, pair it with the next chronological sale. Use these pairs to emit PlotSale records.
+Each process returns the sales of a world as one list of rows, which the main process writes as they complete.
 
-* Note: This script was able to lock all 8 cores of an i9-9900K at 100% for ~20 minutes. I recommend running this on
-  a very capable computer.
+The worker records each sale it sees in plot_sales as it happens, so --backfill only scans the states first seen
+before the earliest sale recorded there; sales that are already recorded are skipped.
 """
+import argparse
 import csv
 import datetime
+import functools
 import multiprocessing
-import os
-import sys
 import time
 from contextlib import contextmanager
-
-from common import calc, crud, models
-from common.database import SessionLocal
-from stats.utils import PlotSale
-
-# threading: setting this to 1 on slower systems and (num cpus) on faster systems is generally fine
-NUM_THREADS = 8
-district_q = multiprocessing.JoinableQueue()
-sale_q = multiprocessing.JoinableQueue()
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from common import crud, models, plotkey
+from common.database import SessionLocal, engine
+from stats.utils import OwnerIndex, PlotSale
+
+NUM_PROCESSES = multiprocessing.cpu_count()
+FETCH_SIZE = 10000
+RELO_WINDOW = 7 * 24 * 60 * 60  # seconds before a sale that the new owner may have owned another plot
+
+SCAN_QUERY = """
+SELECT s.id,
+       s.plot_key,
+       s.first_seen,
+       h.last_seen,
+       s.is_owned,
+       s.owner_name,
+       s.purchase_system,
+       h.last_seen_price
+FROM plot_states s
+         JOIN plot_states_hot h ON h.state_id = s.id AND h.first_seen = s.first_seen
+WHERE s.plot_key BETWEEN :start AND :end
+  AND s.first_seen < :until
+ORDER BY s.plot_key, s.first_seen;
+"""
 
 
 # ==== helpers ====
@@ -46,128 +66,143 @@ def timer(prefix, name, indent=0):
     print(f"{' ' * indent}[{prefix}] finished {name} in {end - start:.2f}s")
 
 
-def is_new_owner(db, plot, sale_details):
-    """
-    Returns whether the current owner of the given plot is a new owner, i.e. if they have not owned another house within
-    the last week.
-    """
-    # if not plot.has_built_house:  # there are cases of people buying a plot and reloing before building a house
-    #     return True
-
-    # time to make a chonky query (~1500ms cold)
-    owned = (
-        db.query(models.Plot)
-        .filter(models.Plot.world_id == plot.world_id)
-        .filter(
-            models.Plot.timestamp < sale_details.est_time_sold_min,
-            models.Plot.timestamp >= sale_details.est_time_sold_min - datetime.timedelta(days=7),
-        )
-        .filter(models.Plot.owner_name == plot.owner_name)
-        .count()
+def to_datetime(timestamp: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+
+
+def to_csv_row(sale: dict) -> tuple:
+    """Converts a sale (a dict of plot_sales columns) to a row of PlotSale fields."""
+    return (
+        sale["world_id"],
+        sale["territory_type_id"],
+        sale["ward_number"],
+        sale["plot_number"],
+        to_datetime(sale["time_open_min"]),
+        to_datetime(sale["time_open_max"]),
+        to_datetime(sale["time_sold_min"]),
+        to_datetime(sale["time_sold_max"]),
+        sale["is_relo"],
+        sale["known_price"],
+        sale["last_presale_state_id"],
     )
 
-    return owned == 0
-
 
 # ==== stats ====
-class SaleStatGenerator:
-    def __init__(self, db, plot: models.Plot):
-        self.db = db
-        self.plot = plot
-
-    # main entrypoint
-    def do_stats(self):
-        last = self.plot  # technically next chronologically
-        for current in crud.plot_history(self.db, self.plot):
-            if last.is_owned and not current.is_owned:
-                yield self._on_sale(last, current)
-            last = current
-
-    # helpers
-    def _on_sale(self, last, current):
-        """
-        Called when *last* is the first datapoint after a plot sells, and *current* is the last datapoint before a plot
-        sells.
-        """
-        sale_details = calc.sold_plot_detail(self.db, last)
-        opening_details = calc.open_plot_detail(self.db, current, now=current.timestamp)
-        sale_is_relo = not is_new_owner(self.db, last, sale_details)
-
-        return PlotSale(
-            world_id=self.plot.world_id,
-            territory_type_id=self.plot.territory_type_id,
-            ward_number=self.plot.ward_number,
-            plot_number=self.plot.plot_number,
-            time_open_min=opening_details.est_time_open_min,
-            time_open_max=opening_details.est_time_open_max,
-            time_sold_min=sale_details.est_time_sold_min,
-            time_sold_max=sale_details.est_time_sold_max,
-            is_relo=sale_is_relo,
-            known_price=opening_details.known_price,
-            last_presale_data_id=current.id,
-        )
-
-
-def queue_processing():
+class SaleFinder:
+    """Finds the sales in a stream of plot states ordered by plot, then time."""
+
+    def __init__(self, base_prices: Dict[Tuple[int, int], int]):
+        self.base_prices = base_prices
+        self.owners = OwnerIndex()
+        # (plot key, open min, open max, sold min, sold max, new owner, price, purchase system, last presale state id)
+        self.sales = []
+
+    def scan(self, states: Iterable):
+        plot_key = None
+        last_owned = None  # the last owned state before the current open run, if any
+        first_open = last_open = None  # the current open run
+        price = None
+
+        for state in states:
+            if state.plot_key != plot_key:
+                plot_key = state.plot_key
+                last_owned = first_open = last_open = price = None
+
+            if not state.is_owned:
+                if first_open is None:
+                    first_open = state
+                last_open = state
+                price = state.last_seen_price or price
+                continue
+
+            if state.owner_name is not None and state.owner_name != models.UNKNOWN_OWNER:
+                self.owners.add(state.owner_name, state.first_seen, state.last_seen, plot_key)
+            if last_open is not None:
+                self.sales.append(
+                    (
+                        plot_key,
+                        last_owned.last_seen if last_owned is not None else 0,
+                        first_open.first_seen,
+                        last_open.last_seen,
+                        state.first_seen,
+                        state.owner_name,
+                        price,
+                        last_open.purchase_system,
+                        last_open.id,
+                    )
+                )
+                first_open = last_open = price = None
+            last_owned = state
+
+    def results(self) -> List[dict]:
+        """The sales found, as dicts of plot_sales columns."""
+        out = []
+        for sale in self.sales:
+            plot_key, open_min, open_max, sold_min, sold_max, owner_name, price, purchase_system, presale_id = sale
+            world_id, district_id, ward_number, plot_number = plotkey.decode(plot_key)
+            out.append(
+                dict(
+                    world_id=world_id,
+                    territory_type_id=district_id,
+                    ward_number=ward_number,
+                    plot_number=plot_number,
+                    plot_key=plot_key,
+                    time_open_min=open_min,
+                    time_open_max=open_max,
+                    time_sold_min=sold_min,
+                    time_sold_max=sold_max,
+                    known_price=price or self.base_prices.get((district_id, plot_number), 0),
+                    is_relo=self.owners.owned_during(owner_name, sold_min - RELO_WINDOW, sold_min),
+                    purchase_system=purchase_system,
+                    last_presale_state_id=presale_id,
+                )
+            )
+        return out
+
+
+def process_world(world_id: int, until: float) -> List[dict]:
+    process = multiprocessing.current_process()
     with SessionLocal() as db:
-        for world in crud.get_worlds(db):
-            for district in crud.get_districts(db):
-                district_q.put((world.id, district.id))
+        world = crud.get_world_by_id(db, world_id)
+        with timer(f"{process.name}", f"{world_id} ({world.name})"):
+            base_prices = {(p.territory_type_id, p.plot_number): p.house_base_price for p in db.query(models.PlotInfo)}
+            finder = SaleFinder(base_prices)
+            start, end = plotkey.world_range(world_id)
+            stmt = text(SCAN_QUERY).bindparams(start=start, end=end, until=until)
+            finder.scan(db.execute(stmt, execution_options={"stream_results": True}).yield_per(FETCH_SIZE))
+            return finder.results()
 
 
-def t_processor(dq, sq):
-    process = multiprocessing.current_process()
-    while True:
-        world_id, district_id = dq.get()
-        with SessionLocal() as db:
-            district = crud.get_district_by_id(db, district_id)
-            world = crud.get_world_by_id(db, world_id)
-            with timer(f"{process.name}", f"{world_id}-{district_id} ({world.name}, {district.name})"):
-                latest_plots = crud.get_latest_plots_in_district(db, world_id, district_id)
-                for plot in latest_plots:
-                    statter = SaleStatGenerator(db, plot)
-                    for result in statter.do_stats():
-                        sq.put(result)
-        dq.task_done()
-
-
-def t_writer(sq):
-    with open("sales.csv", "w", newline="") as f:
-        writer = csv.DictWriter(f, fieldnames=PlotSale.__fields__.keys())
-        writer.writeheader()
-        while True:
-            plot_sale = sq.get()
-            writer.writerow(plot_sale.dict())
-            sq.task_done()
-
-
-def run():
-    # set working tz to UTC, if on Windows you should do this system-wide in time settings
-    if sys.platform != "win32":
-        os.environ["TZ"] = "Etc/UTC"
-        time.tzset()
-    else:
-        input("Make sure your system clock is set to UTC! (Press enter to continue)")
-
-    threads = []
-    queue_processing()
-
-    # launch worker threads
-    for _ in range(NUM_THREADS):
-        t = multiprocessing.Process(target=t_processor, args=(district_q, sale_q), daemon=True)
-        t.start()
-        threads.append(t)
-
-    # launch writer thread
-    t = multiprocessing.Process(target=t_writer, args=(sale_q,), daemon=True)
-    t.start()
-    threads.append(t)
-
-    # wait for all tasks to complete before returning
-    district_q.join()
-    sale_q.join()
+def run(backfill: bool = False):
+    with SessionLocal() as db:
+        world_ids = [world.id for world in crud.get_worlds(db)]
+        until: Optional[float] = crud.get_earliest_plot_sale_time(db) if backfill else None
+    if until is None:
+        until = float("inf")
+    # the processes each need their own connections
+    engine.dispose()
+
+    num_sales = 0
+    with multiprocessing.Pool(NUM_PROCESSES) as pool:
+        results = pool.imap_unordered(functools.partial(process_world, until=until), world_ids)
+        if backfill:
+            with SessionLocal() as db:
+                for sales in results:
+                    crud.backfill_plot_sales(db, sales)
+                    num_sales += len(sales)
+        else:
+            with open("sales.csv", "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(PlotSale.__fields__.keys())
+                for sales in results:
+                    writer.writerows(to_csv_row(sale) for sale in sales)
+                    num_sales += len(sales)
+    print(f"Found {num_sales} sales")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backfill", action="store_true", help="record older sales in plot_sales instead")
+    args = parser.parse_args()
     with timer("MAIN", "all"):
-        run()
+        run(backfill=args.backfill)
@@ -1,4 +1,7 @@
+import bisect
 import datetime
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional
 
 from pydantic import BaseModel
 
@@ -38,3 +41,60 @@ class PlotSale(BaseModel):
     def precision(self) -> float:
         """The number of hours of this sale's imprecision"""
         return self.open_precision + self.close_precision
+
+
+class OwnershipInterval(NamedTuple):
+    start: float  # first_seen of the owned state
+    end: float  # last_seen of the owned state
+    plot_key: int  # see common.plotkey
+
+
+class OwnerIndex:
+    """
+    The plots each owner held and when, built from the owned states of one world (in any order). Once built, whether
+    an owner held any plot in a time range is a binary search.
+
+    Intervals are the (first_seen, last_seen) of owned states, so an owner may have held a plot for a little longer on
+    either side of its interval than it says.
+    """
+
+    def __init__(self):
+        self._intervals: Dict[str, List[OwnershipInterval]] = defaultdict(list)
+        self._max_ends: Dict[str, List[float]] = {}  # owner -> running max of the ends of their sorted intervals
+
+    def add(self, owner_name: str, start: float, end: float, plot_key: int):
+        self._intervals[owner_name].append(OwnershipInterval(start, end, plot_key))
+        self._max_ends.pop(owner_name, None)
+
+    def intervals(self, owner_name: str) -> List[OwnershipInterval]:
+        """The intervals in which an owner held a plot, ordered by start."""
+        self._build(owner_name)
+        return self._intervals.get(owner_name, [])
+
+    def owned_during(self, owner_name: Optional[str], start: float, end: float) -> bool:
+        """Whether an owner held any plot at any time in [start, end)."""
+        intervals = self.intervals(owner_name)
+        # of the intervals that start before *end*, does any end after *start*?
+        i = bisect.bisect_left(intervals, (end,))
+        return i > 0 and self._max_ends[owner_name][i - 1] >= start
+
+    def overlapping(self, owner_name: Optional[str], start: float, end: float) -> List[OwnershipInterval]:
+        """The intervals in which an owner held a plot at any time in [start, end), e.g. to see where they moved."""
+        intervals = self.intervals(owner_name)
+        i = bisect.bisect_left(intervals, (end,))
+        return [interval for interval in intervals[:i] if interval.end >= start]
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def _build(self, owner_name: str):
+        if owner_name in self._max_ends or owner_name not in self._intervals:
+            return
+        intervals = self._intervals[owner_name]
+        intervals.sort()
+        max_ends = []
+        max_end = float("-inf")
+        for interval in intervals:
+            max_end = max(max_end, interval.end)
+            max_ends.append(max_end)
+        self._max_ends[owner_name] = max_ends
@@ -0,0 +1,60 @@
+"""
+Benchmarks decoding an /ingest body with the pydantic models (the old path) against the fast decoder in
+common/schemas/lite.py. Run from the repository root:
+
+    python -m tests.bench_decode [--wards N] [--repeat N]
+"""
+import argparse
+import copy
+import json
+import os
+import time
+import timeit
+from typing import List
+
+from pydantic import parse_obj_as
+
+from common import schemas
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "static/dummy_ward_info.json")) as f:
+    DUMMY_WARD_INFO = json.load(f)
+
+
+def make_body(num_wards: int) -> bytes:
+    """An ingest body like the ones PaissaHouse sends, with *num_wards* ward info packets."""
+    data = []
+    now = time.time()
+    for i in range(num_wards):
+        packet = copy.deepcopy(DUMMY_WARD_INFO)
+        packet.update(client_timestamp=now, server_timestamp=now, PurchaseType=2, TenantType=2)
+        packet["LandIdent"]["WardNumber"] = i % 30
+        data.append(packet)
+    return json.dumps(data).encode()
+
+
+def decode_pydantic(body: bytes):
+    return parse_obj_as(List[schemas.ffxiv.BaseFFXIVPacket], json.loads(body))
+
+
+def decode_lite(body: bytes):
+    return schemas.lite.parse_packets(json.loads(body))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wards", type=int, default=30, help="ward info packets per request")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    body = make_body(args.wards)
+    print(f"{args.wards} wards/request, {len(body)} bytes")
+    results = {}
+    for name, fn in (("pydantic", decode_pydantic), ("lite", decode_lite)):
+        per_request = min(timeit.repeat(lambda: fn(body), number=args.repeat, repeat=5)) / args.repeat
+        results[name] = per_request
+        print(f"{name:>10}: {per_request * 1000:8.3f} ms/request, {args.wards / per_request:10.0f} wards/s")
+    print(f"speedup: {results['pydantic'] / results['lite']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Benchmarks last_seen heartbeat updates against the wide plot_states layout (every column in one row, with last_seen
+indexed) and the split layout (plot_states + plot_states_hot), with and without an index on last_seen, reporting update
+throughput, how much the tables and their indexes grow, the share of updates postgres could do in place (HOT), and how
+long it takes to find the 1% of states last seen most recently. Needs a postgres DB_URI; the tables are created in a
+scratch schema which is dropped afterwards. Run from the repository root:
+
+    python -m tests.bench_hot_table [--states N] [--updates N] [--batch N]
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import text
+
+from common.database import engine
+
+SCHEMA = "bench_hot_table"
+AUTOCOMMIT = engine.execution_options(isolation_level="AUTOCOMMIT")
+
+WIDE = """
+CREATE TABLE {schema}.wide
+(
+    id                SERIAL PRIMARY KEY,
+    world_id          INTEGER,
+    territory_type_id INTEGER,
+    ward_number       INTEGER,
+    plot_number       INTEGER,
+    plot_key          BIGINT,
+    first_seen        FLOAT,
+    is_owned          BOOLEAN,
+    owner_name        VARCHAR,
+    purchase_system   INTEGER,
+    last_seen         FLOAT,
+    last_seen_price   INTEGER,
+    lotto_entries     INTEGER,
+    lotto_phase       INTEGER,
+    lotto_phase_until INTEGER
+);
+CREATE INDEX ON {schema}.wide (plot_key, last_seen DESC);
+CREATE INDEX ON {schema}.wide (last_seen DESC);
+"""
+
+SPLIT = """
+CREATE TABLE {schema}.cold
+(
+    id                SERIAL PRIMARY KEY,
+    world_id          INTEGER,
+    territory_type_id INTEGER,
+    ward_number       INTEGER,
+    plot_number       INTEGER,
+    plot_key          BIGINT,
+    first_seen        FLOAT,
+    is_owned          BOOLEAN,
+    owner_name        VARCHAR,
+    purchase_system   INTEGER
+);
+CREATE INDEX ON {schema}.cold (plot_key, first_seen DESC);
+CREATE TABLE {schema}.hot
+(
+    state_id          INTEGER PRIMARY KEY,
+    last_seen         FLOAT,
+    last_seen_price   INTEGER,
+    lotto_entries     INTEGER,
+    lotto_phase       INTEGER,
+    lotto_phase_until INTEGER
+) WITH (fillfactor = 50, autovacuum_vacuum_scale_factor = 0.02);
+"""
+
+POPULATE_COLD = """
+INSERT INTO {schema}.{table} (world_id, territory_type_id, ward_number, plot_number, plot_key, first_seen, is_owned,
+                              owner_name, purchase_system{hot_columns})
+SELECT 73, 339, i / 60 % 30, i % 60, i, 0, TRUE, 'Some Owner', 6{hot_values}
+FROM generate_series(1, :n) AS i
+"""
+
+SPLIT_POPULATE = (
+    POPULATE_COLD.replace("{table}", "cold").replace("{hot_columns}", "").replace("{hot_values}", "")
+    + ";\nINSERT INTO {schema}.hot (state_id, last_seen, last_seen_price) SELECT id, 0, 3000000 FROM {schema}.cold"
+)
+
+LAYOUTS = {
+    # name: (DDL, populate, heartbeat update, tables to measure, table with last_seen)
+    "wide": (
+        WIDE,
+        POPULATE_COLD.replace("{table}", "wide")
+        .replace("{hot_columns}", ", last_seen, last_seen_price")
+        .replace("{hot_values}", ", 0, 3000000"),
+        "UPDATE {schema}.wide SET last_seen = :t WHERE id = :id",
+        ["wide"],
+        "wide",
+    ),
+    "split": (
+        SPLIT,
+        SPLIT_POPULATE,
+        "UPDATE {schema}.hot SET last_seen = :t WHERE state_id = :id",
+        ["cold", "hot"],
+        "hot",
+    ),
+    # what restoring ix_plot_states_last_seen_desc on plot_states_hot would cost
+    "split+ix": (
+        SPLIT + "CREATE INDEX ON {schema}.hot (last_seen DESC);\n",
+        SPLIT_POPULATE,
+        "UPDATE {schema}.hot SET last_seen = :t WHERE state_id = :id",
+        ["cold", "hot"],
+        "hot",
+    ),
+}
+
+
+def total_size(conn, tables) -> int:
+    return sum(
+        conn.execute(text(f"SELECT pg_total_relation_size('{SCHEMA}.{table}')")).scalar() for table in tables
+    )
+
+
+def hot_ratio(conn, tables) -> float:
+    upd, hot_upd = conn.execute(
+        text(
+            "SELECT SUM(n_tup_upd), SUM(n_tup_hot_upd) FROM pg_stat_user_tables "
+            "WHERE schemaname = :schema AND relname = ANY(:tables)"
+        ).bindparams(schema=SCHEMA, tables=tables)
+    ).one()
+    return (hot_upd or 0) / upd if upd else 0
+
+
+def scan_time(conn, table: str, since: float, repeat: int = 5) -> float:
+    """The best time, in seconds, of a count of the states last seen since *since* (like the last_seen filters)."""
+    stmt = text(f"SELECT COUNT(*) FROM {SCHEMA}.{table} WHERE last_seen >= :since").bindparams(since=since)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(stmt).scalar()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_layout(name: str, num_states: int, num_updates: int, batch: int, seed: int):
+    ddl, populate, update, tables, scan_table = LAYOUTS[name]
+    rng = random.Random(seed)
+    with AUTOCOMMIT.connect() as admin:
+        admin.execute(text(ddl.format(schema=SCHEMA)))
+        for stmt in populate.format(schema=SCHEMA).split(";\n"):
+            admin.execute(text(stmt), {"n": num_states})
+        admin.execute(text(f"VACUUM ANALYZE {', '.join(f'{SCHEMA}.{t}' for t in tables)}"))
+        size_before = total_size(admin, tables)
+
+        stmt = text(update.format(schema=SCHEMA))
+        start = time.perf_counter()
+        with engine.connect() as conn:
+            for i in range(0, num_updates, batch):
+                with conn.begin():
+                    conn.execute(stmt, [{"t": i + j, "id": rng.randint(1, num_states)} for j in range(batch)])
+        elapsed = time.perf_counter() - start
+
+        time.sleep(1)  # let the statistics collector catch up
+        size_after = total_size(admin, tables)
+        ratio = hot_ratio(admin, tables)
+        admin.execute(text(f"VACUUM ANALYZE {', '.join(f'{SCHEMA}.{t}' for t in tables)}"))
+        scan = scan_time(admin, scan_table, num_updates * 0.99)
+    mib = 1024 * 1024
+    print(
+        f"{name:>8} {num_updates / elapsed:12.0f} {size_before / mib:12.1f} {size_after / mib:12.1f}"
+        f" {(size_after - size_before) / num_updates:12.1f} {ratio:8.0%} {scan * 1000:10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--states", type=int, default=100_000)
+    parser.add_argument("--updates", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=1000, help="updates per transaction")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{args.states} states, {args.updates} single-row last_seen updates in batches of {args.batch}")
+    print(
+        f"{'':>8} {'updates/s':>12} {'MiB before':>12} {'MiB after':>12} {'B/update':>12} {'HOT':>8} {'scan ms':>10}"
+    )
+    for name in LAYOUTS:
+        with AUTOCOMMIT.connect() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        try:
+            run_layout(name, args.states, args.updates, args.batch, args.seed)
+        finally:
+            with AUTOCOMMIT.connect() as conn:
+                conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
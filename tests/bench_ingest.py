@@ -0,0 +1,77 @@
+"""
+Benchmarks the bytes on the wire and the CPU time spent decoding each ward info packet for /ingest (JSON) and
+/ingest/binary (packed), uncompressed and compressed. Run from the repository root:
+
+    python -m tests.bench_ingest [--wards N] [--repeat N]
+"""
+import argparse
+import gzip
+import json
+import random
+import string
+import timeit
+
+from common import eventcodec, schemas
+from paissadb import encoding
+from .bench_decode import make_body
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAX_SIZE = 64 * 1024 * 1024
+
+
+def make_varied_body(num_wards: int, seed: int = 0) -> bytes:
+    """Like bench_decode.make_body, but with different owners and prices in each ward so compression is realistic."""
+    rng = random.Random(seed)
+    data = json.loads(make_body(num_wards))
+    for packet in data:
+        for entry in packet["HouseInfoEntries"]:
+            owned = rng.random() < 0.9
+            entry["InfoFlags"] = rng.choice([1, 3, 9, 11, 27]) if owned else 0
+            entry["HousePrice"] = rng.randrange(3_000_000, 40_000_000, 1000)
+            entry["HouseAppeals"] = [rng.randrange(0, 30) for _ in range(3)]
+            entry["EstateOwnerName"] = (
+                " ".join("".join(rng.choices(string.ascii_letters, k=rng.randint(3, 10))) for _ in range(2))
+                if owned
+                else ""
+            )
+    return json.dumps(data).encode()
+
+
+def decode_json(body: bytes, content_encoding: str = None):
+    return schemas.lite.parse_packets(json.loads(encoding.decompress(body, content_encoding, MAX_SIZE)))
+
+
+def decode_binary(body: bytes, content_encoding: str = None):
+    return eventcodec.decode_ingest_body(encoding.decompress(body, content_encoding, MAX_SIZE))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wards", type=int, default=30, help="ward info packets per request")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    json_body = make_varied_body(args.wards)
+    binary_body = eventcodec.encode_ingest_body(schemas.lite.parse_packets(json.loads(json_body)))
+    cases = [
+        ("json", decode_json, json_body, None),
+        ("json+gzip", decode_json, gzip.compress(json_body), "gzip"),
+        ("binary", decode_binary, binary_body, None),
+        ("binary+gzip", decode_binary, gzip.compress(binary_body), "gzip"),
+    ]
+    if zstandard is not None:
+        cases.append(("binary+zstd", decode_binary, zstandard.ZstdCompressor().compress(binary_body), "zstd"))
+
+    print(f"{args.wards} wards/request")
+    print(f"{'':>12} {'bytes/ward':>12} {'us/ward':>10}")
+    for name, fn, body, content_encoding in cases:
+        per_request = min(timeit.repeat(lambda: fn(body, content_encoding), number=args.repeat, repeat=5)) / args.repeat
+        print(f"{name:>12} {len(body) / args.wards:12.0f} {per_request / args.wards * 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
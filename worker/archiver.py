@@ -0,0 +1,176 @@
+"""
+Drains the events archive stream filled by /ingest into the events table in large batches.
+
+Entries are read through a consumer group and only acknowledged (and deleted) once their batch is committed, so an
+archiver that dies mid-batch picks its pending entries back up when it restarts under the same name (ARCHIVER_NAME),
+and entries left pending by an archiver that never comes back are claimed by the others after ARCHIVE_CLAIM_IDLE.
+Delivery is at-least-once: an archiver that dies between committing and acknowledging a batch inserts it again.
+
+If a batch fails to insert, its events are inserted one at a time so that one bad event does not hold back the rest.
+Events that still fail are left pending to be retried (claimed again after ARCHIVE_CLAIM_IDLE), and once they have
+been delivered ARCHIVE_MAX_DELIVERIES times, they are moved to the ARCHIVE_DEAD_LETTER_KEY stream for inspection.
+"""
+import asyncio
+import logging
+import time
+from typing import List, Tuple
+
+import redis.asyncio as redis_lib
+
+from common import config, crud, models
+from common.database import (
+    ARCHIVE_DEAD_LETTER_KEY,
+    ARCHIVE_GROUP,
+    ARCHIVE_STREAM_KEY,
+    SessionLocal,
+    ensure_stream_group,
+)
+from common.utils import executor
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_CLAIM_IDLE = 60_000  # ms
+StreamEntry = Tuple[bytes, dict]
+
+
+class Archiver:
+    def __init__(self):
+        # the packed events are binary, so this needs its own connection that does not decode responses
+        self.redis = redis_lib.from_url(config.REDIS_URI)
+        self.db = SessionLocal()
+        self.name = config.ARCHIVER_NAME
+        self.batch_size = config.ARCHIVE_BATCH_SIZE
+        self.max_deliveries = config.ARCHIVE_MAX_DELIVERIES
+        self.running = True
+
+    async def init(self):
+        await ensure_stream_group(self.redis, ARCHIVE_STREAM_KEY, ARCHIVE_GROUP)
+
+    async def main_loop(self):
+        try:
+            await self.archive_pending()
+        except Exception:
+            log.exception("Error archiving pending events:")  # they will be claimed again after ARCHIVE_CLAIM_IDLE
+            self.db.rollback()
+
+        last_claim = 0
+        while self.running:
+            try:
+                # XAUTOCLAIM scans the pending list, so only look for stale entries as often as they can appear
+                if time.monotonic() - last_claim > ARCHIVE_CLAIM_IDLE / 1000:
+                    last_claim = time.monotonic()
+                    _, claimed, *_ = await self.redis.xautoclaim(
+                        ARCHIVE_STREAM_KEY, ARCHIVE_GROUP, self.name, ARCHIVE_CLAIM_IDLE, count=self.batch_size
+                    )
+                    if claimed:
+                        log.info(f"Claimed {len(claimed)} stale entries")
+                        await self.archive(claimed)
+                if entries := await self.read(start_id=">", block=5000):
+                    await self.archive(entries)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                break
+            except Exception:
+                log.exception("Error archiving events:")
+                self.db.rollback()
+                await asyncio.sleep(5)
+
+    async def archive_pending(self):
+        """Re-archives anything we read but did not acknowledge before we last stopped."""
+        start_id = "0"
+        # entries that fail again stay pending, so read past them rather than from the start each time
+        while entries := await self.read(start_id=start_id):
+            await self.archive(entries)
+            start_id = entries[-1][0]
+
+    async def read(self, start_id: str, block: int = None) -> List[StreamEntry]:
+        resp = await self.redis.xreadgroup(
+            ARCHIVE_GROUP, self.name, {ARCHIVE_STREAM_KEY: start_id}, count=self.batch_size, block=block
+        )
+        if not resp:
+            return []
+        _, entries = resp[0]
+        return entries
+
+    async def archive(self, entries: List[StreamEntry]):
+        """
+        Inserts the given stream entries into the events table, then acknowledges and deletes them (except for any
+        that could not be inserted).
+        """
+        events = []
+        failed = []
+        for entry_id, fields in entries:
+            if not fields:  # claimed deleted entries have no fields
+                continue
+            try:
+                events.append((entry_id, _entry_to_event(fields)))
+            except Exception:
+                log.exception(f"Could not decode archive entry {entry_id}:")
+                failed.append((entry_id, fields))
+        if events:
+            try:
+                await executor(crud.archive_events, self.db, [event for _, event in events])
+            except Exception:
+                log.warning(f"Failed to archive a batch of {len(events)} events, retrying one at a time", exc_info=True)
+                self.db.rollback()
+                failed_ids = set(await executor(self._archive_each, events))
+                failed.extend(entry for entry in entries if entry[0] in failed_ids)
+
+        failed_ids = {entry_id for entry_id, _ in failed}
+        entry_ids = [entry_id for entry_id, _ in entries if entry_id not in failed_ids]
+        if entry_ids:
+            pipeline = self.redis.pipeline(transaction=True)
+            await pipeline.xack(ARCHIVE_STREAM_KEY, ARCHIVE_GROUP, *entry_ids)
+            await pipeline.xdel(ARCHIVE_STREAM_KEY, *entry_ids)
+            await pipeline.execute()
+        if failed:
+            await self.dead_letter(failed)
+        log.debug(f"Archived {sum(1 for entry_id, _ in events if entry_id not in failed_ids)} events")
+
+    def _archive_each(self, events: List[Tuple[bytes, dict]]) -> List[bytes]:
+        """Inserts events one at a time. Returns the IDs of the entries that could not be inserted."""
+        failed = []
+        for entry_id, event in events:
+            try:
+                crud.archive_event(self.db, event)
+            except Exception:
+                log.exception(f"Could not archive entry {entry_id}:")
+                self.db.rollback()
+                failed.append(entry_id)
+        return failed
+
+    async def dead_letter(self, entries: List[StreamEntry]):
+        """
+        Moves the given entries, which could not be archived, to the dead letter stream once they have been delivered
+        ARCHIVE_MAX_DELIVERIES times. The others are left pending, to be retried when they are claimed again.
+        """
+        for entry_id, fields in entries:
+            pending = await self.redis.xpending_range(
+                ARCHIVE_STREAM_KEY, ARCHIVE_GROUP, min=entry_id, max=entry_id, count=1
+            )
+            if pending and pending[0]["times_delivered"] < self.max_deliveries:
+                continue
+            log.warning(f"Moving archive entry {entry_id} to {ARCHIVE_DEAD_LETTER_KEY}")
+            pipeline = self.redis.pipeline(transaction=True)
+            await pipeline.xadd(ARCHIVE_DEAD_LETTER_KEY, {**fields, b"entry_id": entry_id})
+            await pipeline.xack(ARCHIVE_STREAM_KEY, ARCHIVE_GROUP, entry_id)
+            await pipeline.xdel(ARCHIVE_STREAM_KEY, entry_id)
+            await pipeline.execute()
+
+
+def _entry_to_event(fields: dict) -> dict:
+    sweeper_id = fields[b"sweeper_id"]
+    return dict(
+        sweeper_id=int(sweeper_id) if sweeper_id else None,
+        timestamp=float(fields[b"timestamp"]),
+        event_type=models.EventType(fields[b"event_type"].decode()),
+        packed=fields[b"packed"],
+    )
+
+
+async def run():
+    """Entrypoint for an archiver instance."""
+    archiver = Archiver()
+    await archiver.init()
+    log.info(f"Archiver {archiver.name} is listening...")
+    await archiver.main_loop()
+    log.info("Archiver is shutting down...")
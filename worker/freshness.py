@@ -0,0 +1,148 @@
+"""
+In-memory index of when each ward was last swept, used to publish data freshness metrics and the /freshness summary
+without having to scan plot_states.
+
+Each worker only sees the wards it processes, so the index is merged into a hash in redis shared by all workers
+(keeping the later time of each ward, with MAX_MERGE_SCRIPT), and the summaries are built from the merged copy.
+"""
+import logging
+import time
+from typing import Dict, List
+
+from prometheus_client import Gauge
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from common import models, plotkey, schemas
+from common.database import FRESHNESS_WARDS_KEY, FRESHNESS_WORLDS_KEY
+from common.gamedata import WARDS_PER_DISTRICT
+
+log = logging.getLogger(__name__)
+
+STALE_AFTER = 60 * 60 * 24
+WardKey = int  # see common.plotkey
+
+# KEYS[1]: hash; ARGV: field, value, field, value, ...
+# sets each field to the given value unless it already holds a later one
+MAX_MERGE_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]))
+    if current == nil or current < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+"""
+
+oldest_ward_age = Gauge(
+    "world_oldest_ward_age_seconds", "Seconds since the least recently swept (seen) ward in a world", ["world"]
+)
+stale_wards = Gauge("world_stale_wards", "The number of wards in a world not swept in the last 24 hours", ["world"])
+
+
+class FreshnessIndex:
+    def __init__(self):
+        self.last_seen: Dict[WardKey, float] = {}
+        self._dirty = set()
+        self._max_merge = None
+
+    def touch(self, key: WardKey, timestamp: float):
+        """Records that the given ward was seen at the given time."""
+        if self._update(key, timestamp):
+            self._dirty.add(key)
+
+    def _update(self, key: WardKey, timestamp: float) -> bool:
+        if timestamp > self.last_seen.get(key, 0):
+            self.last_seen[key] = timestamp
+            return True
+        return False
+
+    # ==== persistence ====
+    async def load(self, redis, db: Session):
+        """
+        Seeds the index from the copy persisted in redis. If there is no such copy (e.g. first deploy), seeds it from
+        the states seen in the last day instead.
+        """
+        persisted = await redis.hgetall(FRESHNESS_WARDS_KEY)
+        legacy_fields = []
+        for field, value in persisted.items():
+            if ":" in field:  # world:district:ward, persisted before ward keys were packed; rewritten on next flush
+                legacy_fields.append(field)
+                field = plotkey.encode(*map(int, field.split(":")))
+            self.touch(int(field), float(value))
+        if legacy_fields:
+            await redis.hdel(FRESHNESS_WARDS_KEY, *legacy_fields)
+        if not persisted:
+            since = time.time() - STALE_AFTER
+            result = (
+                db.query(
+                    models.PlotState.world_id,
+                    models.PlotState.territory_type_id,
+                    models.PlotState.ward_number,
+                    func.max(models.PlotState.last_seen),
+                )
+                .filter(models.PlotState.last_seen >= since)
+                .group_by(models.PlotState.world_id, models.PlotState.territory_type_id, models.PlotState.ward_number)
+            )
+            for world_id, district_id, ward_num, last_seen in result:
+                self.touch(plotkey.encode(world_id, district_id, ward_num), last_seen)
+        log.info(f"Loaded freshness index with {len(self.last_seen)} wards")
+
+    async def flush(self, redis, worlds: Dict[int, str], districts: Dict[int, str]):
+        """
+        Merges any changed wards into the copy in redis, picks up the wards other workers have seen from it, and
+        refreshes the per-world summaries and gauges.
+        """
+        if self._max_merge is None:
+            self._max_merge = redis.register_script(MAX_MERGE_SCRIPT)
+        if self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            args = [arg for key in dirty for arg in (key, self.last_seen[key])]
+            await self._max_merge(keys=[FRESHNESS_WARDS_KEY], args=args)
+        for field, value in (await redis.hgetall(FRESHNESS_WARDS_KEY)).items():
+            if ":" not in field:  # legacy fields of a worker that has not been restarted yet
+                self._update(int(field), float(value))
+
+        summaries = self.summarize(worlds, districts)
+        if summaries:
+            await redis.hset(FRESHNESS_WORLDS_KEY, mapping={s.id: s.json() for s in summaries})
+
+    # ==== summary ====
+    def summarize(
+        self, worlds: Dict[int, str], districts: Dict[int, str], now: float = None
+    ) -> List[schemas.paissa.WorldFreshness]:
+        """
+        Builds the freshness summary of each world (given as mappings of ID to name) and updates the freshness gauges.
+        Wards that have never been seen count as stale and have a last seen time of 0.
+        """
+        if now is None:
+            now = time.time()
+        out = []
+        for world_id, world_name in worlds.items():
+            district_freshness = []
+            for district_id, district_name in districts.items():
+                times = [
+                    self.last_seen.get(plotkey.encode(world_id, district_id, ward), 0)
+                    for ward in range(WARDS_PER_DISTRICT)
+                ]
+                district_freshness.append(
+                    schemas.paissa.DistrictFreshness(
+                        id=district_id,
+                        name=district_name,
+                        oldest_ward_time=min(times),
+                        num_stale_wards=sum(1 for t in times if now - t > STALE_AFTER),
+                    )
+                )
+            world_freshness = schemas.paissa.WorldFreshness(
+                id=world_id,
+                name=world_name,
+                oldest_ward_time=min(d.oldest_ward_time for d in district_freshness),
+                num_stale_wards=sum(d.num_stale_wards for d in district_freshness),
+                districts=district_freshness,
+            )
+            out.append(world_freshness)
+
+            # left unset while at least one ward has never been seen
+            if world_freshness.oldest_ward_time:
+                oldest_ward_age.labels(world_name).set(now - world_freshness.oldest_ward_time)
+            stale_wards.labels(world_name).set(world_freshness.num_stale_wards)
+        return out
@@ -0,0 +1,91 @@
+"""
+Coalescing of last_seen heartbeats.
+
+Nearly every sweep of a plot only advances the last_seen of its latest state, and writing each of those immediately
+makes every event an UPDATE of a plot_states row. With WORKER_HEARTBEAT_INTERVAL set, such updates are held in memory
+instead and written in a single bulk UPDATE once per interval; updates that change anything else are written
+immediately (along with any held last_seen of the same state). The worker overlays the held values on the states it
+loads, so its own decisions always see the latest last_seen even though the database (and the API) may lag behind by
+up to the interval. Held heartbeats are lost if the worker crashes before they are written.
+"""
+import logging
+from typing import Dict, Set, Tuple
+
+from prometheus_client import Counter
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+
+from common import crud, models
+from common.database import SessionLocal
+from common.utils import executor
+
+log = logging.getLogger(__name__)
+
+StateKey = Tuple[int, float]  # id, first_seen (the primary key of plot_states)
+
+coalesced_heartbeats = Counter("worker_coalesced_heartbeats", "last_seen-only state updates held to be written in bulk")
+
+
+class HeartbeatBuffer:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.pending: Dict[StateKey, float] = {}
+        self._flushing: Dict[StateKey, float] = {}
+
+    def apply(self, state: models.PlotState):
+        """Overlays the held last_seen of a state loaded from the database, if it is later than the stored one."""
+        key = (state.id, state.first_seen)
+        last_seen = self.pending.get(key) or self._flushing.get(key)
+        if last_seen is not None and last_seen > state.last_seen:
+            set_committed_value(state, "last_seen", last_seen)
+
+    def hold(self, state: models.PlotState):
+        """
+        Called after updating a state in place, before committing. If the only change is to its last_seen, holds the
+        new value and clears the change so that committing does not write it; otherwise, makes sure that committing
+        writes the state's held last_seen along with its other changes.
+        """
+        if not self.enabled:
+            return
+        key = (state.id, state.first_seen)
+        changed = _changed_columns(state)
+        if changed == {"last_seen"}:
+            self.pending[key] = state.last_seen
+            set_committed_value(state, "last_seen", state.last_seen)
+            coalesced_heartbeats.inc()
+        elif changed and self.pending.pop(key, None) is not None and "last_seen" not in changed:
+            flag_modified(state, "last_seen")
+
+    async def flush(self) -> int:
+        """Writes all held heartbeats in one UPDATE, in a session of its own. Returns the number of states updated."""
+        if not self.pending:
+            return 0
+        self._flushing, self.pending = self.pending, {}
+        try:
+            updated = await executor(self._write, self._flushing)
+        except Exception:
+            # hold them again, unless they were superseded while we were writing
+            self.pending = {**self._flushing, **self.pending}
+            raise
+        finally:
+            self._flushing = {}
+        log.debug(f"Flushed {updated} heartbeats")
+        return updated
+
+    @staticmethod
+    def _write(states: Dict[StateKey, float]) -> int:
+        db = SessionLocal()
+        try:
+            return crud.bulk_bump_last_seen(db, states)
+        finally:
+            db.close()
+
+
+def _changed_columns(state: models.PlotState) -> Set[str]:
+    """The columns of a state whose values were changed since it was loaded (not just set to the same value)."""
+    changed = set()
+    for attr in inspect(state).attrs:
+        history = attr.history
+        if history.added and history.added != history.deleted:
+            changed.add(attr.key)
+    return changed
@@ -1,55 +1,199 @@
 import asyncio
 import logging
+import time
+from typing import List, Tuple
 
 import sentry_sdk
+from prometheus_client import Counter, start_http_server
 from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 from sqlalchemy.orm import Session
 
-from common import calc, config, crud, gamedata, models, schemas
-from common.database import EVENT_QUEUE_KEY, PUBSUB_WS_CHANNEL, SessionLocal, engine, redis
+from common import calc, config, crud, gamedata, models, partitions, plotkey, schemas
+from common.database import (
+    EVENT_QUEUE_KEY,
+    EVENT_STREAM_GROUP,
+    EVENT_STREAM_KEY,
+    PUBSUB_WS_CHANNEL,
+    SessionLocal,
+    engine,
+    ensure_stream_group,
+    redis,
+)
+from common.profiling import SamplingProfiler
 from common.utils import executor
-from . import utils
+from . import freshness, heartbeats, utils
 
 log = logging.getLogger("worker")
 logging.basicConfig(level=config.LOGLEVEL)
 
+FRESHNESS_REFRESH_TIME = 15
+
+expired_events = Counter("worker_expired_events", "Queued events whose data expired before they were processed")
+
 
 class Worker:
     def __init__(self):
         self.redis = redis
         self.db: Session = SessionLocal()
         self.running = True
+        self.freshness = freshness.FreshnessIndex()
+        # the bulk update (crud.bulk_bump_last_seen) only runs on postgres
+        self.heartbeats = heartbeats.HeartbeatBuffer(
+            enabled=config.WORKER_HEARTBEAT_INTERVAL > 0 and config.DB_TYPE == "postgresql"
+        )
+        self.profiler = SamplingProfiler("worker")
+        # id -> name, loaded once on init so the freshness summary does not have to touch the db
+        self.worlds = {}
+        self.districts = {}
 
     async def init(self):
         models.Base.metadata.create_all(bind=engine)
+        if config.DB_TYPE == "postgresql":
+            partitions.ensure_partitions(self.db)
         gamedata.upsert_all(gamedata_dir=config.GAMEDATA_DIR, db=self.db)
+        self.worlds = {w.id: w.name for w in crud.get_worlds(self.db)}
+        self.districts = {d.id: d.name for d in crud.get_districts(self.db)}
+        await self.freshness.load(self.redis, self.db)
         if config.SENTRY_DSN is not None:
             sentry_sdk.init(
                 dsn=config.SENTRY_DSN, environment=config.SENTRY_ENV, integrations=[SqlalchemyIntegration()]
             )
+        if config.WORKER_METRICS_PORT:
+            start_http_server(config.WORKER_METRICS_PORT)
 
     async def main_loop(self):
+        if config.EVENT_QUEUE_BACKEND == "stream":
+            await self.stream_loop()
+        else:
+            await self.zset_loop()
+
+    async def zset_loop(self):
         while self.running:
             try:
                 _, data_key, score = await self.redis.bzpopmin(EVENT_QUEUE_KEY)
                 log.debug(f"Got {data_key} off the event PQ with score {score}")
-                await self.process_plot_from_key(data_key)
+                with self.profiler.section():
+                    if data_key.startswith(crud.WARD_HEARTBEAT_KEY_PREFIX):
+                        await self.process_ward_heartbeat(data_key)
+                    else:
+                        await self.process_plot_from_key(data_key)
             except (asyncio.CancelledError, KeyboardInterrupt):
                 break
             except Exception:
                 log.exception(f"Error processing event:")
                 self.db.rollback()
 
+    async def stream_loop(self):
+        """
+        Reads events from the event stream through the workers' consumer group. Events are acknowledged (and deleted)
+        after each batch, so the events of a worker that crashes mid-batch stay pending: it picks them back up when it
+        restarts under the same name, or another worker claims them after WORKER_CLAIM_IDLE seconds.
+        """
+        await ensure_stream_group(self.redis, EVENT_STREAM_KEY, EVENT_STREAM_GROUP)
+        start_id = "0"  # first, anything we read but did not acknowledge before we last stopped
+        last_claim = 0
+        while self.running:
+            try:
+                if time.monotonic() - last_claim > config.WORKER_CLAIM_IDLE:
+                    last_claim = time.monotonic()
+                    _, entries, *_ = await self.redis.xautoclaim(
+                        EVENT_STREAM_KEY,
+                        EVENT_STREAM_GROUP,
+                        config.WORKER_NAME,
+                        config.WORKER_CLAIM_IDLE * 1000,
+                        count=config.WORKER_BATCH_SIZE,
+                    )
+                    if entries:
+                        log.info(f"Claimed {len(entries)} stale events")
+                        await self.process_stream_entries(entries)
+
+                resp = await self.redis.xreadgroup(
+                    EVENT_STREAM_GROUP,
+                    config.WORKER_NAME,
+                    {EVENT_STREAM_KEY: start_id},
+                    count=config.WORKER_BATCH_SIZE,
+                    block=None if start_id == "0" else 5000,
+                )
+                entries = resp[0][1] if resp else []
+                if not entries and start_id == "0":
+                    start_id = ">"
+                await self.process_stream_entries(entries)
+            except (asyncio.CancelledError, KeyboardInterrupt):
+                break
+            except Exception:
+                log.exception(f"Error reading events:")
+                await asyncio.sleep(5)
+
+    async def process_stream_entries(self, entries: List[Tuple[str, dict]]):
+        for entry_id, fields in entries:
+            if not fields:  # claimed after being deleted
+                continue
+            key = fields["key"]
+            log.debug(f"Got {key} ({entry_id}) off the event stream")
+            try:
+                with self.profiler.section():
+                    if key.startswith(crud.WARD_HEARTBEAT_KEY_PREFIX):
+                        await self.process_ward_heartbeat(key)
+                    else:
+                        await self.process_plot_event(f"{key}:{entry_id}", fields["data"])
+            except Exception:
+                # like an event popped off the zset, an event that fails is not retried
+                log.exception(f"Error processing event:")
+                self.db.rollback()
+        if entries:
+            entry_ids = [entry_id for entry_id, _ in entries]
+            pipeline = self.redis.pipeline(transaction=True)
+            await pipeline.xack(EVENT_STREAM_KEY, EVENT_STREAM_GROUP, *entry_ids)
+            await pipeline.xdel(EVENT_STREAM_KEY, *entry_ids)
+            await pipeline.execute()
+
+    async def freshness_task(self):
+        """Persists the freshness index and refreshes the freshness summaries every 15 seconds."""
+        while self.running:
+            try:
+                await self.freshness.flush(self.redis, self.worlds, self.districts)
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                log.exception("Failed to update freshness index:")
+            finally:
+                await asyncio.sleep(FRESHNESS_REFRESH_TIME)
+
+    async def heartbeat_task(self):
+        """Writes the held last_seen heartbeats every WORKER_HEARTBEAT_INTERVAL seconds."""
+        while self.running:
+            try:
+                await asyncio.sleep(config.WORKER_HEARTBEAT_INTERVAL)
+                await self.heartbeats.flush()
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                log.exception("Failed to write heartbeats:")
+
+    async def process_ward_heartbeat(self, key: str):
+        """A ward was seen with the same contents as its last sweep: bump the last_seen of all of its plots at once."""
+        ward_key, source_timestamp, timestamp = crud.parse_ward_heartbeat_key(key)
+        self.freshness.touch(ward_key, timestamp)
+        updated = crud.bump_ward_last_seen(self.db, ward_key, source_timestamp, timestamp)
+        log.debug(f"Heartbeat {key} updated {updated} states")
+
     async def process_plot_from_key(self, key: str):
         data = await self.redis.getdel(key)
         if data is None:
             log.warning(f"Data in key {key} is nil, skipping")
+            expired_events.inc()
             return
+        await self.process_plot_event(key, data)
+
+    async def process_plot_event(self, key: str, data: str):
         plot_state_event: schemas.paissa.PlotStateEntry = schemas.paissa.PlotStateEntry.parse_raw(data)
         world_id = plot_state_event.world_id
         district_id = plot_state_event.district_id
         ward_num = plot_state_event.ward_num
         plot_num = plot_state_event.plot_num
+        # only ward info (placard) events mean that the whole ward was seen
+        if key.startswith("event.wardinfo"):
+            self.freshness.touch(plotkey.encode(world_id, district_id, ward_num), plot_state_event.timestamp)
 
         # get the latest state of the plot
         for i, state in enumerate(
@@ -62,6 +206,7 @@ class Worker:
                 yield_per=1,
             )
         ):
+            self.heartbeats.apply(state)
             # if event's timestamp  > state's last_seen:
             if plot_state_event.timestamp > state.last_seen:
                 log.debug(f"Event {key} updates state {state.id} with new time")
@@ -91,6 +236,7 @@ class Worker:
         # if it matches, update last_seen and broadcast any applicable updates
         if not utils.should_create_new_state(plot_state_event, old_state):
             should_broadcast = utils.update_historical_state_from(old_state, plot_state_event)
+            self.heartbeats.hold(old_state)
             if should_broadcast and is_newest:
                 update = schemas.paissa.WSPlotUpdate(data=calc.plot_update(plot_state_event, old_state))
                 await self.broadcast(update)
@@ -107,6 +253,7 @@ class Worker:
                     )
                 else:
                     transition_detail = schemas.paissa.WSPlotSold(data=calc.sold_plot_detail(new_state, old_state))
+                    crud.record_plot_sale(self.db, new_state, old_state)
                 await self.broadcast(transition_detail)
             elif not new_state.is_owned:
                 update = schemas.paissa.WSPlotUpdate(data=calc.plot_update(plot_state_event, old_state))
@@ -140,6 +287,10 @@ async def run():
     """Primary entrypoint for a worker instance. Sets up the loop that processes anything in the event PQ."""
     worker = Worker()
     await worker.init()
+    asyncio.create_task(worker.freshness_task())
+    if worker.heartbeats.enabled:
+        asyncio.create_task(worker.heartbeat_task())
     log.info("Hello world, worker is listening...")
     await worker.main_loop()
     log.info("Worker is shutting down...")
+    await worker.heartbeats.flush()